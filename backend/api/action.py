@@ -1,14 +1,28 @@
 import jwt
 import base64
+import datetime
+import hashlib
+import uuid
+import logging
 from rest_framework import status
+from rest_framework.exceptions import NotFound
 from django.http import JsonResponse
+from django.core import signing
+from django.core.cache import cache
 from django.core.files.base import ContentFile
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 import time
 
 from core.settings import SECRET_KEY, ALGORITHM
 from .models import User
+from .principal import get_principal, aget_principal
+
+logger = logging.getLogger(__name__)
 
 
 class Pagination(PageNumberPagination):
@@ -24,17 +38,189 @@ class Pagination(PageNumberPagination):
     # Define the query parameter for specifying the current page in the request
     page_query_param = 'page'
     
+    # Define the query parameter that switches to keyset (cursor) pagination.
+    # Cursor mode skips the COUNT(*) and OFFSET scan of page mode: each page is a
+    # range scan starting after the last row of the previous one.
+    cursor_query_param = 'cursor'
+    
+    # Define the query parameter that asks cursor mode for an exact total
+    total_query_param = 'total'
+    
+    # Number of seconds an exact total is reused as an estimate in cursor mode
+    total_cache_timeout = 60
+    
+    cursor_salt = 'api.action.Pagination'
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        
+        return self.paginate_queryset_by_cursor(queryset, request)
+    
+    async def apaginate_queryset(self, queryset, request):
+        # Page mode for async views: same page numbers and errors as
+        # paginate_queryset, with the count and the rows read by the async ORM
+        self.request = request
+        self.cursor_mode = False
+        
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        # A cached property; set here, so the paginator never counts synchronously
+        paginator.count = await queryset.acount()
+        
+        page_number = self.get_page_number(request, paginator)
+        
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        
+        self.page.object_list = [row async for row in self.page.object_list]
+        
+        return self.page.object_list
+    
+    def paginate_queryset_by_cursor(self, queryset, request):
+        page_size = self.get_page_size(request)
+        ordering = self.get_cursor_ordering(queryset)
+        
+        self.total = self.get_total(queryset, request)
+        
+        cursor = request.query_params.get(self.cursor_query_param)
+        
+        if cursor:
+            try:
+                position = signing.loads(cursor, salt=self.cursor_salt)
+            except signing.BadSignature:
+                raise NotFound('Invalid cursor')
+            
+            if not isinstance(position, list) or len(position) != len(ordering):
+                raise NotFound('Invalid cursor')
+            
+            queryset = queryset.filter(self.get_cursor_filter(ordering, position))
+        
+        rows = list(queryset.order_by(*ordering)[:page_size + 1])
+        page, has_next = rows[:page_size], len(rows) > page_size
+        
+        self.next_cursor = self.encode_cursor(page[-1], ordering) if has_next else None
+        
+        return page
+    
+    def get_cursor_ordering(self, queryset):
+        # Keep the queryset ordering and break ties on the primary key, so every
+        # position in the result is unique and stable under concurrent inserts
+        ordering = [str(field) for field in queryset.query.order_by] or ['pk']
+        
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            ordering.append('pk')
+        
+        return ordering
+    
+    def get_cursor_filter(self, ordering, position):
+        # Expand the row comparison (a, b, c) > (x, y, z) into
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z),
+        # flipping the comparison for descending fields
+        condition = Q()
+        
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            
+            clause = Q(**{f'{name}__{lookup}': position[index]})
+            
+            for previous, value in zip(ordering[:index], position[:index]):
+                clause &= Q(**{previous.lstrip('-'): value})
+            
+            condition |= clause
+        
+        return condition
+    
+    def encode_cursor(self, instance, ordering):
+        position = []
+        
+        for field in ordering:
+            value = instance
+            
+            for attribute in field.lstrip('-').split('__'):
+                value = getattr(value, attribute)
+            
+            if isinstance(value, uuid.UUID):
+                value = str(value)
+            elif isinstance(value, (datetime.date, datetime.datetime)):
+                value = value.isoformat()
+            
+            position.append(value)
+        
+        return signing.dumps(position, salt=self.cursor_salt, compress=True)
+    
+    def get_total(self, queryset, request):
+        # Count only when asked to; otherwise reuse the last exact count of
+        # the same query as an estimate, or report no total at all. str(query)
+        # inlines the parameters unquoted, so two queries can print the same
+        sql, params = queryset.query.sql_with_params()
+        key = 'pagination-total:' + hashlib.sha1(repr((sql, params)).encode()).hexdigest()
+        
+        if request.query_params.get(self.total_query_param) in ('true', '1'):
+            total = queryset.count()
+            cache.set(key, total, self.total_cache_timeout)
+            return total
+        
+        return cache.get(key)
+    
     def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+    
+    def get_paginated_data(self, data):
+        if self.cursor_mode:
+            return {
+                'data': data,  # The data to paginate
+                'nextCursor': self.next_cursor,  # Opaque cursor of the next page, None on the last page
+                'totalElements': self.total,  # Exact or estimated number of items, None when unknown
+                'size': self.get_page_size(self.request),  # Size of the current page
+            }
+        
         # Customize the pagination response format
-        return Response({
+        return {
             'data': data,  # The data to paginate
             'totalPages': self.page.paginator.num_pages,  # Total number of pages
             'totalElements': self.page.paginator.count,  # Total number of items
             'size': self.get_page_size(self.request),  # Size of the current page
             'currentPage': self.page.number,  # Current page number
-        })
+        }
 
 
+def conditional_response(request, updated_at, *keys):
+    """Validate a conditional GET before the response body is built.
+
+    ``updated_at`` is when the rows rendered by the endpoint last changed and
+    ``keys`` tell apart representations sharing it (e.g. the row id). Returns
+    ``(not_modified, headers)``: a 304 response when the client's copy is
+    still current (``If-None-Match`` / ``If-Modified-Since``), otherwise None,
+    plus the ETag and Last-Modified headers to send with the full response.
+    """
+    accepted_renderer = getattr(request, 'accepted_renderer', None)
+    version = ':'.join([str(key) for key in keys] + [
+        accepted_renderer.format if accepted_renderer else '',
+        updated_at.isoformat(),
+    ])
+    last_modified = int(updated_at.timestamp())
+    
+    headers = {
+        'ETag': 'W/"%s"' % hashlib.sha1(version.encode()).hexdigest()[:24],
+        'Last-Modified': http_date(last_modified),
+        # Let browsers keep the body but revalidate it on every use
+        'Cache-Control': 'private, no-cache',
+    }
+    
+    not_modified = get_conditional_response(request, etag=headers['ETag'], last_modified=last_modified)
+    
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+    
+    return not_modified, headers
+
 def base64_file(data, name=None):
     _format, _img_str = data.split(';base64,')
     _name, ext = _format.split('/')
@@ -42,21 +228,32 @@ def base64_file(data, name=None):
         name = _name.split(":")[-1]
     return ContentFile(base64.b64decode(_img_str), name='{}.{}'.format(name, ext))
 
+def get_token(request):
+    # The token is read from the cookie first, then from a bearer Authorization header
+    token = request.COOKIES.get('__lunar_jwt')
+    
+    if not token:
+        authorization = request.headers.get('Authorization', '').split(' ')
+        token = authorization[1] if len(authorization) > 1 else None
+    
+    return token
+
 def auth_handler(view_func):
     def wrapper(request, *args, **kwargs):
-        token = request.COOKIES.get('__lunar_jwt') or request.headers.get('Authorization').split(' ')[1]
+        token = get_token(request)
         
         if not token:
             return JsonResponse(data={'message': 'Unauthenticated!'}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user = User.objects.get(email=payload['email'])
+            # Resolved from the per-process principal cache, a warm request does not touch the database
+            user = get_principal(payload['email']).to_user()
         except jwt.ExpiredSignatureError as e:
             return JsonResponse(data={'message': 'Token has expired!'}, status=status.HTTP_401_UNAUTHORIZED)
         except jwt.DecodeError as e:
-            # Print the specific exception message for debugging
-            print(f"JWT Decode Error: {e}")
+            # Log the specific exception message for debugging
+            logger.info('JWT decode error: %s', e)
             return JsonResponse(data={'message': 'Token is invalid!'}, status=status.HTTP_401_UNAUTHORIZED)
         except User.DoesNotExist as e:
             response = Response()
@@ -69,3 +266,30 @@ def auth_handler(view_func):
         return view_func(request, user=user, *args, **kwargs)
     
     return wrapper
+
+
+def async_auth_handler(view_func):
+    # Same contract as auth_handler for async views: the principal is read
+    # from the cache, or loaded with the async ORM on a miss
+    async def wrapper(request, *args, **kwargs):
+        token = get_token(request)
+        
+        if not token:
+            return JsonResponse(data={'message': 'Unauthenticated!'}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user = (await aget_principal(payload['email'])).to_user()
+        except jwt.ExpiredSignatureError as e:
+            return JsonResponse(data={'message': 'Token has expired!'}, status=status.HTTP_401_UNAUTHORIZED)
+        except jwt.DecodeError as e:
+            logger.info('JWT decode error: %s', e)
+            return JsonResponse(data={'message': 'Token is invalid!'}, status=status.HTTP_401_UNAUTHORIZED)
+        except User.DoesNotExist as e:
+            response = JsonResponse(data={'message': 'User does not exist!'}, status=status.HTTP_401_UNAUTHORIZED)
+            response.delete_cookie('__lunar_jwt')
+            return response
+        
+        return await view_func(request, user=user, *args, **kwargs)
+    
+    return wrapper
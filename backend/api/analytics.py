@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .models import Price, ProductPurchaseRequisition, PurchaseRequisition, SpendRollup
+
+
+# Statuses rolled up: a requisition can no longer leave them (see api.workflow),
+# so its lines and spend are final once it gets there. Its lines keep the price they
+# closed at, so a later price change leaves the rollups alone
+ROLLUP_STATUSES = ('COMPLETED', 'CANCELLED')
+
+# Counters of each rollup, added up by record_spend and taken back by remove_spend
+TOTALS = ('total_spend', 'line_count', 'requisition_count', 'unique_requisition_count')
+
+# Dimensions GET /api/analytics/spend can group by, mapped to SpendRollup paths
+DIMENSIONS = {
+    'project': 'project__code',
+    'vendor': 'vendor__code',
+    'month': 'month',
+    'status': 'status',
+}
+
+
+def spend_rows(purchase_requisitions):
+    """Aggregate the lines of ``purchase_requisitions`` at their closed_unit_price into SpendRollup field values, one dict per rollup key."""
+    lines = ProductPurchaseRequisition.objects.filter(purchase_requisition__in=purchase_requisitions)
+
+    # The requisition's vendor with the lowest id, whose bucket alone counts it in unique_requisition_count
+    first_vendor = ProductPurchaseRequisition.objects.filter(purchase_requisition=OuterRef('purchase_requisition')).order_by('vendor_id').values('vendor_id')[:1]
+
+    return lines.values(
+        'vendor_id',
+        legal_entity_id=F('purchase_requisition__legal_entity'),
+        project_id=F('purchase_requisition__project'),
+        month=TruncMonth('purchase_requisition__target_date'),
+        status=F('purchase_requisition__status'),
+    ).annotate(
+        total_spend=Coalesce(Sum(F('quantity') * F('closed_unit_price')), 0.0),
+        line_count=Count('pk'),
+        requisition_count=Count('purchase_requisition', distinct=True),
+        unique_requisition_count=Count('purchase_requisition', distinct=True, filter=Q(vendor_id=Subquery(first_vendor))),
+    ).order_by()
+
+
+def close_prices(purchase_requisitions):
+    # Copy each line's current vendor price to closed_unit_price in one UPDATE; unpriced lines keep NULL and add nothing
+    price = Price.objects.filter(product=OuterRef('product'), vendor=OuterRef('vendor')).values('price')[:1]
+
+    ProductPurchaseRequisition.objects.filter(purchase_requisition__in=purchase_requisitions).update(closed_unit_price=Subquery(price))
+
+
+def record_spend(*purchase_requisition_ids):
+    """Add requisitions that just reached a rolled up status to their rollups.
+
+    Call it in the transaction that moved the requisitions there, after the
+    status was claimed with a conditional UPDATE, so it runs once per
+    requisition. Their lines' prices are stored first, so removing or
+    rebuilding the rollups later sums the same amounts. Every bucket is
+    incremented with F(), which keeps concurrent recordings into the same
+    bucket from losing updates; requisitions sharing a bucket are added to it
+    in one increment.
+    """
+    purchase_requisitions = PurchaseRequisition.objects.filter(pk__in=purchase_requisition_ids, status__in=ROLLUP_STATUSES)
+
+    with transaction.atomic():
+        close_prices(purchase_requisitions)
+
+        for row in spend_rows(purchase_requisitions):
+            totals = {name: row.pop(name) for name in TOTALS}
+            rollup, _ = SpendRollup.objects.get_or_create(**row)
+
+            SpendRollup.objects.filter(pk=rollup.pk).update(**{name: F(name) + value for name, value in totals.items()})
+
+
+def remove_spend(*purchase_requisition_ids):
+    """Take rolled up requisitions that are being deleted back out of their rollups.
+
+    Call it before the requisitions' lines are deleted, in the deleting
+    transaction; api.signals does from pre_delete. Buckets left without
+    lines are deleted.
+    """
+    purchase_requisitions = PurchaseRequisition.objects.filter(pk__in=purchase_requisition_ids, status__in=ROLLUP_STATUSES)
+
+    with transaction.atomic():
+        for row in spend_rows(purchase_requisitions):
+            totals = {name: row.pop(name) for name in TOTALS}
+            rollups = SpendRollup.objects.filter(**row)
+
+            rollups.update(**{name: F(name) - value for name, value in totals.items()})
+            rollups.filter(line_count__lte=0).delete()
+
+
+def rebuild_spend_rollups(legal_entity=None):
+    """Recompute the rollups from the requisitions, for one legal entity or all of them; returns the number of rows written."""
+    purchase_requisitions = PurchaseRequisition.objects.filter(status__in=ROLLUP_STATUSES)
+    rollups = SpendRollup.objects.all()
+
+    if legal_entity is not None:
+        purchase_requisitions = purchase_requisitions.filter(legal_entity=legal_entity)
+        rollups = rollups.filter(legal_entity=legal_entity)
+
+    with transaction.atomic():
+        rollups.delete()
+
+        return len(SpendRollup.objects.bulk_create(
+            [SpendRollup(**row) for row in spend_rows(purchase_requisitions)],
+            batch_size=1000,
+        ))
+
+
+def spend_summary(legal_entity, group_by, filters):
+    """Answer a dashboard tile from the rollups with one grouped query over the legal entity's rows."""
+    rollups = SpendRollup.objects.filter(legal_entity=legal_entity, **filters)
+    paths = [DIMENSIONS[dimension] for dimension in group_by]
+
+    # A requisition is in one bucket per vendor it orders from. Within one vendor
+    # requisition_count is exact; across vendors only unique_requisition_count adds up
+    per_vendor = 'vendor' in group_by or any(name.startswith('vendor') for name in filters)
+
+    rows = rollups.values(*paths).annotate(
+        spend=Sum('total_spend'),
+        lines=Sum('line_count'),
+        requisitions=Sum('requisition_count' if per_vendor else 'unique_requisition_count'),
+    ).order_by(*paths)
+
+    # Months render as mm-YYYY, like the dd-mm-YYYY dates of the rest of the API
+    return [
+        dict(
+            {dimension: row[path].strftime('%m-%Y') if dimension == 'month' else row[path] for dimension, path in zip(group_by, paths)},
+            totalSpend=row['spend'],
+            lineCount=row['lines'],
+            requisitionCount=row['requisitions'],
+        )
+        for row in rows
+    ]
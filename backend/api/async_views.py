@@ -0,0 +1,240 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import views
+from .action import async_auth_handler, Pagination
+from .events import hub, format_event, entity_channel, requisition_channel
+from .search import search
+from .models import Price, PurchaseRequisition
+from .serializers import (
+    UserInfoSerializer,
+    ProductSerializer,
+    VendorSerializer,
+    PurchaseRequisitionSerializer,
+    CommentSerializer
+)
+
+# Async versions of the high-traffic GET endpoints, routed instead of the sync
+# views when settings.ASYNC_VIEWS is on (the default under SERVER_MODE=asgi).
+# Queries go through the async ORM, so a worker keeps serving other requests
+# while one waits on the database. Every relation a serializer touches is
+# loaded up front: a lazy query inside an async view raises
+# SynchronousOnlyOperation. Other methods and cursor pagination are handed to
+# the sync view, so each route keeps exactly one implementation of its writes.
+
+
+def csrf_exempt(view):
+    # Like the REST framework views they stand in for. Django's own decorator
+    # wraps the view in a sync function, which would hide that it is async.
+    view.csrf_exempt = True
+    return view
+
+
+def render(request, data, status=status.HTTP_200_OK):
+    # Render with the same JSON renderer as the REST framework views
+    started = time.perf_counter()
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    content = renderer.render(data)
+
+    request._render_time = getattr(request, '_render_time', 0.0) + time.perf_counter() - started
+
+    return HttpResponse(content, status=status, content_type=renderer.media_type)
+
+
+async def paginated_response(request, queryset, serializer_class):
+    # Pagination in page mode, the one async views serve
+    paginator = Pagination()
+
+    try:
+        rows = await paginator.apaginate_queryset(queryset, Request(request))
+    except NotFound as error:
+        return JsonResponse({'detail': str(error.detail)}, status=status.HTTP_404_NOT_FOUND)
+
+    return render(request, paginator.get_paginated_data(serializer_class(rows, many=True).data))
+
+
+def sync_fallback(request):
+    return request.method != 'GET' or Pagination.cursor_query_param in request.GET
+
+
+@async_auth_handler
+async def get_user(request, user):
+    try:
+        return render(request, UserInfoSerializer(user).data)
+    except:
+        return JsonResponse({"message": "An error has occured while retrieving user info"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_auth_handler
+async def list_products(request, user):
+    legal_entity = user.legal_entity
+    search_query = request.GET.get('search')
+
+    if search_query:
+        products = search(legal_entity.products.all(), search_query, ordering=('name',))
+    else:
+        products = legal_entity.products.all().order_by('id')
+
+    products = products.prefetch_related(Prefetch('prices', queryset=Price.objects.select_related('vendor')))
+
+    return await paginated_response(request, products, ProductSerializer)
+
+
+@async_auth_handler
+async def list_vendors(request, user):
+    legal_entity = user.legal_entity
+    search_query = request.GET.get('search')
+
+    if search_query:
+        vendors = search(legal_entity.vendors.all(), search_query, ordering=('id',))
+    else:
+        vendors = legal_entity.vendors.all().order_by('id')
+
+    return await paginated_response(request, vendors.prefetch_related('contacts'), VendorSerializer)
+
+
+@async_auth_handler
+async def list_purchase_requisitions(request, user):
+    legal_entity = user.legal_entity
+    search_query = request.GET.get('search')
+
+    if search_query:
+        purchase_requisitions = search(legal_entity.purchase_requisitions.all(), search_query, ordering=('name',))
+    else:
+        purchase_requisitions = legal_entity.purchase_requisitions.all().order_by('id')
+
+    return await paginated_response(request, purchase_requisitions.with_details(), PurchaseRequisitionSerializer)
+
+
+@async_auth_handler
+async def list_comments(request, user, purchase_requisition_id):
+    legal_entity = user.legal_entity
+
+    try:
+        purchase_requisition = await legal_entity.purchase_requisitions.aget(id=purchase_requisition_id)
+    except PurchaseRequisition.DoesNotExist:
+        return JsonResponse({"message": "Purchase Requisition not found"}, status=status.HTTP_404_NOT_FOUND)
+    except:
+        return JsonResponse({"message": "An error has occured while retrieving Purchase Requisition info"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    comments = purchase_requisition.comments.select_related('user').order_by('-created_at')
+
+    return await paginated_response(request, comments, CommentSerializer)
+
+
+async def event_stream(channels):
+    # Server-Sent Events of api.events. The stream ends after
+    # EVENTS_STREAM_TIMEOUT seconds and the browser's EventSource reconnects:
+    # Django 4.2 does not notice a client that went away mid-stream, so this
+    # bounds how long an abandoned subscription lives.
+    subscription = hub.subscribe(channels)
+    deadline = time.monotonic() + settings.EVENTS_STREAM_TIMEOUT
+
+    try:
+        yield b'retry: 3000\n\n'
+
+        while True:
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                break
+
+            try:
+                event = await asyncio.wait_for(subscription.get(), timeout=min(settings.EVENTS_KEEPALIVE, remaining))
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection
+                if time.monotonic() < deadline:
+                    yield b': keepalive\n\n'
+
+                continue
+
+            if event is None:
+                break
+
+            yield format_event(event)
+    finally:
+        subscription.close()
+
+
+def event_response(channels):
+    response = StreamingHttpResponse(event_stream(channels), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+
+    return response
+
+
+@csrf_exempt
+@async_auth_handler
+async def entity_events(request, user):
+    # Every requisition event of the user's legal entity
+    return event_response([entity_channel(user.legal_entity_id)])
+
+
+@csrf_exempt
+@async_auth_handler
+async def purchase_requisition_events(request, user, purchase_requisition_id):
+    legal_entity = user.legal_entity
+
+    try:
+        exists = await legal_entity.purchase_requisitions.filter(id=purchase_requisition_id).aexists()
+    except ValidationError:
+        exists = False
+
+    if not exists:
+        return JsonResponse({"message": "Purchase Requisition not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    return event_response([requisition_channel(purchase_requisition_id)])
+
+
+# Route entry points: GET requests in page mode are served asynchronously,
+# everything else by the sync view
+
+@csrf_exempt
+async def account(request):
+    if request.method != 'GET':
+        return await sync_to_async(views.get_user)(request)
+
+    return await get_user(request)
+
+
+@csrf_exempt
+async def product(request):
+    if sync_fallback(request):
+        return await sync_to_async(views.create_and_list_product)(request)
+
+    return await list_products(request)
+
+
+@csrf_exempt
+async def vendor(request):
+    if sync_fallback(request):
+        return await sync_to_async(views.create_and_list_vendor)(request)
+
+    return await list_vendors(request)
+
+
+@csrf_exempt
+async def purchase_requisition(request):
+    if sync_fallback(request):
+        return await sync_to_async(views.create_and_list_purchase_requisition)(request)
+
+    return await list_purchase_requisitions(request)
+
+
+@csrf_exempt
+async def purchase_requisition_comment(request, purchase_requisition_id):
+    if sync_fallback(request):
+        return await sync_to_async(views.post_and_list_comment_purchase_requisition)(request, purchase_requisition_id=purchase_requisition_id)
+
+    return await list_comments(request, purchase_requisition_id=purchase_requisition_id)
@@ -0,0 +1,106 @@
+import uuid
+
+from django.db import transaction
+
+from .workflow import check, apply_transitions, Change, InvalidTransition, STATUSES, APPROVE, REJECT
+
+
+# Items accepted per request
+MAX_BATCH_SIZE = 500
+
+ACTIONS = (APPROVE, REJECT, 'set-status')
+
+SUCCESS_MESSAGES = {
+    APPROVE: 'Successfully approved purchase requisition',
+    REJECT: 'Successfully rejected purchase requisition',
+    'set-status': 'Successfully updated purchase requisition status',
+}
+
+
+class RequisitionBatch:
+    # Applies a list of approve, reject and set-status actions to the
+    # requisitions of one legal entity. Every item is checked against the
+    # transition table of api.workflow in memory, then the valid ones are
+    # applied together by api.workflow.apply_transitions. An item that fails
+    # its checks is reported and skipped; the others still apply.
+
+    def __init__(self, legal_entity, user=None):
+        self.legal_entity = legal_entity
+        self.user = user
+        self.results = []
+
+    def run(self, items):
+        """Apply ``items`` and return one ``{id, action, success, message}`` result per item, in order."""
+        self.results = [self.result(item) for item in items]
+
+        checked = self.check_items(items)
+
+        with transaction.atomic():
+            # Lock the rows so their status cannot change between the checks and the UPDATEs
+            purchase_requisitions = self.legal_entity.purchase_requisitions.select_for_update().order_by('pk').in_bulk([pk for pk, _ in checked.values()])
+
+            changes = {}
+
+            for index, (pk, item) in checked.items():
+                purchase_requisition = purchase_requisitions.get(pk)
+
+                if purchase_requisition is None:
+                    self.fail(index, 'Purchase Requisition not found')
+                    continue
+
+                action = item['status'] if item['action'] == 'set-status' else item['action']
+
+                try:
+                    changes[index] = Change(purchase_requisition, check(purchase_requisition, action), item.get('comment'))
+                except InvalidTransition as error:
+                    self.fail(index, error.message)
+
+            apply_transitions(list(changes.values()), self.user)
+
+        for index, change in changes.items():
+            if isinstance(change.refusal, InvalidTransition):
+                self.fail(index, change.refusal.message)
+            elif change.refusal is not None:
+                self.fail(index, "Purchase Requisition exceeds project's purchase allowance")
+            else:
+                self.results[index].update(success=True, message=SUCCESS_MESSAGES[self.results[index]['action']])
+
+        return self.results
+
+    def result(self, item):
+        item = item if isinstance(item, dict) else {}
+
+        return {'id': item.get('id'), 'action': item.get('action'), 'success': False, 'message': None}
+
+    def fail(self, index, message):
+        self.results[index]['message'] = message
+
+    def check_items(self, items):
+        # Returns {index: (pk, item)} of the items whose shape is valid
+        checked = {}
+        seen = set()
+
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                self.fail(index, 'Item must be an object')
+                continue
+
+            try:
+                pk = uuid.UUID(str(item.get('id')))
+            except ValueError:
+                self.fail(index, 'Purchase Requisition not found')
+                continue
+
+            if item.get('action') not in ACTIONS:
+                self.fail(index, 'Action must be one of ' + ', '.join(ACTIONS))
+            elif item['action'] == REJECT and not item.get('comment'):
+                self.fail(index, 'Comment is required')
+            elif item['action'] == 'set-status' and item.get('status') not in STATUSES:
+                self.fail(index, f'"{item.get("status")}" is not a valid choice.')
+            elif pk in seen:
+                self.fail(index, 'Purchase Requisition is listed more than once')
+            else:
+                seen.add(pk)
+                checked[index] = (pk, item)
+
+        return checked
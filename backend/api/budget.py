@@ -0,0 +1,26 @@
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Project
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def charge(project_id, amount, count=1):
+    """Add ``amount`` to a project's spend if it stays within its allowance.
+
+    The check and the increment are one conditional UPDATE, so concurrent
+    charges against the same project are serialized by the row lock and can
+    neither lose an increment nor overspend. Returns False when the allowance
+    would be exceeded, in which case nothing is written.
+    """
+    return Project.objects.filter(
+        pk=project_id,
+        current_purchase__lte=F('purchase_allowance') - amount,
+    ).update(
+        current_purchase=F('current_purchase') + amount,
+        purchase_count=F('purchase_count') + count,
+        updated_at=timezone.now(),
+    ) == 1
@@ -0,0 +1,314 @@
+import csv
+import io
+import math
+from itertools import islice
+
+import orjson
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, Vendor, Price, PurchaseRequisition
+from .pricing import invalidate_price_matrix
+
+
+# Rows validated and written per transaction
+CHUNK_SIZE = 2000
+
+# Errors listed in the report; the count covers all of them
+MAX_REPORTED_ERRORS = 1000
+
+# File columns of each row type, mapped to model fields. Column names follow
+# the JSON fields of the product, vendor and add-price endpoints; every row
+# has a `type` column of product, vendor or price.
+PRODUCT_COLUMNS = {
+    'code': 'code',
+    'name': 'name',
+    'description': 'description',
+    'SKU': 'SKU',
+    'brand': 'brand',
+    'category': 'category',
+    'weight': 'weight',
+    'width': 'width',
+    'height': 'height',
+    'length': 'length',
+    'color': 'color',
+    'material': 'material',
+}
+
+VENDOR_COLUMNS = {
+    'code': 'code',
+    'businessName': 'name',
+    'businessNumber': 'business_num',
+    'description': 'description',
+}
+
+# Columns that may be left empty
+OPTIONAL_COLUMNS = {'description'}
+
+# Upload file extensions and content types, mapped to the reader format
+FORMATS = {
+    'csv': 'csv',
+    'text/csv': 'csv',
+    'ndjson': 'ndjson',
+    'jsonl': 'ndjson',
+    'application/x-ndjson': 'ndjson',
+}
+
+
+def read_rows(file, file_format):
+    """Yield ``(row_number, row)`` pairs from an uploaded CSV or NDJSON file, one line at a time.
+
+    ``row`` is None for an NDJSON line that is not a JSON object.
+    """
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+
+    if file_format == 'csv':
+        for number, row in enumerate(csv.DictReader(text), start=1):
+            yield number, row
+
+        return
+
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            row = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            row = None
+
+        yield number, row if isinstance(row, dict) else None
+
+
+def clean_fields(row, columns, model):
+    # Returns (model field values, errors) for the columns of one row
+    values = {}
+    errors = {}
+
+    for column, name in columns.items():
+        value = row.get(column)
+        value = '' if value is None else str(value).strip()
+        field = model._meta.get_field(name)
+
+        if not value and column not in OPTIONAL_COLUMNS:
+            errors[column] = ['This field is required.']
+        elif field.max_length and len(value) > field.max_length:
+            errors[column] = [f'Ensure this field has no more than {field.max_length} characters.']
+        else:
+            values[name] = value
+
+    return values, errors
+
+
+class CatalogImport:
+    # Upserts the products, vendors and prices of one legal entity from an
+    # iterable of file rows. Rows are validated and written CHUNK_SIZE at a
+    # time, each chunk in its own transaction with one bulk upsert per model,
+    # so a 100k row file costs a few hundred queries. A price may refer to a
+    # product or vendor defined earlier in the file or already in the catalog.
+
+    def __init__(self, legal_entity, chunk_size=CHUNK_SIZE):
+        self.legal_entity = legal_entity
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.imported = {'products': 0, 'vendors': 0, 'prices': 0}
+        self.errors = []
+        self.error_count = 0
+
+    def run(self, rows):
+        rows = iter(rows)
+
+        while True:
+            try:
+                chunk = list(islice(rows, self.chunk_size))
+            except (UnicodeDecodeError, csv.Error):
+                # Chunks before the unreadable line stay imported
+                self.error(self.rows + 1, {'file': ['File must be UTF-8 encoded CSV or NDJSON.']})
+                break
+
+            if not chunk:
+                break
+
+            self.rows += len(chunk)
+            self.import_chunk(chunk)
+
+        return self.report()
+
+    def report(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'errorCount': self.error_count,
+            'errors': sorted(self.errors, key=lambda error: error['row']),
+        }
+
+    def error(self, number, errors):
+        self.error_count += 1
+
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def import_chunk(self, chunk):
+        products, vendors, prices = {}, {}, []
+
+        for number, row in chunk:
+            kind = row.get('type') if row is not None else None
+
+            if row is None:
+                self.error(number, {'row': ['Invalid JSON object.']})
+            elif kind == 'product':
+                self.collect(number, row, PRODUCT_COLUMNS, Product, products)
+            elif kind == 'vendor':
+                self.collect(number, row, VENDOR_COLUMNS, Vendor, vendors)
+            elif kind == 'price':
+                self.collect_price(number, row, prices)
+            else:
+                self.error(number, {'type': ['Must be one of product, vendor, price.']})
+
+        with transaction.atomic():
+            product_ids = self.upsert(Product, products, PRODUCT_COLUMNS)
+            vendor_ids = self.upsert(Vendor, vendors, VENDOR_COLUMNS)
+            self.upsert_prices(prices, product_ids, vendor_ids)
+
+    def collect(self, number, row, columns, model, rows):
+        values, errors = clean_fields(row, columns, model)
+
+        if not errors and values['code'] in rows:
+            errors['code'] = [f"Duplicate code, also on row {rows[values['code']][0]}."]
+
+        if errors:
+            self.error(number, errors)
+        else:
+            rows[values['code']] = (number, values)
+
+    def collect_price(self, number, row, prices):
+        errors = {}
+        product_code = str(row.get('productCode') or '').strip()
+        vendor_code = str(row.get('vendorCode') or '').strip()
+
+        if not product_code:
+            errors['productCode'] = ['This field is required.']
+
+        if not vendor_code:
+            errors['vendorCode'] = ['This field is required.']
+
+        try:
+            price = float(row.get('price'))
+        except (TypeError, ValueError):
+            price = None
+
+        # float() also accepts "nan" and "inf"
+        if price is None or not math.isfinite(price):
+            errors['price'] = ['A valid number is required.']
+
+        if errors:
+            self.error(number, errors)
+        else:
+            prices.append((number, product_code, vendor_code, price))
+
+    def upsert(self, model, rows, columns):
+        """Upsert the rows of one model on code; returns the ``{code: id}`` of every row written."""
+        if not rows:
+            return {}
+
+        # Codes are unique across tenants; never take over another entity's row.
+        # Rows of this entity are locked, so none of them changes hands before it
+        # is updated; new codes are inserted without overwriting a row another
+        # entity created meanwhile, which is then reported like the others
+        existing = self.lock_codes(model, rows)
+        ids = {code: pk for code, (legal_entity_id, pk) in existing.items() if legal_entity_id == self.legal_entity.pk}
+        new = [code for code in rows if code not in existing]
+        updated = list(ids.values())
+
+        if ids:
+            model.objects.bulk_create(
+                [model(legal_entity_id=self.legal_entity.pk, **rows[code][1]) for code in ids],
+                update_conflicts=True,
+                unique_fields=['code'],
+                update_fields=[name for name in columns.values() if name != 'code'] + ['updated_at'],
+            )
+
+        if new:
+            model.objects.bulk_create([model(legal_entity_id=self.legal_entity.pk, **rows[code][1]) for code in new], ignore_conflicts=True)
+            # Skipped rows are not given their id
+            ids.update(model.objects.filter(code__in=new, legal_entity=self.legal_entity).values_list('code', 'id'))
+
+        for code in [code for code in rows if code not in ids]:
+            number, _ = rows.pop(code)
+            self.error(number, {'code': ['Code is already used by another legal entity.']})
+
+        self.imported['products' if model is Product else 'vendors'] += len(rows)
+
+        if model is Vendor and updated:
+            self.touch_vendor_rows(updated)
+
+        return ids
+
+    def lock_codes(self, model, codes):
+        # Returns {code: (legal_entity_id, id)} of the rows already using the codes, locked until commit
+        return {
+            code: (legal_entity_id, pk)
+            for code, legal_entity_id, pk in model.objects.select_for_update().filter(code__in=codes).values_list('code', 'legal_entity_id', 'id')
+        }
+
+    def touch_vendor_rows(self, vendor_ids):
+        # bulk_create sends no signals: bump what api.signals.touch_vendor_rows would have
+        now = timezone.now()
+
+        Product.objects.filter(prices__vendor__in=vendor_ids).update(updated_at=now)
+        PurchaseRequisition.objects.filter(product_purchase_requisitions__vendor__in=vendor_ids).update(updated_at=now)
+
+    def upsert_prices(self, prices, product_ids, vendor_ids):
+        if not prices:
+            return
+
+        # Products and vendors of earlier chunks or already in the catalog
+        missing_products = {product_code for _, product_code, _, _ in prices} - set(product_ids)
+        missing_vendors = {vendor_code for _, _, vendor_code, _ in prices} - set(vendor_ids)
+
+        if missing_products:
+            product_ids = dict(product_ids, **dict(self.legal_entity.products.filter(code__in=missing_products).values_list('code', 'id')))
+
+        if missing_vendors:
+            vendor_ids = dict(vendor_ids, **dict(self.legal_entity.vendors.filter(code__in=missing_vendors).values_list('code', 'id')))
+
+        rows = {}
+
+        for number, product_code, vendor_code, price in prices:
+            errors = {}
+
+            if product_code not in product_ids:
+                errors['productCode'] = ['Product not found.']
+
+            if vendor_code not in vendor_ids:
+                errors['vendorCode'] = ['Vendor not found.']
+
+            key = (product_ids.get(product_code), vendor_ids.get(vendor_code))
+
+            if not errors and key in rows:
+                errors['productCode'] = [f'Duplicate price, also on row {rows[key][0]}.']
+
+            if errors:
+                self.error(number, errors)
+            else:
+                rows[key] = (number, price)
+
+        if not rows:
+            return
+
+        Price.objects.bulk_create(
+            [Price(product_id=product_id, vendor_id=vendor_id, price=price) for (product_id, vendor_id), (_, price) in rows.items()],
+            update_conflicts=True,
+            unique_fields=['product', 'vendor'],
+            update_fields=['price'],
+        )
+
+        self.imported['prices'] += len(rows)
+        invalidate_price_matrix(self.legal_entity.pk)
+
+        # bulk_create sends no signals: bump what api.signals would have for changed prices
+        changed_products = {product_id for product_id, _ in rows}
+        now = timezone.now()
+
+        Product.objects.filter(pk__in=changed_products).update(updated_at=now)
+        PurchaseRequisition.objects.filter(product_purchase_requisitions__product__in=changed_products).update(updated_at=now)
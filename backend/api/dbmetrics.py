@@ -0,0 +1,70 @@
+import threading
+
+from django.core.signals import request_started, request_finished
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+class ConnectionMetrics:
+    # Per-process counters describing how database connections are reused.
+    # With CONN_MAX_AGE > 0 every worker thread keeps its connection open across
+    # requests, so `created` should stay flat while `reused` grows. Under ASGI
+    # CONN_MAX_AGE is forced to 0 (see core.settings) and every request opens
+    # and closes its own connection.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.closed = 0
+        self.requests = 0
+
+    def increment(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'created': self.created,  # Connections opened by this process
+                'reused': self.reused,  # Requests that started on an already open connection
+                'closed': self.closed,  # Connections closed at the end of a request (expired or unhealthy)
+                'open': self.created - self.closed,  # Connections currently held by this process
+                'requests': self.requests,  # Requests served since the process started
+            }
+
+
+metrics = ConnectionMetrics()
+
+# Aliases whose connection the current thread used during its request
+_local = threading.local()
+
+
+@receiver(connection_created)
+def count_created(sender, connection, **kwargs):
+    metrics.increment('created')
+
+    if hasattr(_local, 'used'):
+        _local.used.add(connection.alias)
+
+
+@receiver(request_started)
+def count_checkout(sender, **kwargs):
+    _local.used = {alias for alias in connections if connections[alias].connection is not None}
+
+    if _local.used:
+        metrics.increment('reused')
+
+    metrics.increment('requests')
+
+
+@receiver(request_finished)
+def count_checkin(sender, **kwargs):
+    # Django closes expired and unusable connections in its own request_finished
+    # handler, which is connected before this one
+    for alias in getattr(_local, 'used', ()):
+        if connections[alias].connection is None:
+            metrics.increment('closed')
+
+    _local.used = set()
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import orjson
+from django.conf import settings
+from django.db import connections, transaction
+
+from .renderers import ORJSONRenderer
+
+
+logger = logging.getLogger(__name__)
+
+# Longest NOTIFY payload PostgreSQL accepts is 8000 bytes
+MAX_NOTIFY_PAYLOAD = 7900
+
+
+def requisition_channel(purchase_requisition_id):
+    return f'requisition:{purchase_requisition_id}'
+
+
+def entity_channel(legal_entity_id):
+    return f'entity:{legal_entity_id}'
+
+
+class Subscription:
+    # Events of a set of channels, queued for one open stream. A subscriber
+    # that falls more than `maxsize` events behind is closed rather than
+    # buffered without bound; its client reconnects and refetches.
+
+    def __init__(self, hub, channels, maxsize):
+        self.hub = hub
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def deliver(self, event):
+        # Called from any thread
+        try:
+            self.loop.call_soon_threadsafe(self.put, event)
+        except RuntimeError:
+            # The stream's event loop is gone
+            self.hub.unsubscribe(self)
+
+    def put(self, event):
+        if self.closed:
+            return
+
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.close()
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self):
+        """Next event, or None once the subscription was closed for falling behind."""
+        return await self.queue.get()
+
+    def close(self):
+        self.closed = True
+        self.hub.unsubscribe(self)
+
+
+class LocalBackend:
+    # Delivers events to the subscribers of this process only. Enough for a
+    # single worker; with several, a stream only sees the writes its own
+    # worker handled.
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, event):
+        self.hub.dispatch(event)
+
+    def start(self):
+        pass
+
+
+class PostgresBackend:
+    # Fans events out to every worker through PostgreSQL LISTEN/NOTIFY. Each
+    # process that has subscribers keeps one extra connection listening on
+    # `channel`, in a daemon thread that hands notifications to the hub.
+
+    channel = 'api_events'
+
+    def __init__(self, hub, alias='default'):
+        self.hub = hub
+        self.alias = alias
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        payload = ORJSONRenderer().render(event)
+
+        if len(payload) > MAX_NOTIFY_PAYLOAD:
+            # Too large to notify; subscribers refetch what changed
+            payload = ORJSONRenderer().render(dict(event, data={'truncated': True}))
+
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload.decode()])
+
+    def start(self):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name='api-events-listener', daemon=True)
+                self.listener.start()
+
+    def listen(self):
+        while True:
+            connection = connections.create_connection(self.alias)
+
+            try:
+                connection.ensure_connection()
+                connection.set_autocommit(True)
+
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+
+                # psycopg 3 yields notifications as they arrive
+                for notify in connection.connection.notifies():
+                    self.hub.dispatch(orjson.loads(notify.payload))
+            except Exception:
+                logger.exception('Event listener lost its connection, reconnecting')
+                time.sleep(1)
+            finally:
+                connection.close()
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'postgres': PostgresBackend,
+}
+
+
+class EventHub:
+    # In-process pub/sub between the views that change requisitions and the
+    # SSE streams of api.async_views. Events are published to the backend,
+    # which hands them back to `dispatch` in every process with subscribers.
+    # An event carries the channels it is routed to.
+
+    def __init__(self, backend='local', queue_size=100):
+        self.backend = BACKENDS[backend](self)
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, channels, event_type, data):
+        event = {'type': event_type, 'channels': channels, 'data': data}
+
+        try:
+            self.backend.publish(event)
+        except Exception:
+            # A missed event only delays a client until it refetches
+            logger.exception('Could not publish %s', event_type)
+
+    def publish_on_commit(self, channels, event_type, data):
+        transaction.on_commit(lambda: self.publish(channels, event_type, data))
+
+    def subscribe(self, channels):
+        """Return a Subscription to ``channels``; call from the event loop of the stream."""
+        self.backend.start()
+        subscription = Subscription(self, channels, self.queue_size)
+
+        with self.lock:
+            for channel in channels:
+                self.subscribers[channel].add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscribers[channel].discard(subscription)
+
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+    def dispatch(self, event):
+        with self.lock:
+            subscriptions = {subscription for channel in event['channels'] for subscription in self.subscribers.get(channel, ())}
+
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+
+hub = EventHub(
+    backend=getattr(settings, 'EVENTS_BACKEND', 'local'),
+    queue_size=getattr(settings, 'EVENTS_QUEUE_SIZE', 100),
+)
+
+
+def format_event(event):
+    # One Server-Sent Events message; the payload renders like the REST responses
+    return b'event: ' + event['type'].encode() + b'\ndata: ' + ORJSONRenderer().render(event['data']) + b'\n\n'
+
+
+def publish_requisition_event(purchase_requisition, event_type, data):
+    """Publish an event about a requisition to its stream and its legal entity's, once the transaction commits."""
+    channels = [requisition_channel(purchase_requisition.pk), entity_channel(purchase_requisition.legal_entity_id)]
+
+    hub.publish_on_commit(channels, event_type, dict(data, purchaseRequisitionId=str(purchase_requisition.pk)))
+
+
+def publish_status(purchase_requisition):
+    # Approvals, rejections and every other status change
+    publish_requisition_event(purchase_requisition, 'requisition.status', {
+        'status': purchase_requisition.status,
+        'isApproved': purchase_requisition.is_approved,
+        'isRejected': purchase_requisition.is_rejected,
+        'rejectedComment': purchase_requisition.rejected_comment,
+    })
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Product, Vendor
+from api.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Generate missing product and vendor thumbnails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate thumbnails that already exist')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        for model in (Product, Vendor):
+            queryset = model.objects.exclude(image='').exclude(image__isnull=True)
+
+            if not options['all']:
+                queryset = queryset.filter(thumbnails={})
+
+            generated = failed = 0
+
+            for instance in queryset.only('id', 'image', 'thumbnails').iterator(chunk_size=options['chunk_size']):
+                try:
+                    generate_thumbnails(instance)
+                    generated += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{model.__name__} {instance.pk}: {e}')
+
+            self.stdout.write(f'{model.__name__}: generated {generated}, failed {failed}')
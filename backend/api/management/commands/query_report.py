@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+from api.models import EndpointQueryStats
+
+
+ORDERINGS = {
+    'queries': 'avg_queries',
+    'duplicates': 'avg_duplicates',
+    'sql': 'avg_sql_time',
+    'total': 'avg_total_time',
+    'requests': 'requests',
+}
+
+
+class Command(BaseCommand):
+    help = 'List the endpoints issuing the most queries, as recorded by QueryInstrumentationMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='Number of endpoints to list')
+        parser.add_argument('--order-by', choices=list(ORDERINGS), default='queries', help='Per-request average to rank by')
+        parser.add_argument('--reset', action='store_true', help='Delete the recorded statistics after printing them')
+
+    def handle(self, *args, **options):
+        requests = Cast(F('requests'), FloatField())
+
+        stats = EndpointQueryStats.objects.filter(requests__gt=0).annotate(
+            avg_queries=F('queries') / requests,
+            avg_duplicates=F('duplicate_queries') / requests,
+            avg_sql_time=F('sql_time') / requests,
+            avg_render_time=F('render_time') / requests,
+            avg_total_time=F('total_time') / requests,
+        ).order_by(f"-{ORDERINGS[options['order_by']]}")[:options['top']]
+
+        self.stdout.write(
+            f"{'endpoint':<70}{'reqs':>8}{'queries':>9}{'max':>6}{'dups':>7}{'sql ms':>9}{'render ms':>11}{'total ms':>10}"
+        )
+
+        for row in stats:
+            self.stdout.write(
+                f"{(row.method + ' /' + row.route)[:69]:<70}{row.requests:>8}{row.avg_queries:>9.1f}{row.max_queries:>6}"
+                f"{row.avg_duplicates:>7.1f}{row.avg_sql_time:>9.1f}{row.avg_render_time:>11.1f}{row.avg_total_time:>10.1f}"
+            )
+
+            if row.top_duplicate:
+                self.stdout.write(f'    most repeated: {row.top_duplicate[:160]}')
+
+        if options['reset']:
+            EndpointQueryStats.objects.all().delete()
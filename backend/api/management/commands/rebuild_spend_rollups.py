@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.analytics import rebuild_spend_rollups
+from api.models import LegalEntity
+
+
+class Command(BaseCommand):
+    help = 'Recompute the spend rollups served by GET /api/analytics/spend from the completed and cancelled requisitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--legal-entity', help='Only rebuild the rollups of this legal entity code')
+
+    def handle(self, *args, **options):
+        legal_entity = None
+
+        if options['legal_entity']:
+            try:
+                legal_entity = LegalEntity.objects.get(legal_entity_code=options['legal_entity'])
+            except LegalEntity.DoesNotExist:
+                raise CommandError(f"Legal entity {options['legal_entity']} does not exist")
+
+        rows = rebuild_spend_rollups(legal_entity)
+
+        self.stdout.write(f'Wrote {rows} spend rollups')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.models import PurchaseRequisition
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored comment_count and line_count of purchase requisitions from their comments and lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--legal-entity', help='Only repair the requisitions of this legal entity code')
+
+    def handle(self, *args, **options):
+        purchase_requisitions = PurchaseRequisition.objects.all()
+
+        if options['legal_entity']:
+            purchase_requisitions = purchase_requisitions.filter(legal_entity__legal_entity_code=options['legal_entity'])
+
+        # One UPDATE over the requisitions whose counters drifted
+        repaired = purchase_requisitions.recount()
+
+        self.stdout.write(f'Repaired {repaired} purchase requisitions')
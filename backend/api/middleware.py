@@ -0,0 +1,216 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections, IntegrityError
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import EndpointQueryStats
+
+
+logger = logging.getLogger(__name__)
+
+class QueryRecorder:
+    # Database execute wrapper counting the queries of one request, their total
+    # time and how often each statement (SQL with placeholders, before parameters
+    # are bound) repeats. Repeated statements are the signature of an N+1.
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    @property
+    def top_duplicate(self):
+        if not self.statements:
+            return None
+
+        sql, count = self.statements.most_common(1)[0]
+        return sql if count > 1 else None
+
+
+class EndpointStatsBuffer:
+    # Per-process aggregates keyed by (route, method), added to the
+    # EndpointQueryStats table every QUERY_STATS_FLUSH_INTERVAL seconds so
+    # `manage.py query_report` can see every worker. The writes happen on a
+    # daemon thread of their own, never inside a request, so they do not show
+    # up in any request's query count or latency.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._flusher = None
+
+    def add(self, route, method, recorder, render_time, total_time):
+        with self._lock:
+            stats = self._stats.setdefault((route, method), {
+                'requests': 0,
+                'queries': 0,
+                'duplicate_queries': 0,
+                'max_queries': 0,
+                'sql_time': 0.0,
+                'render_time': 0.0,
+                'total_time': 0.0,
+                'top_duplicate': None,
+            })
+
+            stats['requests'] += 1
+            stats['queries'] += recorder.count
+            stats['duplicate_queries'] += recorder.duplicates
+            stats['max_queries'] = max(stats['max_queries'], recorder.count)
+            stats['sql_time'] += recorder.duration * 1000
+            stats['render_time'] += render_time * 1000
+            stats['total_time'] += total_time * 1000
+            stats['top_duplicate'] = recorder.top_duplicate or stats['top_duplicate']
+
+            # Started by the first request of the worker, after the server forked it
+            if self._flusher is None and settings.QUERY_STATS_FLUSH_INTERVAL > 0:
+                self._flusher = threading.Thread(target=self.run, name='query-stats-flusher', daemon=True)
+                self._flusher.start()
+
+    def run(self):
+        while True:
+            time.sleep(max(settings.QUERY_STATS_FLUSH_INTERVAL, 1))
+
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not flush query statistics')
+            finally:
+                # The thread's connection would otherwise stay open between flushes
+                connections.close_all()
+
+    def flush(self):
+        with self._lock:
+            pending, self._stats = self._stats, {}
+
+        for (route, method), stats in pending.items():
+            top_duplicate = stats.pop('top_duplicate')
+            max_queries = stats.pop('max_queries')
+
+            changes = {name: F(name) + value for name, value in stats.items()}
+            changes['max_queries'] = Greatest(F('max_queries'), max_queries)
+
+            if top_duplicate:
+                changes['top_duplicate'] = top_duplicate
+
+            updated = EndpointQueryStats.objects.filter(route=route, method=method).update(**changes)
+
+            if not updated:
+                try:
+                    EndpointQueryStats.objects.create(route=route, method=method, max_queries=max_queries, top_duplicate=top_duplicate, **stats)
+                except IntegrityError:
+                    # Another worker created the row first
+                    EndpointQueryStats.objects.filter(route=route, method=method).update(**changes)
+
+
+buffer = EndpointStatsBuffer()
+
+
+class QueryInstrumentationMiddleware:
+    # Records the query count, SQL time, duplicate statements and render
+    # (serialization) time of every request. They are reported to the client in
+    # a Server-Timing header and aggregated per URL pattern. Async-capable, so
+    # async views are not pushed back onto a thread by this middleware.
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not settings.QUERY_INSTRUMENTATION:
+            return self.get_response(request)
+
+        recorder, started = self.start(request)
+
+        with self.instrument(recorder):
+            response = self.get_response(request)
+
+        self.finish(request, response, recorder, started)
+
+        return response
+
+    async def __acall__(self, request):
+        if not settings.QUERY_INSTRUMENTATION:
+            return await self.get_response(request)
+
+        recorder, started = self.start(request)
+
+        # Database connections are thread-bound. Queries of an async request run
+        # on its thread-sensitive sync thread, so wrap the connections there
+        instrumentation = await sync_to_async(self.instrument)(recorder)
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(instrumentation.close)()
+
+        self.finish(request, response, recorder, started)
+
+        return response
+
+    def start(self, request):
+        request._render_time = 0.0
+        return QueryRecorder(), time.perf_counter()
+
+    def instrument(self, recorder):
+        stack = ExitStack()
+
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+        return stack
+
+    def finish(self, request, response, recorder, started):
+        # Sets the Server-Timing header and records the request in the buffer
+        total_time = time.perf_counter() - started
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries, {recorder.duplicates} duplicates"',
+            f'render;dur={request._render_time * 1000:.1f};desc="Serialization"',
+            f'total;dur={total_time * 1000:.1f}',
+        ])
+
+        match = getattr(request, 'resolver_match', None)
+
+        if match is not None:
+            buffer.add(match.route, request.method, recorder, request._render_time, total_time)
+
+    def process_template_response(self, request, response):
+        # REST framework responses are rendered after the view returns; time it
+        if settings.QUERY_INSTRUMENTATION:
+            started = time.perf_counter()
+
+            def record_render_time(response):
+                request._render_time += time.perf_counter() - started
+
+            response.add_post_render_callback(record_render_time)
+
+        return response
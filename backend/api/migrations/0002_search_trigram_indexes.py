@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+# (table, column) pairs searched with icontains by api.search
+TRIGRAM_INDEXES = [
+    ('api_product', 'name'),
+    ('api_product', 'code'),
+    ('api_vendor', 'name'),
+    ('api_vendor', 'code'),
+    ('api_vendor', 'business_num'),
+    ('api_project', 'name'),
+    ('api_project', 'code'),
+    ('api_project', 'label'),
+    ('api_purchaserequisition', 'name'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Trigram GIN indexes only exist on PostgreSQL; SQLite keeps scanning with LIKE
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    for table, column in TRIGRAM_INDEXES:
+        # Index UPPER(column) to match the UPPER(column::text) LIKE UPPER(%s) emitted for icontains
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{table}_{column}_trgm" ON "{table}" USING gin (UPPER("{column}") gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{table}_{column}_trgm"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
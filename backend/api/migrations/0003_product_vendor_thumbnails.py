@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='vendor',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.5 on 2026-10-18 12:42
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_product_vendor_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EndpointQueryStats',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('route', models.CharField(max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('requests', models.BigIntegerField(default=0)),
+                ('queries', models.BigIntegerField(default=0)),
+                ('duplicate_queries', models.BigIntegerField(default=0)),
+                ('max_queries', models.IntegerField(default=0)),
+                ('sql_time', models.FloatField(default=0)),
+                ('render_time', models.FloatField(default=0)),
+                ('total_time', models.FloatField(default=0)),
+                ('top_duplicate', models.TextField(blank=True, default=None, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('route', 'method')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.5 on 2026-10-18 13:07
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_existing_rows(apps, schema_editor):
+    PurchaseRequisition = apps.get_model('api', 'PurchaseRequisition')
+    Comment = apps.get_model('api', 'Comment')
+    ProductPurchaseRequisition = apps.get_model('api', 'ProductPurchaseRequisition')
+
+    comments = Comment.objects.filter(purchase_requisition=OuterRef('pk')).values('purchase_requisition').annotate(count=Count('pk')).values('count')
+    lines = ProductPurchaseRequisition.objects.filter(purchase_requisition=OuterRef('pk')).values('purchase_requisition').annotate(count=Count('pk')).values('count')
+
+    PurchaseRequisition.objects.update(comment_count=Coalesce(Subquery(comments), 0), line_count=Coalesce(Subquery(lines), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaserequisition',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='purchaserequisition',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
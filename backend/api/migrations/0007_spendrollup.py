@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-18 13:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_purchase_requisition_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendRollup',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('month', models.DateField()),
+                ('status', models.CharField(choices=[('DRAFT', 'Draft'), ('READY', 'Ready'), ('WAITING_TO_APPROVAL', 'Waiting to Approval'), ('TO_DO', 'To Do'), ('IN_PROGRESS', 'In Progress'), ('ON_HOLD', 'On Hold'), ('CANCELLED', 'Cancelled'), ('COMPLETED', 'Completed')], max_length=20)),
+                ('total_spend', models.FloatField(default=0)),
+                ('line_count', models.IntegerField(default=0)),
+                ('requisition_count', models.IntegerField(default=0)),
+                ('legal_entity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spend_rollups', to='api.legalentity')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spend_rollups', to='api.project')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spend_rollups', to='api.vendor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['legal_entity', 'month'], name='spend_rollup_entity_month')],
+                'unique_together': {('legal_entity', 'project', 'vendor', 'month', 'status')},
+            },
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 4.2.5 on 2026-10-18 13:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_spendrollup'),
+    ]
+
+    operations = [
+        # Build the composite indexes before dropping the single column ones they cover
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['purchase_requisition', '-created_at', 'id'], name='comment_requisition_created'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['legal_entity', 'id'], name='product_entity_id'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['legal_entity', 'id'], name='project_entity_id'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(condition=models.Q(('is_default', True)), fields=['legal_entity'], name='project_entity_default'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaserequisition',
+            index=models.Index(fields=['legal_entity', 'id'], name='requisition_entity_id'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaserequisition',
+            index=models.Index(fields=['legal_entity', 'status'], name='requisition_entity_status'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaserequisition',
+            index=models.Index(fields=['legal_entity', 'target_date'], name='requisition_entity_target'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['legal_entity', 'id'], name='user_entity_id'),
+        ),
+        migrations.AddIndex(
+            model_name='vendor',
+            index=models.Index(fields=['legal_entity', 'id'], name='vendor_entity_id'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='purchase_requisition',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='api.purchaserequisition'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='legal_entity',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='products', to='api.legalentity'),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='legal_entity',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='projects', to='api.legalentity'),
+        ),
+        migrations.AlterField(
+            model_name='purchaserequisition',
+            name='legal_entity',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='purchase_requisitions', to='api.legalentity'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='legal_entity',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='users', to='api.legalentity'),
+        ),
+        migrations.AlterField(
+            model_name='vendor',
+            name='legal_entity',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='vendors', to='api.legalentity'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.5 on 2026-10-18 13:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseRequisitionTransition',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('action', models.CharField(max_length=20)),
+                ('from_status', models.CharField(choices=[('DRAFT', 'Draft'), ('READY', 'Ready'), ('WAITING_TO_APPROVAL', 'Waiting to Approval'), ('TO_DO', 'To Do'), ('IN_PROGRESS', 'In Progress'), ('ON_HOLD', 'On Hold'), ('CANCELLED', 'Cancelled'), ('COMPLETED', 'Completed')], max_length=20)),
+                ('to_status', models.CharField(choices=[('DRAFT', 'Draft'), ('READY', 'Ready'), ('WAITING_TO_APPROVAL', 'Waiting to Approval'), ('TO_DO', 'To Do'), ('IN_PROGRESS', 'In Progress'), ('ON_HOLD', 'On Hold'), ('CANCELLED', 'Cancelled'), ('COMPLETED', 'Completed')], max_length=20)),
+                ('comment', models.TextField(blank=True, default=None, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('purchase_requisition', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transitions', to='api.purchaserequisition')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purchase_requisition_transitions', to='api.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['purchase_requisition', '-created_at'], name='transition_requisition_created')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.5 on 2026-10-18 14:02
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, TruncMonth
+
+
+def count_existing_rows(apps, schema_editor):
+    SpendRollup = apps.get_model('api', 'SpendRollup')
+    PurchaseRequisition = apps.get_model('api', 'PurchaseRequisition')
+    ProductPurchaseRequisition = apps.get_model('api', 'ProductPurchaseRequisition')
+
+    first_vendor = ProductPurchaseRequisition.objects.filter(purchase_requisition=OuterRef('pk')).order_by('vendor_id').values('vendor_id')[:1]
+    requisitions = PurchaseRequisition.objects.annotate(
+        month=TruncMonth('target_date'),
+        first_vendor=Subquery(first_vendor),
+    ).filter(
+        legal_entity=OuterRef('legal_entity'),
+        project=OuterRef('project'),
+        status=OuterRef('status'),
+        month=OuterRef('month'),
+        first_vendor=OuterRef('vendor'),
+    ).values('legal_entity').annotate(count=Count('pk')).values('count')
+
+    SpendRollup.objects.update(unique_requisition_count=Coalesce(Subquery(requisitions), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_purchase_requisition_transition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spendrollup',
+            name='unique_requisition_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.5 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_spendrollup_unique_requisition_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='price',
+            name='price',
+            field=models.FloatField(),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='current_purchase',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='purchase_allowance',
+            field=models.IntegerField(default=0),
+        ),
+    ]
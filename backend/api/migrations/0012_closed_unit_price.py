@@ -0,0 +1,32 @@
+# Generated by Django 4.2.5 on 2026-10-18 14:06
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def close_existing_prices(apps, schema_editor):
+    # Requisitions closed before the prices were stored keep the current ones, the closest record there is
+    Price = apps.get_model('api', 'Price')
+    ProductPurchaseRequisition = apps.get_model('api', 'ProductPurchaseRequisition')
+
+    price = Price.objects.filter(product=OuterRef('product'), vendor=OuterRef('vendor')).values('price')[:1]
+
+    ProductPurchaseRequisition.objects.filter(
+        purchase_requisition__status__in=('COMPLETED', 'CANCELLED')
+    ).update(closed_unit_price=Subquery(price))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_price_and_project_field_types'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productpurchaserequisition',
+            name='closed_unit_price',
+            field=models.FloatField(blank=True, default=None, null=True),
+        ),
+        migrations.RunPython(close_existing_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_closed_unit_price'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['legal_entity', 'name'], name='product_entity_name'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaserequisition',
+            index=models.Index(fields=['legal_entity', 'name'], name='requisition_entity_name'),
+        ),
+    ]
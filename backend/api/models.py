@@ -1,5 +1,9 @@
 from django.db import models
+from django.db.models import Count, F, FilteredRelation, FloatField, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 import uuid
+import warnings
 
 
 class LegalEntity(models.Model):
@@ -7,6 +11,8 @@ class LegalEntity(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     legal_entity_code = models.CharField(max_length=20, unique=True, db_index=True)
     business_num = models.CharField(max_length=200)
+    # Bumped when the entity, its departments, teams or roles change (see api.signals)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         """String representation of a LegalEntity."""
@@ -76,7 +82,19 @@ class Product(models.Model):
     color = models.CharField(max_length=200)
     material = models.CharField(max_length=200)
     image = models.ImageField(upload_to='images/products', null=True, blank=True, default=None)
-    legal_entity = models.ForeignKey(LegalEntity, on_delete=models.CASCADE, related_name='products', db_index=True)
+    thumbnails = models.JSONField(default=dict, blank=True)
+    # Indexed by the (legal_entity, id) index below
+    legal_entity = models.ForeignKey(LegalEntity, on_delete=models.CASCADE, related_name='products', db_index=False)
+    # Bumped when the product or its prices change (see api.signals)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # Product list pages: WHERE legal_entity_id = %s ORDER BY id
+            models.Index(fields=['legal_entity', 'id'], name='product_entity_id'),
+            # Searched product lists: WHERE legal_entity_id = %s AND ... ORDER BY name (api.search)
+            models.Index(fields=['legal_entity', 'name'], name='product_entity_name'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.code})"
@@ -89,7 +107,17 @@ class Vendor(models.Model):
     description = models.TextField(default=None, null=True, blank=True)
     business_num = models.CharField(max_length=200)
     image = models.ImageField(upload_to='images/vendors')
-    legal_entity = models.ForeignKey(LegalEntity, on_delete=models.CASCADE, related_name='vendors', db_index=True)
+    thumbnails = models.JSONField(default=dict, blank=True)
+    # Indexed by the (legal_entity, id) index below
+    legal_entity = models.ForeignKey(LegalEntity, on_delete=models.CASCADE, related_name='vendors', db_index=False)
+    # Bumped when the vendor or its contacts change (see api.signals)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # Vendor list pages: WHERE legal_entity_id = %s ORDER BY id
+            models.Index(fields=['legal_entity', 'id'], name='vendor_entity_id'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.code})"
@@ -128,12 +156,66 @@ class Project(models.Model):
     purchase_allowance = models.IntegerField(default=0)
     current_purchase = models.FloatField(default=0)
     purchase_count = models.IntegerField(default=0)
-    legal_entity = models.ForeignKey(LegalEntity, on_delete=models.CASCADE, related_name='projects', db_index=True)
+    # Indexed by the (legal_entity, id) index below
+    legal_entity = models.ForeignKey(LegalEntity, on_delete=models.CASCADE, related_name='projects', db_index=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # Project list pages: WHERE legal_entity_id = %s ORDER BY id
+            models.Index(fields=['legal_entity', 'id'], name='project_entity_id'),
+            # The default project lookup, over the one flagged row per legal entity
+            models.Index(fields=['legal_entity'], condition=Q(is_default=True), name='project_entity_default'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.code})"
 
 
+class PurchaseRequisitionQuerySet(models.QuerySet):
+    def with_totals(self):
+        # Price every requisition in SQL: one aggregate over its lines joined to Price on (product, vendor)
+        totals = ProductPurchaseRequisition.objects.with_prices().filter(
+            purchase_requisition=OuterRef('pk')
+        ).values('purchase_requisition').annotate(total=Sum('line_price')).values('total')
+        
+        return self.annotate(total_price=Coalesce(Subquery(totals), 0.0, output_field=FloatField()))
+    
+    def with_unpriced_lines(self):
+        # Count the lines whose vendor has no Price for their product, which with_totals counts as 0
+        unpriced = ProductPurchaseRequisition.objects.with_prices().filter(
+            purchase_requisition=OuterRef('pk'),
+            unit_price__isnull=True
+        ).values('purchase_requisition').annotate(count=Count('pk')).values('count')
+        
+        return self.annotate(unpriced_lines=Coalesce(Subquery(unpriced), 0))
+    
+    def with_details(self):
+        # Load everything PurchaseRequisitionSerializer renders in a constant number of queries
+        return self.with_totals().select_related('project', 'requester').prefetch_related(
+            Prefetch(
+                'product_purchase_requisitions',
+                queryset=ProductPurchaseRequisition.objects.with_prices().select_related('product', 'vendor')
+            )
+        )
+    
+    def recount(self):
+        """Recompute the stored comment_count and line_count of the requisitions in bulk; returns the number repaired."""
+        comments = Comment.objects.filter(purchase_requisition=OuterRef('pk')).values('purchase_requisition').annotate(count=Count('pk')).values('count')
+        lines = ProductPurchaseRequisition.objects.filter(purchase_requisition=OuterRef('pk')).values('purchase_requisition').annotate(count=Count('pk')).values('count')
+        
+        return self.annotate(
+            actual_comments=Coalesce(Subquery(comments), 0),
+            actual_lines=Coalesce(Subquery(lines), 0)
+        ).filter(
+            ~Q(comment_count=F('actual_comments')) | ~Q(line_count=F('actual_lines'))
+        ).update(
+            comment_count=Coalesce(Subquery(comments), 0),
+            line_count=Coalesce(Subquery(lines), 0),
+            updated_at=timezone.now()
+        )
+
+
 class PurchaseRequisition(models.Model):
     priority_choices = [
         ('LOW', 'Low'),
@@ -157,24 +239,84 @@ class PurchaseRequisition(models.Model):
     priority = models.CharField(max_length=10, choices=priority_choices)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='purchase_requisitions', db_index=True)
     requester = models.ForeignKey('User', on_delete=models.PROTECT, related_name='purchase_requisitions', db_index=True)
-    legal_entity = models.ForeignKey(LegalEntity, on_delete=models.CASCADE, related_name='purchase_requisitions', db_index=True)
+    # Indexed by the (legal_entity, ...) indexes below
+    legal_entity = models.ForeignKey(LegalEntity, on_delete=models.CASCADE, related_name='purchase_requisitions', db_index=False)
     target_date = models.DateField()
     due_date = models.DateField()
     status = models.CharField(max_length=20, choices=status_choices, default='DRAFT')
     is_approved = models.BooleanField(default=False)
     is_rejected = models.BooleanField(default=False)
     rejected_comment = models.TextField(null=True, blank=True, default=None)
+    # Kept in step with the comments and lines by api.signals and ProductPurchaseRequisitionListSerializer
+    comment_count = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+    # Bumped when the requisition, its lines, their prices or its comments change (see api.signals)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = PurchaseRequisitionQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # List pages and detail lookups: WHERE legal_entity_id = %s ORDER BY id / AND id = %s
+            models.Index(fields=['legal_entity', 'id'], name='requisition_entity_id'),
+            # Searched requisition lists: WHERE legal_entity_id = %s AND ... ORDER BY name (api.search)
+            models.Index(fields=['legal_entity', 'name'], name='requisition_entity_name'),
+            # Status filters of the export, the analytics rebuild and the dashboards
+            models.Index(fields=['legal_entity', 'status'], name='requisition_entity_status'),
+            # Target date ranges and ordering of the export
+            models.Index(fields=['legal_entity', 'target_date'], name='requisition_entity_target'),
+        ]
+    
+    # Set by the total_price annotation of PurchaseRequisitionQuerySet.with_totals
+    _total_price = None
     
     def __str__(self):
         return f"{self.name} ({self.project.name})"
     
     @property
     def total_price(self):
-        return sum([product_purchase_requisition.price for product_purchase_requisition in self.product_purchase_requisitions.all()])
+        """Total price of the lines, unpriced lines counting as 0.
+        
+        Read it from requisitions loaded through ``with_totals()``; computing
+        it for one requisition costs a query and is deprecated.
+        """
+        if self._total_price is None:
+            warnings.warn('PurchaseRequisition.total_price without with_totals() is deprecated', DeprecationWarning, stacklevel=2)
+            return PurchaseRequisition.objects.with_totals().values_list('total_price', flat=True).get(pk=self.pk)
+        
+        return self._total_price
+    
+    @total_price.setter
+    def total_price(self, value):
+        self._total_price = value
     
     @property
     def total_comment(self):
-        return self.comments.count()
+        """Deprecated alias of the stored comment_count."""
+        warnings.warn('PurchaseRequisition.total_comment is deprecated, use comment_count', DeprecationWarning, stacklevel=2)
+        return self.comment_count
+    
+    def save(self, *args, **kwargs):
+        # The counters are only written with F() updates; a full save of an instance
+        # loaded before a comment or line was added must not overwrite them
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('comment_count', 'line_count')
+            ]
+        
+        super().save(*args, **kwargs)
+
+
+class ProductPurchaseRequisitionQuerySet(models.QuerySet):
+    def with_prices(self):
+        # Join the vendor's Price for each line and annotate unit_price and line_price (quantity * unit_price)
+        return self.annotate(
+            vendor_price=FilteredRelation('product__prices', condition=Q(product__prices__vendor=F('vendor')))
+        ).annotate(
+            unit_price=F('vendor_price__price'),
+            line_price=F('quantity') * F('vendor_price__price')
+        )
 
 
 class ProductPurchaseRequisition(models.Model):
@@ -183,39 +325,136 @@ class ProductPurchaseRequisition(models.Model):
     product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='purchase_requisitions')
     vendor = models.ForeignKey(Vendor, on_delete=models.PROTECT, related_name='product_purchase_requisitions') 
     purchase_requisition = models.ForeignKey(PurchaseRequisition, on_delete=models.CASCADE, related_name='product_purchase_requisitions')
+    # The vendor's price when the requisition was completed or cancelled, which its spend rollups are summed from (see api.analytics)
+    closed_unit_price = models.FloatField(null=True, blank=True, default=None)
+    
+    objects = ProductPurchaseRequisitionQuerySet.as_manager()
     
     class Meta:
         unique_together = ('product', 'purchase_requisition')
-        
+    
     @property
     def price(self):
+        """Deprecated: load the lines through ``with_prices()`` and read ``line_price``, None when unpriced.
+        
+        Raises Price.DoesNotExist when the vendor has no price for the product.
+        """
+        warnings.warn('ProductPurchaseRequisition.price is deprecated, use with_prices() and line_price', DeprecationWarning, stacklevel=2)
         return self.quantity * self.product.prices.get(vendor=self.vendor).price
 
 
 class Comment(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     content = models.TextField()
-    purchase_requisition = models.ForeignKey(PurchaseRequisition, on_delete=models.CASCADE, related_name='comments', db_index=True)
+    # Indexed by the (purchase_requisition, -created_at, id) index below
+    purchase_requisition = models.ForeignKey(PurchaseRequisition, on_delete=models.CASCADE, related_name='comments', db_index=False)
     user = models.ForeignKey('User', on_delete=models.PROTECT, related_name='comments')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_updated = models.BooleanField(default=False)
     
+    class Meta:
+        indexes = [
+            # Comment pages: WHERE purchase_requisition_id = %s ORDER BY created_at DESC, id
+            models.Index(fields=['purchase_requisition', '-created_at', 'id'], name='comment_requisition_created'),
+        ]
+    
     def __str__(self):
         return f"{self.user.username} ({self.purchase_requisition.name})"
 
 
+class PurchaseRequisitionTransition(models.Model):
+    # Audit trail of status changes, written in bulk by api.workflow. `action`
+    # is approve, reject, or the status a set-status moved the requisition to.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Indexed by the (purchase_requisition, -created_at) index below
+    purchase_requisition = models.ForeignKey(PurchaseRequisition, on_delete=models.CASCADE, related_name='transitions', db_index=False)
+    user = models.ForeignKey('User', on_delete=models.SET_NULL, null=True, blank=True, related_name='purchase_requisition_transitions')
+    action = models.CharField(max_length=20)
+    from_status = models.CharField(max_length=20, choices=PurchaseRequisition.status_choices)
+    to_status = models.CharField(max_length=20, choices=PurchaseRequisition.status_choices)
+    comment = models.TextField(null=True, blank=True, default=None)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # History of a requisition: WHERE purchase_requisition_id = %s ORDER BY created_at DESC
+            models.Index(fields=['purchase_requisition', '-created_at'], name='transition_requisition_created'),
+        ]
+    
+    def __str__(self):
+        return f"{self.purchase_requisition_id}: {self.from_status} -> {self.to_status}"
+
+
 class User(models.Model):
     # Represents user accounts in the system.
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     username = models.CharField(max_length=30, unique=True)
     email = models.EmailField(max_length=200, unique=True, db_index=True)
     password = models.CharField(max_length=200)
-    legal_entity = models.ForeignKey(LegalEntity, null=True, blank=True, on_delete=models.SET_NULL, related_name='users', db_index=True)
+    # Indexed by the (legal_entity, id) index below
+    legal_entity = models.ForeignKey(LegalEntity, null=True, blank=True, on_delete=models.SET_NULL, related_name='users', db_index=False)
     department = models.ForeignKey(Department, null=True, blank=True, on_delete=models.SET_NULL)
     team = models.ForeignKey(Team, null=True, blank=True, on_delete=models.SET_NULL)
     role = models.ForeignKey(Role, null=True, blank=True, on_delete=models.SET_NULL)
     
+    class Meta:
+        indexes = [
+            # Member list pages: WHERE legal_entity_id = %s ORDER BY id
+            models.Index(fields=['legal_entity', 'id'], name='user_entity_id'),
+        ]
+    
     def __str__(self):
         """String representation of a User."""
         return self.email
+
+
+class EndpointQueryStats(models.Model):
+    # Per URL pattern aggregates recorded by api.middleware.QueryInstrumentationMiddleware.
+    # Times are in milliseconds.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    route = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    requests = models.BigIntegerField(default=0)
+    queries = models.BigIntegerField(default=0)
+    duplicate_queries = models.BigIntegerField(default=0)
+    max_queries = models.IntegerField(default=0)
+    sql_time = models.FloatField(default=0)
+    render_time = models.FloatField(default=0)
+    total_time = models.FloatField(default=0)
+    top_duplicate = models.TextField(null=True, blank=True, default=None)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('route', 'method')
+    
+    def __str__(self):
+        return f"{self.method} {self.route}"
+
+
+class SpendRollup(models.Model):
+    # Spend of closed requisitions per (legal entity, project, vendor, month of
+    # target date, status), maintained by api.analytics when a requisition is
+    # completed or cancelled and when a closed one is deleted. Requisitions are
+    # counted once per vendor they order from, so requisition_count does not add
+    # up across vendors; unique_requisition_count counts each one in the bucket
+    # of its first vendor only, and does.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    legal_entity = models.ForeignKey(LegalEntity, on_delete=models.CASCADE, related_name='spend_rollups')
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='spend_rollups')
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='spend_rollups')
+    month = models.DateField()
+    status = models.CharField(max_length=20, choices=PurchaseRequisition.status_choices)
+    total_spend = models.FloatField(default=0)
+    line_count = models.IntegerField(default=0)
+    requisition_count = models.IntegerField(default=0)
+    unique_requisition_count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('legal_entity', 'project', 'vendor', 'month', 'status')
+        indexes = [
+            models.Index(fields=['legal_entity', 'month'], name='spend_rollup_entity_month'),
+        ]
+    
+    def __str__(self):
+        return f"{self.project.code} {self.vendor.code} {self.month:%Y-%m} ({self.status})"
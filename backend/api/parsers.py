@@ -0,0 +1,28 @@
+import io
+
+import orjson
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from .renderers import ORJSONRenderer
+
+
+class ORJSONParser(JSONParser):
+    # JSONParser backed by orjson. Bodies orjson rejects (invalid JSON, integers
+    # beyond 64 bits, non UTF-8 encodings) go through JSONParser, so errors and
+    # edge cases are reported exactly as before.
+
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        body = stream.read()
+
+        if encoding.lower().replace('-', '') == 'utf8':
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+
+        return super().parse(io.BytesIO(body), media_type, parser_context)
@@ -0,0 +1,93 @@
+from django.conf import settings
+from django.db import transaction
+
+from .models import Price
+from .tenant_cache import TenantCache
+
+
+# Largest number of prices a legal entity's matrix is built and cached for
+PRICE_MATRIX_MAX_SIZE = getattr(settings, 'PRICE_MATRIX_MAX_SIZE', 20000)
+
+
+class PriceMatrix:
+    # Unit prices keyed by (product_id, vendor_id), loaded with a single query:
+    # all of a legal entity's, or only those of the lines being rendered.
+    # Serializers look line prices up here instead of issuing a Price query
+    # per line. Only used to render; validation reads Price itself.
+
+    def __init__(self, prices):
+        self.prices = prices
+
+    @classmethod
+    def load(cls, legal_entity_id, limit=None):
+        """Load every price of a legal entity; None when it has more than ``limit`` (PRICE_MATRIX_MAX_SIZE)."""
+        limit = PRICE_MATRIX_MAX_SIZE if limit is None else limit
+        prices = list(Price.objects.filter(product__legal_entity_id=legal_entity_id).values_list('product_id', 'vendor_id', 'price')[:limit + 1])
+
+        if len(prices) > limit:
+            return None
+
+        return cls({(product_id, vendor_id): price for product_id, vendor_id, price in prices})
+
+    @classmethod
+    def for_lines(cls, lines):
+        # Prices of the (product, vendor) pairs of some requisition lines
+        lines = list(lines)
+
+        if not lines:
+            return cls({})
+
+        prices = Price.objects.filter(
+            product_id__in={line.product_id for line in lines},
+            vendor_id__in={line.vendor_id for line in lines},
+        ).values_list('product_id', 'vendor_id', 'price')
+
+        return cls({(product_id, vendor_id): price for product_id, vendor_id, price in prices})
+
+    def __contains__(self, key):
+        return key in self.prices
+
+    def get(self, product_id, vendor_id, default=None):
+        return self.prices.get((product_id, vendor_id), default)
+
+    def line_price(self, line):
+        price = self.get(line.product_id, line.vendor_id)
+
+        return line.quantity * price if price is not None else None
+
+    def total(self, lines):
+        """Total price of requisition lines; unpriced lines count as 0, like PurchaseRequisitionQuerySet.with_totals."""
+        return sum(self.line_price(line) or 0.0 for line in lines)
+
+
+# The matrices are version-stamped per legal entity under their own prefix,
+# so a price change does not flush the org tree and role table
+PRICE_MATRIX = 'price-matrix'
+
+price_cache = TenantCache(
+    alias=getattr(settings, 'TENANT_CACHE_ALIAS', 'default'),
+    timeout=getattr(settings, 'TENANT_CACHE_TIMEOUT', 300),
+    prefix='tenant-prices',
+)
+
+
+def get_price_matrix(legal_entity_id):
+    """Return the cached price matrix of a legal entity, or None.
+
+    None when the cache backend is not shared by every worker, where a matrix
+    could outlive a price change made in another worker, or when the entity
+    has more than PRICE_MATRIX_MAX_SIZE prices.
+    """
+    if not price_cache.enabled:
+        return None
+
+    # False stands for a legal entity with too many prices, so that is cached too
+    prices = price_cache.get_or_set(legal_entity_id, PRICE_MATRIX, lambda: getattr(PriceMatrix.load(legal_entity_id), 'prices', False))
+
+    return PriceMatrix(prices) if prices is not False else None
+
+
+def invalidate_price_matrix(legal_entity_id):
+    # Now and again on commit, so a matrix rebuilt before the write committed is not kept
+    price_cache.invalidate(legal_entity_id)
+    transaction.on_commit(lambda: price_cache.invalidate(legal_entity_id))
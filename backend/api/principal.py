@@ -0,0 +1,213 @@
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import User, LegalEntity, Department, Team, Role
+
+
+@dataclass(frozen=True)
+class Principal:
+    # Immutable snapshot of an authenticated user and the rows hanging off it.
+    # Built from a single joined query and shared between requests, so it must
+    # never hold model instances (those are mutable and not thread-safe).
+    id: str
+    username: str
+    email: str
+    legal_entity_id: Optional[str] = None
+    legal_entity_code: Optional[str] = None
+    legal_entity_name: Optional[str] = None
+    department_id: Optional[str] = None
+    department_code: Optional[str] = None
+    department_name: Optional[str] = None
+    team_id: Optional[str] = None
+    team_code: Optional[str] = None
+    team_name: Optional[str] = None
+    role_id: Optional[str] = None
+    role: Optional[str] = None
+    approve: bool = False
+    reject: bool = False
+
+    @classmethod
+    def load(cls, email):
+        """Build a principal for the given email in one joined query."""
+        return cls.from_user(cls.queryset().get(email=email))
+
+    @classmethod
+    async def aload(cls, email):
+        return cls.from_user(await cls.queryset().aget(email=email))
+
+    @staticmethod
+    def queryset():
+        return User.objects.select_related('legal_entity', 'department', 'team', 'role')
+
+    @classmethod
+    def from_user(cls, user):
+        legal_entity, department, team, role = user.legal_entity, user.department, user.team, user.role
+
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            legal_entity_id=legal_entity.id if legal_entity else None,
+            legal_entity_code=legal_entity.legal_entity_code if legal_entity else None,
+            legal_entity_name=legal_entity.business_num if legal_entity else None,
+            department_id=department.id if department else None,
+            department_code=department.code if department else None,
+            department_name=department.name if department else None,
+            team_id=team.id if team else None,
+            team_code=team.code if team else None,
+            team_name=team.name if team else None,
+            role_id=role.id if role else None,
+            role=role.role if role else None,
+            approve=role.approve if role else False,
+            reject=role.reject if role else False,
+        )
+
+    def to_user(self):
+        """Rehydrate a fresh, request-local User with its relations attached.
+
+        The password column is left deferred, so a view calling ``user.save()``
+        only writes the columns it could have changed.
+        """
+        user = _from_db(User, {
+            'id': self.id,
+            'username': self.username,
+            'email': self.email,
+            'legal_entity_id': self.legal_entity_id,
+            'department_id': self.department_id,
+            'team_id': self.team_id,
+            'role_id': self.role_id,
+        })
+
+        user.legal_entity = _from_db(LegalEntity, {
+            'id': self.legal_entity_id,
+            'legal_entity_code': self.legal_entity_code,
+            'business_num': self.legal_entity_name,
+        }) if self.legal_entity_id else None
+
+        user.department = _from_db(Department, {
+            'id': self.department_id,
+            'code': self.department_code,
+            'name': self.department_name,
+            'legal_entity_id': self.legal_entity_id,
+        }) if self.department_id else None
+
+        user.team = _from_db(Team, {
+            'id': self.team_id,
+            'code': self.team_code,
+            'name': self.team_name,
+            'department_id': self.department_id,
+        }) if self.team_id else None
+
+        user.role = _from_db(Role, {
+            'id': self.role_id,
+            'role': self.role,
+            'legal_entity_id': self.legal_entity_id,
+            'approve': self.approve,
+            'reject': self.reject,
+        }) if self.role_id else None
+
+        return user
+
+
+def _from_db(model, data):
+    # Model.from_db expects values in concrete field order; anything we do not
+    # carry in the principal becomes a deferred field.
+    field_names = [field.attname for field in model._meta.concrete_fields if field.attname in data]
+    values = [data[name] for name in field_names]
+    return model.from_db(DEFAULT_DB_ALIAS, field_names, values)
+
+
+class PrincipalCache:
+    # Bounded, per-process LRU cache of principals with a time-to-live.
+    # Entries are evicted explicitly by signal handlers when the user, its role
+    # or its organisation changes, in the process that made the change. Other
+    # processes are not told: they keep serving the old principal, role and
+    # legal entity until the entry expires, at most `ttl` seconds later.
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a load that raced with a write
+        # cannot store the stale principal it read.
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            principal, expires_at = entry
+
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return principal
+
+    def set(self, key, principal, generation=None):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self._entries[key] = (principal, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_principal(email):
+    """Return the cached principal for an email, loading it on a miss."""
+    principal = principal_cache.get(email)
+
+    if principal is None:
+        generation = principal_cache.generation
+        principal = Principal.load(email)
+        principal_cache.set(email, principal, generation)
+
+    return principal
+
+
+async def aget_principal(email):
+    """Async variant of :func:`get_principal` for async views."""
+    principal = principal_cache.get(email)
+
+    if principal is None:
+        generation = principal_cache.generation
+        principal = await Principal.aload(email)
+        principal_cache.set(email, principal, generation)
+
+    return principal
+
+
+principal_cache = PrincipalCache(
+    maxsize=getattr(settings, 'AUTH_PRINCIPAL_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'AUTH_PRINCIPAL_CACHE_TTL', 60),
+)
@@ -0,0 +1,40 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Types orjson does not handle natively fall back to REST framework's encoder
+encode_default = JSONEncoder().default
+
+
+class ORJSONRenderer(JSONRenderer):
+    # Drop-in replacement for JSONRenderer backed by orjson, producing the same
+    # compact UTF-8 output with two exceptions. Floats are written in their
+    # shortest form (1e16 and 1e-7, where JSONRenderer writes 1e+16 and 1e-07),
+    # which parse back to the same value. NaN and infinities are written as
+    # null, where JSONRenderer raises ValueError. Dates and times are passed back
+    # to REST framework's encoder so they keep its format (e.g. a trailing Z for
+    # UTC), as are Decimals and lazy strings. Indented output (?indent=, the
+    # browsable API) and ASCII-only settings use JSONRenderer.
+
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+
+        if indent is not None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=encode_default, option=self.options)
+        except orjson.JSONEncodeError:
+            # Integers beyond 64 bits and the like; let the stdlib encoder decide
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Escape \u2028 and \u2029 like JSONRenderer so the output stays a strict javascript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+        return ret
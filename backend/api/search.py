@@ -0,0 +1,52 @@
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Product, Vendor, Price, Project, PurchaseRequisition
+
+
+# Columns matched by the search box of each list endpoint. Every column listed
+# here (except joined ones) is covered by an UPPER(column) gin_trgm_ops index
+# on PostgreSQL, which serves the UPPER(column) LIKE UPPER('%term%') filter
+# Django emits for icontains.
+SEARCH_FIELDS = {
+    Product: ['name', 'code'],
+    Vendor: ['name', 'code', 'business_num'],
+    Project: ['name', 'code', 'label'],
+    PurchaseRequisition: ['name', 'project__code'],
+}
+
+
+def search_condition(model, query):
+    condition = Q()
+
+    for field in SEARCH_FIELDS[model]:
+        condition |= Q(**{f'{field}__icontains': query})
+
+    if model is Product:
+        # Match products offered by a vendor code through a semi-join, so a
+        # product sold by several matching vendors is returned only once
+        condition |= Exists(Price.objects.filter(product=OuterRef('pk'), vendor__code__icontains=query))
+
+    return condition
+
+
+def search(queryset, query, ordering=('pk',)):
+    """Filter a list queryset by a search box term and order it by relevance.
+
+    On PostgreSQL results are ranked by their best trigram similarity to the
+    term, falling back to ``ordering`` for ties. Other databases (SQLite in
+    local development) get a plain LIKE filter in ``ordering`` order.
+    """
+    model = queryset.model
+    queryset = queryset.filter(search_condition(model, query))
+
+    if connection.vendor != 'postgresql':
+        return queryset.order_by(*ordering)
+
+    from django.contrib.postgres.search import TrigramSimilarity
+    from django.db.models.functions import Greatest
+
+    similarities = [TrigramSimilarity(field, query) for field in SEARCH_FIELDS[model]]
+    rank = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+
+    return queryset.annotate(search_rank=rank).order_by('-search_rank', *ordering)
@@ -1,4 +1,7 @@
 from rest_framework import serializers
+from django.db.models import F
+from django.utils import timezone
+from collections import Counter
 from datetime import datetime
 from .models import (
     LegalEntity, 
@@ -16,6 +19,19 @@ from .models import (
     Comment
 )
 from .action import base64_file
+from .thumbnails import schedule_thumbnails, thumbnail_urls
+from .pricing import get_price_matrix, PriceMatrix
+
+
+def render_price_matrix(serializer, legal_entity_id, lines):
+    # The cached price matrix of the legal entity, looked up once per render and shared by nested
+    # serializers through the root's context. Without one, ``lines`` are priced with their own query
+    matrices = serializer.context.setdefault('price_matrices', {})
+    
+    if legal_entity_id not in matrices:
+        matrices[legal_entity_id] = get_price_matrix(legal_entity_id)
+    
+    return matrices[legal_entity_id] or PriceMatrix.for_lines(lines)
 
 
 class UserInfoSerializer(serializers.ModelSerializer):
@@ -222,6 +238,7 @@ class ProductSerializer(serializers.ModelSerializer):
             'length': instance.length,
         }
         ret['productImage'] = ('http://localhost:8080' + instance.image.url) if instance.image else None
+        ret['thumbnails'] = thumbnail_urls(instance)
         return ret
 
     def create(self, validated_data):
@@ -237,6 +254,8 @@ class ProductSerializer(serializers.ModelSerializer):
         instance.image = base64_file(productImage, name=instance.code) if productImage else None
 
         instance.save()
+        
+        schedule_thumbnails(instance)
 
         return instance
 
@@ -278,6 +297,7 @@ class VendorSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         ret = super().to_representation(instance)
         ret['vendorImage'] = ('http://localhost:8080' + instance.image.url) if instance.image else None
+        ret['thumbnails'] = thumbnail_urls(instance)
         
         return ret
         
@@ -291,6 +311,8 @@ class VendorSerializer(serializers.ModelSerializer):
         
         instance.save()
         
+        schedule_thumbnails(instance)
+        
         return instance
 
 
@@ -329,6 +351,77 @@ class PatchProjectSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'label']
 
 
+class ProductPurchaseRequisitionListSerializer(serializers.ListSerializer):
+    # Validates and inserts every line of a requisition in a constant number of
+    # queries: product and vendor codes are resolved with one IN query each, the
+    # (product, vendor) pairs are checked against Price with a third one and the
+    # lines are written with a single bulk_create.
+    
+    def to_internal_value(self, data):
+        lines = super().to_internal_value(data)
+        
+        legal_entity = self.child.legal_entity
+        product_codes = {line['product']['code'] for line in lines}
+        vendor_codes = {line['vendor']['code'] for line in lines}
+        
+        products = Product.objects.filter(code__in=product_codes)
+        vendors = Vendor.objects.filter(code__in=vendor_codes)
+        
+        if legal_entity is not None:
+            products = products.filter(legal_entity=legal_entity)
+            vendors = vendors.filter(legal_entity=legal_entity)
+        
+        products = {product.code: product for product in products}
+        vendors = {vendor.code: vendor for vendor in vendors}
+        
+        # Read from the database, never the cached matrix: a line must not be accepted on a deleted price
+        priced = set(
+            Price.objects.filter(product__in=products.values(), vendor__in=vendors.values()).values_list('product_id', 'vendor_id')
+        ) if products and vendors else set()
+        
+        errors = []
+        seen = set()
+        
+        for line in lines:
+            product = products.get(line['product']['code'])
+            vendor = vendors.get(line['vendor']['code'])
+            error = {}
+            
+            if product is None:
+                error['code'] = ['Product not found']
+            elif product.code in seen:
+                error['code'] = ['Product is listed more than once']
+            
+            if vendor is None:
+                error['vendorCode'] = ['Vendor not found']
+            
+            if product is not None and vendor is not None and (product.id, vendor.id) not in priced:
+                error['vendorCode'] = ['Vendor does not supply this product']
+            
+            if product is not None:
+                seen.add(product.code)
+            
+            line['product'] = product
+            line['vendor'] = vendor
+            errors.append(error)
+        
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        
+        return lines
+    
+    def create(self, validated_data):
+        instances = self.child.Meta.model.objects.bulk_create([self.child.Meta.model(**line) for line in validated_data])
+        
+        # bulk_create sends no post_save, so count the new lines here
+        lines = Counter(instance.purchase_requisition_id for instance in instances)
+        
+        for purchase_requisition_id, count in lines.items():
+            PurchaseRequisition.objects.filter(pk=purchase_requisition_id).update(line_count=F('line_count') + count, updated_at=timezone.now())
+        
+        return instances
+
+
 class ProductPurchaseRequisitionSerializer(serializers.ModelSerializer):
     code = serializers.CharField(source='product.code')
     vendorCode = serializers.CharField(source='vendor.code')
@@ -337,17 +430,25 @@ class ProductPurchaseRequisitionSerializer(serializers.ModelSerializer):
     
     def __init__(self, *args, **kwargs):
         purchase_requisition = kwargs.pop('purchase_requisition', None)
+        legal_entity = kwargs.pop('legal_entity', None)
         super().__init__(*args, **kwargs)
         self.purchase_requisition = purchase_requisition
+        self.legal_entity = legal_entity
     
     class Meta:
         model = ProductPurchaseRequisition
         fields = ['id', 'code', 'quantity', 'vendorCode', 'vendorName', 'price']
+        list_serializer_class = ProductPurchaseRequisitionListSerializer
         
     
     def to_representation(self, instance):
         ret = super().to_representation(instance)
-        ret['price'] = Price.objects.get(product=instance.product, vendor=instance.vendor).price
+        
+        # Lines loaded through ProductPurchaseRequisitionQuerySet.with_prices carry their unit price
+        if hasattr(instance, 'unit_price'):
+            ret['price'] = instance.unit_price
+        else:
+            ret['price'] = render_price_matrix(self, instance.product.legal_entity_id, [instance]).get(instance.product_id, instance.vendor_id)
         
         return ret
     
@@ -377,6 +478,7 @@ class PurchaseRequisitionSerializer(serializers.ModelSerializer):
     isApproved = serializers.BooleanField(source='is_approved', read_only=True)
     isRejected = serializers.BooleanField(source='is_rejected', read_only=True)
     rejectedComment = serializers.CharField(source='rejected_comment', read_only=True)
+    totalPrice = serializers.SerializerMethodField()
     
     def __init__(self, *args, **kwargs):
         legal_entity = kwargs.pop('legal_entity', None)
@@ -389,16 +491,26 @@ class PurchaseRequisitionSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = PurchaseRequisition
-        fields = ['id', 'purchaseName', 'priority', 'projectCode', 'requester', 'targetDate', 'dueDate', 'status', 'products', 'isApproved', 'isRejected', 'rejectedComment']
+        fields = ['id', 'purchaseName', 'priority', 'projectCode', 'requester', 'targetDate', 'dueDate', 'status', 'products', 'totalPrice', 'isApproved', 'isRejected', 'rejectedComment']
     
     
     def to_representation(self, instance):
         ret = super().to_representation(instance)
         ret['dueDate'] = instance.due_date.strftime('%d-%m-%Y')
         ret['targetDate'] = instance.target_date.strftime('%d-%m-%Y')
-        ret['commentCount'] = instance.total_comment
+        # Stored counters, kept up to date on write so rendering never counts
+        ret['commentCount'] = instance.comment_count
+        ret['lineCount'] = instance.line_count
         
         return ret 
+    
+    def get_totalPrice(self, instance):
+        # Requisitions not loaded through PurchaseRequisitionQuerySet.with_totals are priced from the price matrix
+        if instance._total_price is None:
+            lines = instance.product_purchase_requisitions.all()
+            return render_price_matrix(self, instance.legal_entity_id, lines).total(lines)
+        
+        return instance._total_price
         
     def create(self, validated_data):
         target_date = validated_data.pop('target_date', None)
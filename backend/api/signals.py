@@ -0,0 +1,166 @@
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    User,
+    LegalEntity,
+    Department,
+    Team,
+    Role,
+    Product,
+    Vendor,
+    Price,
+    Contact,
+    Project,
+    PurchaseRequisition,
+    ProductPurchaseRequisition,
+    Comment
+)
+from .principal import principal_cache
+from .tenant_cache import tenant_cache
+from .pricing import invalidate_price_matrix
+from .events import publish_requisition_event
+from .analytics import remove_spend, ROLLUP_STATUSES
+from .serializers import CommentSerializer
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_principal(sender, instance, **kwargs):
+    # set_role, set_department, set_team, join_legal_entity and
+    # delete_user_from_legal_entity all end with a save of the member
+    principal_cache.invalidate(instance.email)
+
+
+@receiver([post_save, post_delete], sender=LegalEntity)
+@receiver([post_save, post_delete], sender=Department)
+@receiver([post_save, post_delete], sender=Team)
+@receiver([post_save, post_delete], sender=Role)
+def invalidate_all_principals(sender, instance, **kwargs):
+    # Organisation rows are shared by many principals and change rarely,
+    # so dropping the whole cache is cheaper than tracking who references them
+    principal_cache.clear()
+
+
+@receiver([post_save, post_delete], sender=LegalEntity)
+@receiver([post_save, post_delete], sender=Department)
+@receiver([post_save, post_delete], sender=Team)
+@receiver([post_save, post_delete], sender=Role)
+def invalidate_tenant_cache(sender, instance, **kwargs):
+    # create_department, delete_department, create_team and role PATCHes all
+    # end here. Invalidate now and again on commit, so a reader that rebuilt the
+    # org tree before the write committed cannot keep serving it.
+    if sender is LegalEntity:
+        legal_entity_id = instance.pk
+    elif sender is Team:
+        legal_entity_id = instance.department.legal_entity_id
+    else:
+        legal_entity_id = instance.legal_entity_id
+
+    tenant_cache.invalidate(legal_entity_id)
+    transaction.on_commit(lambda: tenant_cache.invalidate(legal_entity_id))
+
+
+@receiver([post_save, post_delete], sender=Price)
+def invalidate_price_matrix_cache(sender, instance, **kwargs):
+    # assign_price_to_product, update_price and delete_and_update_price all end here
+    legal_entity_id = Product.objects.filter(pk=instance.product_id).values_list('legal_entity_id', flat=True).first()
+
+    if legal_entity_id is not None:
+        invalidate_price_matrix(legal_entity_id)
+
+
+# Conditional GET (api.action.conditional_response) compares the updated_at of
+# the row an endpoint renders. Rows rendered inside another one's payload bump
+# its updated_at with a plain UPDATE, which fires no further signals.
+
+@receiver([post_save, post_delete], sender=Department)
+@receiver([post_save, post_delete], sender=Role)
+def touch_legal_entity(sender, instance, **kwargs):
+    LegalEntity.objects.filter(pk=instance.legal_entity_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Team)
+def touch_team_legal_entity(sender, instance, **kwargs):
+    LegalEntity.objects.filter(departments=instance.department_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Price)
+def touch_priced_rows(sender, instance, **kwargs):
+    now = timezone.now()
+
+    Product.objects.filter(pk=instance.product_id).update(updated_at=now)
+    PurchaseRequisition.objects.filter(
+        product_purchase_requisitions__product=instance.product_id,
+        product_purchase_requisitions__vendor=instance.vendor_id
+    ).update(updated_at=now)
+
+
+@receiver(post_save, sender=Vendor)
+def touch_vendor_rows(sender, instance, created, **kwargs):
+    # Products and requisition lines render the vendor's code and name
+    if created:
+        return
+
+    now = timezone.now()
+
+    Product.objects.filter(prices__vendor=instance.pk).update(updated_at=now)
+    PurchaseRequisition.objects.filter(product_purchase_requisitions__vendor=instance.pk).update(updated_at=now)
+
+
+@receiver([post_save, post_delete], sender=Contact)
+def touch_contact_vendor(sender, instance, **kwargs):
+    Vendor.objects.filter(pk=instance.vendor_id).update(updated_at=timezone.now())
+
+
+def deleted_from(origin, *models):
+    # Whether a delete started from one of the models, as an instance or a queryset
+    return isinstance(origin, models) or isinstance(origin, QuerySet) and issubclass(origin.model, models)
+
+
+def deleted_with_requisition(origin):
+    # Lines and comments are only cascaded from their requisition, itself
+    # deleted directly or along with its project or legal entity
+    return deleted_from(origin, PurchaseRequisition, Project, LegalEntity)
+
+
+@receiver([post_save, post_delete], sender=ProductPurchaseRequisition)
+@receiver([post_save, post_delete], sender=Comment)
+def touch_purchase_requisition(sender, instance, signal, created=False, origin=None, **kwargs):
+    # Keeps comment_count and line_count in step in the same UPDATE; lines
+    # written by ProductPurchaseRequisitionListSerializer.create count themselves
+    if signal is post_delete and deleted_with_requisition(origin):
+        return
+
+    counter = 'comment_count' if sender is Comment else 'line_count'
+    changes = {'updated_at': timezone.now()}
+
+    if created:
+        changes[counter] = F(counter) + 1
+    elif signal is post_delete:
+        changes[counter] = Greatest(F(counter) - 1, 0)
+
+    PurchaseRequisition.objects.filter(pk=instance.purchase_requisition_id).update(**changes)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def publish_comment_event(sender, instance, signal, created=False, origin=None, **kwargs):
+    # Streamed to the open requisition pages by api.async_views once committed
+    if signal is post_delete and deleted_with_requisition(origin):
+        return
+
+    if signal is post_delete:
+        publish_requisition_event(instance.purchase_requisition, 'comment.deleted', {'id': str(instance.pk)})
+    else:
+        publish_requisition_event(instance.purchase_requisition, 'comment.created' if created else 'comment.updated', CommentSerializer(instance).data)
+
+
+@receiver(pre_delete, sender=PurchaseRequisition)
+def remove_deleted_spend(sender, instance, origin=None, **kwargs):
+    # Before the cascade deletes the lines the rollups are computed from. The
+    # rollups of a deleted project or legal entity are cascaded along with it
+    if instance.status in ROLLUP_STATUSES and not deleted_from(origin, Project, LegalEntity):
+        remove_spend(instance.pk)
@@ -0,0 +1,102 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+class TenantCache:
+    # Read-through cache of rendered, per-legal-entity payloads that rarely
+    # change (the org tree, the role table), kept in a Django cache backend so
+    # every worker process shares it when the backend is shared.
+    #
+    # Entries are keyed by a per-tenant version token. Invalidation replaces
+    # the token instead of deleting entries, so a reader that built a payload
+    # from rows read before a write can only store it under the old token.
+    # Hits and misses are counted in the backend as well.
+    #
+    # The backend must be shared by every worker process (redis, memcached,
+    # database): with a local memory cache an invalidation only reaches the
+    # worker that handled the write, and the others keep serving the old
+    # payload. Such a cache is bypassed unless TENANT_CACHE_ALLOW_LOCAL is set
+    # for a single-process deployment.
+
+    def __init__(self, alias='default', timeout=300, prefix='tenant-cache'):
+        self.alias = alias
+        self.timeout = timeout
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        return not isinstance(self.cache, LocMemCache) or settings.TENANT_CACHE_ALLOW_LOCAL
+
+    def version(self, legal_entity_id):
+        key = f'{self.prefix}:{legal_entity_id}:version'
+        version = self.cache.get(key)
+
+        if version is None:
+            self.cache.add(key, uuid.uuid4().hex, timeout=None)
+            version = self.cache.get(key)
+
+        return version
+
+    def get_or_set(self, legal_entity_id, name, build):
+        """Return the cached ``name`` payload of a legal entity, building it with ``build()`` on a miss."""
+        if not self.enabled:
+            return build()
+
+        key = f'{self.prefix}:{legal_entity_id}:{self.version(legal_entity_id)}:{name}'
+        value = self.cache.get(key)
+
+        if value is not None:
+            self.count(name, 'hits')
+            return value
+
+        self.count(name, 'misses')
+        value = build()
+        self.cache.set(key, value, timeout=self.timeout)
+
+        return value
+
+    def invalidate(self, legal_entity_id):
+        self.cache.set(f'{self.prefix}:{legal_entity_id}:version', uuid.uuid4().hex, timeout=None)
+
+    def count(self, name, outcome):
+        key = f'{self.prefix}:stats:{name}:{outcome}'
+
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # First event since the counter was created or evicted
+            if not self.cache.add(key, 1, timeout=None):
+                self.cache.incr(key)
+
+    def stats(self, names):
+        counters = self.cache.get_many([f'{self.prefix}:stats:{name}:{outcome}' for name in names for outcome in ('hits', 'misses')])
+        stats = {}
+
+        for name in names:
+            hits = counters.get(f'{self.prefix}:stats:{name}:hits', 0)
+            misses = counters.get(f'{self.prefix}:stats:{name}:misses', 0)
+
+            stats[name] = {
+                'hits': hits,
+                'misses': misses,
+                'hitRate': hits / (hits + misses) if hits + misses else None,
+            }
+
+        return stats
+
+
+# Payloads cached per legal entity
+ORG_TREE = 'org-tree'
+ROLES = 'roles'
+
+tenant_cache = TenantCache(
+    alias=getattr(settings, 'TENANT_CACHE_ALIAS', 'default'),
+    timeout=getattr(settings, 'TENANT_CACHE_TIMEOUT', 300),
+)
@@ -1,3 +1,1788 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import decimal
+import io
+import json
+import shutil
+import tempfile
+import uuid
+import threading
+import unittest
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import SkipFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, AsyncRequestFactory, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from core.settings import SECRET_KEY, ALGORITHM
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import async_views, thumbnails
+from .action import Pagination
+from .renderers import ORJSONRenderer
+from .parsers import ORJSONParser
+from .budget import BudgetExceeded
+from .workflow import transition, check, InvalidTransition, TransitionConflict, TRANSITIONS, Change, apply_transitions
+from .catalog_import import CatalogImport
+from .pricing import get_price_matrix
+from .thumbnails import generate_thumbnails, schedule_thumbnails
+from .upload import ImageUploadHandler
+from .principal import Principal, PrincipalCache, principal_cache, get_principal
+from .events import hub, EventHub, requisition_channel
+from .middleware import buffer, EndpointStatsBuffer, QueryRecorder
+from .serializers import PurchaseRequisitionSerializer
+from .models import (
+    User,
+    LegalEntity,
+    Role,
+    Department,
+    Team,
+    Product,
+    Vendor,
+    Price,
+    Contact,
+    Project,
+    PurchaseRequisition,
+    ProductPurchaseRequisition,
+    PurchaseRequisitionTransition,
+    Comment,
+    SpendRollup,
+    EndpointQueryStats
+)
+
+
+class FixturesMixin:
+    # Shared fixtures: a legal entity with a manager account authenticated through a bearer token
+
+    @classmethod
+    def create_fixtures(cls):
+        cls.legal_entity = LegalEntity.objects.create(legal_entity_code='LUNA', business_num='Luna Inc.')
+
+        for role in ['ADMINISTRATOR', 'MANAGER', 'MEMBER', 'VIEWER', 'SUPERVISOR']:
+            Role.objects.create(role=role, legal_entity=cls.legal_entity)
+
+        cls.user = User.objects.create(
+            username='manager',
+            email='manager@luna.com',
+            password='password',
+            legal_entity=cls.legal_entity,
+            role=cls.legal_entity.roles.get(role='MANAGER')
+        )
+
+        cls.project = Project.objects.create(
+            name='Project',
+            code='PRJ',
+            label='Label',
+            is_default=True,
+            purchase_allowance=1000000,
+            legal_entity=cls.legal_entity
+        )
+
+    def authenticate(self):
+        payload = {
+            'email': self.user.email,
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1),
+            'iat': datetime.datetime.utcnow()
+        }
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer ' + jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+    def create_product(self, code, **kwargs):
+        return Product.objects.create(
+            name=kwargs.pop('name', code),
+            description='',
+            SKU=code,
+            brand='Brand',
+            code=code,
+            category='Category',
+            weight='1',
+            width='1',
+            height='1',
+            length='1',
+            color='Black',
+            material='Steel',
+            legal_entity=self.legal_entity,
+            **kwargs
+        )
+
+    def create_vendor(self, code, **kwargs):
+        return Vendor.objects.create(
+            name=kwargs.pop('name', code),
+            code=code,
+            business_num=kwargs.pop('business_num', code),
+            legal_entity=self.legal_entity,
+            **kwargs
+        )
+
+    def create_purchase_requisition(self, name, lines=(), **kwargs):
+        purchase_requisition = PurchaseRequisition.objects.create(
+            name=name,
+            priority='LOW',
+            project=kwargs.pop('project', self.project),
+            requester=self.user,
+            legal_entity=self.legal_entity,
+            target_date=kwargs.pop('target_date', datetime.date(2023, 10, 1)),
+            due_date=kwargs.pop('due_date', datetime.date(2023, 10, 31)),
+            **kwargs
+        )
+
+        for product, vendor, quantity in lines:
+            ProductPurchaseRequisition.objects.create(
+                product=product,
+                vendor=vendor,
+                quantity=quantity,
+                purchase_requisition=purchase_requisition
+            )
+
+        return purchase_requisition
+
+
+# Query statistics stay in memory; a flusher thread would write to the test database mid-test.
+# The test process is the only worker, so the local memory cache may serve the tenant cache
+@override_settings(QUERY_STATS_FLUSH_INTERVAL=0, TENANT_CACHE_ALLOW_LOCAL=True)
+class APITestCase(FixturesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixtures()
+
+    def setUp(self):
+        # Rolled back rows may reuse the ids of cached ones, and a rollback sends no invalidation signals
+        cache.clear()
+        principal_cache.clear()
+        self.authenticate()
+
+
+class PurchaseRequisitionListQueryTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        vendors = [self.create_vendor(f'VND-{i}') for i in range(3)]
+        products = [self.create_product(f'PRD-{i}') for i in range(3)]
+
+        for i, product in enumerate(products):
+            for j, vendor in enumerate(vendors):
+                Price.objects.create(product=product, vendor=vendor, price=10 * i + j)
+
+        for i in range(12):
+            purchase_requisition = self.create_purchase_requisition(
+                f'Requisition {i}',
+                lines=[(product, vendors[(i + j) % 3], i + 1) for j, product in enumerate(products)]
+            )
+
+            Comment.objects.create(content='Comment', purchase_requisition=purchase_requisition, user=self.user)
+
+    def count_queries(self, size):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/purchase-requisition', {'size': size})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']), size)
+
+        return len(queries)
+
+    def test_query_count_is_constant_in_page_size(self):
+        # Warm the principal cache so only the list itself is measured
+        self.client.get('/api/account')
+
+        self.assertEqual(self.count_queries(1), self.count_queries(12))
+
+    def test_list_renders_prices_and_comment_count(self):
+        response = self.client.get('/api/purchase-requisition', {'size': 1})
+
+        purchase_requisition = response.json()['data'][0]
+
+        self.assertEqual(purchase_requisition['commentCount'], 1)
+        self.assertEqual(purchase_requisition['projectCode'], 'PRJ')
+        self.assertEqual(purchase_requisition['requester'], 'manager')
+        self.assertEqual(len(purchase_requisition['products']), 3)
+
+        total_price = 0
+
+        for line in purchase_requisition['products']:
+            price = Price.objects.get(product__code=line['code'], vendor__code=line['vendorCode']).price
+            self.assertEqual(line['price'], price)
+            total_price += line['quantity'] * price
+
+        self.assertEqual(purchase_requisition['totalPrice'], total_price)
+
+
+class QueryInstrumentationTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        # Start from an empty buffer; whatever earlier tests recorded is discarded with this test's transaction
+        buffer.flush()
+        EndpointQueryStats.objects.all().delete()
+
+    def get(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+
+        self.assertEqual(response.status_code, 200)
+
+        return response, len(queries)
+
+    def test_server_timing_reports_the_queries(self):
+        response, queries = self.get('/api/product')
+
+        self.assertRegex(response['Server-Timing'], (
+            r'^db;dur=[0-9.]+;desc="' + str(queries) + r' queries, 0 duplicates", '
+            r'render;dur=[0-9.]+;desc="Serialization", '
+            r'total;dur=[0-9.]+$'
+        ))
+
+    def test_requests_are_aggregated_per_route_and_flushed_outside_requests(self):
+        _, first = self.get('/api/product')
+        _, second = self.get('/api/product')
+        _, vendor = self.get('/api/vendor')
+
+        # Nothing is written by the requests themselves
+        self.assertFalse(EndpointQueryStats.objects.exists())
+
+        buffer.flush()
+        self.get('/api/product')
+        buffer.flush()
+
+        stats = {(row.method, row.route): row for row in EndpointQueryStats.objects.all()}
+
+        self.assertEqual(set(stats), {('GET', 'api/product'), ('GET', 'api/vendor')})
+        self.assertEqual(stats['GET', 'api/product'].requests, 3)
+        self.assertEqual(stats['GET', 'api/product'].queries, first + second * 2)
+        self.assertEqual(stats['GET', 'api/product'].max_queries, max(first, second))
+        self.assertEqual((stats['GET', 'api/vendor'].requests, stats['GET', 'api/vendor'].queries), (1, vendor))
+
+    def test_flusher_thread_starts_with_the_first_request(self):
+        stats = EndpointStatsBuffer()
+
+        stats.add('api/product', 'GET', QueryRecorder(), 0, 0)
+        self.assertIsNone(stats._flusher)
+
+        with mock.patch.object(EndpointStatsBuffer, 'run') as run, override_settings(QUERY_STATS_FLUSH_INTERVAL=30):
+            stats.add('api/product', 'GET', QueryRecorder(), 0, 0)
+            stats._flusher.join()
+
+        self.assertTrue(stats._flusher.daemon)
+        run.assert_called_once_with()
+
+    def test_query_report_ranks_the_recorded_endpoints(self):
+        EndpointQueryStats.objects.create(route='api/product', method='GET', requests=2, queries=10, duplicate_queries=2, max_queries=6, top_duplicate='SELECT 1')
+        EndpointQueryStats.objects.create(route='api/vendor', method='GET', requests=4, queries=8, max_queries=2)
+
+        out = io.StringIO()
+        call_command('query_report', stdout=out)
+        lines = out.getvalue().splitlines()
+
+        self.assertTrue(lines[1].startswith('GET /api/product'))
+        self.assertEqual(lines[1].split()[2:5], ['2', '5.0', '6'])
+        self.assertEqual(lines[2], '    most repeated: SELECT 1')
+        self.assertTrue(lines[3].startswith('GET /api/vendor'))
+
+        out = io.StringIO()
+        call_command('query_report', order_by='requests', top=1, reset=True, stdout=out)
+
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+        self.assertIn('GET /api/vendor', out.getvalue())
+        self.assertFalse(EndpointQueryStats.objects.exists())
+
+
+class PrincipalCacheTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.principal = Principal.from_user(self.user)
+
+    def test_entries_expire_after_the_ttl(self):
+        principals = PrincipalCache(ttl=60)
+
+        with mock.patch('api.principal.time.monotonic', return_value=1000.0):
+            principals.set('manager', self.principal)
+
+        with mock.patch('api.principal.time.monotonic', return_value=1059.0):
+            self.assertIs(principals.get('manager'), self.principal)
+
+        with mock.patch('api.principal.time.monotonic', return_value=1060.0):
+            self.assertIsNone(principals.get('manager'))
+
+        self.assertEqual(len(principals), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        principals = PrincipalCache(maxsize=2)
+
+        principals.set('a', self.principal)
+        principals.set('b', self.principal)
+        principals.get('a')
+        principals.set('c', self.principal)
+
+        self.assertEqual([key for key in 'abc' if principals.get(key)], ['a', 'c'])
+
+        disabled = PrincipalCache(maxsize=0)
+        disabled.set('a', self.principal)
+        self.assertIsNone(disabled.get('a'))
+
+    def test_a_load_that_raced_with_an_invalidation_is_not_stored(self):
+        principals = PrincipalCache()
+
+        generation = principals.generation
+        principals.invalidate('manager')
+        principals.set('manager', self.principal, generation)
+        self.assertIsNone(principals.get('manager'))
+
+        generation = principals.generation
+        principals.clear()
+        principals.set('manager', self.principal, generation)
+        self.assertIsNone(principals.get('manager'))
+
+        principals.set('manager', self.principal, principals.generation)
+        self.assertIs(principals.get('manager'), self.principal)
+
+    def test_signals_invalidate_the_cache(self):
+        self.assertEqual(get_principal(self.user.email).role, 'MANAGER')
+
+        # The member's own row
+        self.user.role = self.legal_entity.roles.get(role='VIEWER')
+        self.user.save()
+        self.assertEqual(get_principal(self.user.email).role, 'VIEWER')
+
+        # A row shared by many principals clears the whole cache
+        role = self.user.role
+        role.approve = True
+        role.save()
+        self.assertTrue(get_principal(self.user.email).approve)
+
+        self.legal_entity.business_num = 'Luna Corp.'
+        self.legal_entity.save()
+        self.assertEqual(get_principal(self.user.email).legal_entity_name, 'Luna Corp.')
+
+        # Requests see the change too
+        self.user.role = self.legal_entity.roles.get(role='MANAGER')
+        self.user.save()
+        self.assertEqual(self.client.get('/api/account').json()['role'], 'MANAGER')
+
+    def test_warm_requests_do_not_load_the_principal(self):
+        self.client.get('/api/account')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/account')
+
+        self.assertFalse([query for query in queries if 'api_user' in query['sql']])
+
+
+class PaginationTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.vendors = [self.create_vendor(f'VND-{i}', name='Vendor' if i % 2 else f'Vendor {i}') for i in range(5)]
+
+    def request(self, **params):
+        return Request(RequestFactory().get('/', params))
+
+    def walk(self, queryset, size):
+        # Every page of a cursor walk, following nextCursor from the first page
+        pages = []
+        cursor = ''
+
+        while cursor is not None:
+            pagination = Pagination()
+            pages.append([vendor.code for vendor in pagination.paginate_queryset(queryset, self.request(cursor=cursor, size=size))])
+            cursor = pagination.get_paginated_data([])['nextCursor']
+
+        return pages
+
+    def test_cursor_pages_cover_every_row_once(self):
+        vendors = Vendor.objects.order_by('id')
+        codes = list(vendors.values_list('code', flat=True))
+
+        self.assertEqual(self.walk(vendors, 2), [codes[0:2], codes[2:4], codes[4:]])
+
+        # A last page that is exactly full has no next cursor either
+        Vendor.objects.get(code=codes[0]).delete()
+        self.assertEqual(self.walk(vendors, 2), [codes[1:3], codes[3:5]])
+
+    def test_descending_orderings_break_ties_on_the_primary_key(self):
+        vendors = Vendor.objects.order_by('-name')
+        codes = list(vendors.order_by('-name', 'pk').values_list('code', flat=True))
+
+        self.assertEqual(Pagination().get_cursor_ordering(vendors), ['-name', 'pk'])
+        self.assertEqual(sum(self.walk(vendors, 2), []), codes)
+
+    def test_tampered_and_invalid_cursors_are_rejected(self):
+        pagination = Pagination()
+        pagination.paginate_queryset(Vendor.objects.order_by('id'), self.request(cursor='', size=2))
+        cursor = pagination.next_cursor
+
+        cursors = [
+            cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B'),
+            'not-a-cursor',
+            signing.dumps([str(self.vendors[0].pk)], salt='another salt'),
+            # Signed, but not a position in this ordering
+            signing.dumps(['a', 'b'], salt=Pagination.cursor_salt),
+            signing.dumps({'id': 1}, salt=Pagination.cursor_salt),
+        ]
+
+        for invalid in cursors:
+            with self.assertRaises(NotFound):
+                Pagination().paginate_queryset(Vendor.objects.order_by('id'), self.request(cursor=invalid, size=2))
+
+        response = self.client.get('/api/vendor', {'cursor': cursors[0]})
+        self.assertEqual(response.status_code, 404)
+
+    def test_totals_are_counted_on_request_and_reused_per_query(self):
+        vendors = Vendor.objects.order_by('id')
+
+        self.assertIsNone(Pagination().get_total(vendors, self.request()))
+        self.assertEqual(Pagination().get_total(vendors, self.request(total='true')), 5)
+
+        self.create_vendor('VND-5')
+        # An estimate until the next exact count
+        self.assertEqual(Pagination().get_total(vendors, self.request()), 5)
+        self.assertIsNone(Pagination().get_total(vendors.filter(name='Vendor'), self.request()))
+
+    def test_total_cache_keys_include_the_query_parameters(self):
+        # Both print as ... "code" = x AND "name" = y AND "name" = z
+        first = Vendor.objects.filter(code='x AND "api_vendor"."name" = y').filter(name='z')
+        second = Vendor.objects.filter(code='x').filter(name='y AND "api_vendor"."name" = z')
+        self.assertEqual(str(first.query), str(second.query))
+
+        self.assertEqual(Pagination().get_total(first, self.request(total='1')), 0)
+        self.assertIsNone(Pagination().get_total(second, self.request()))
+
+
+class DatabaseMetricsTest(APITestCase):
+    def test_snapshot_counts_requests(self):
+        first = self.client.get('/api/metrics/db').json()
+        second = self.client.get('/api/metrics/db').json()
+
+        self.assertEqual(set(first), {'created', 'reused', 'closed', 'open', 'requests'})
+        self.assertEqual(second['requests'], first['requests'] + 1)
+        # The test client keeps the test database connection open between requests
+        self.assertEqual(second['reused'], first['reused'] + 1)
+
+    def test_requires_a_manager(self):
+        self.user.role = self.legal_entity.roles.get(role='MEMBER')
+        self.user.save()
+
+        self.assertEqual(self.client.get('/api/metrics/db').status_code, 403)
+
+
+class PurchaseRequisitionCounterTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        vendor = self.create_vendor('VND')
+        products = [self.create_product(f'PRD-{i}') for i in range(2)]
+
+        for product in products:
+            Price.objects.create(product=product, vendor=vendor, price=5)
+
+        self.purchase_requisition = self.create_purchase_requisition('Chairs', lines=[(product, vendor, 1) for product in products])
+
+    def counters(self):
+        return PurchaseRequisition.objects.values_list('comment_count', 'line_count').get(pk=self.purchase_requisition.pk)
+
+    def test_comments_and_lines_update_the_counters(self):
+        path = f'/api/purchase-requisition/{self.purchase_requisition.pk}/comment'
+
+        self.client.post(path, {'content': 'First'}, content_type='application/json')
+        self.client.post(path, {'content': 'Second'}, content_type='application/json')
+        self.assertEqual(self.counters(), (2, 2))
+
+        self.client.delete(f'{path}/{Comment.objects.first().pk}')
+        self.purchase_requisition.product_purchase_requisitions.first().delete()
+        self.assertEqual(self.counters(), (1, 1))
+
+        # A full save of an instance loaded before the writes keeps the counters
+        self.purchase_requisition.name = 'Desks'
+        self.purchase_requisition.save()
+        self.assertEqual(self.counters(), (1, 1))
+
+        response = self.client.get(f'/api/purchase-requisition/{self.purchase_requisition.pk}')
+        self.assertEqual((response.json()['commentCount'], response.json()['lineCount']), (1, 1))
+
+    def test_deleting_a_requisition_skips_the_per_child_receivers(self):
+        def delete(comments):
+            purchase_requisition = self.create_purchase_requisition('Deleted', lines=[(line.product, line.vendor, 1) for line in self.purchase_requisition.product_purchase_requisitions.all()])
+
+            for i in range(comments):
+                Comment.objects.create(content=f'Comment {i}', purchase_requisition=purchase_requisition, user=self.user)
+
+            with mock.patch.object(hub, 'publish') as publish, CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.delete(f'/api/purchase-requisition/{purchase_requisition.pk}').status_code, 200)
+
+            publish.assert_not_called()
+            return len(queries)
+
+        # The first request also loads the principal
+        delete(1)
+        # No UPDATE of the deleted requisition per comment or line
+        self.assertEqual(delete(1), delete(10))
+
+    def test_recount_repairs_drifted_counters(self):
+        PurchaseRequisition.objects.update(comment_count=7, line_count=0)
+        self.create_purchase_requisition('Untouched')
+
+        out = io.StringIO()
+        call_command('recount_purchase_requisitions', stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Repaired 1 purchase requisitions')
+        self.assertEqual(self.counters(), (0, 2))
+
+
+class PriceMatrixTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.vendor = self.create_vendor('VND')
+        self.products = [self.create_product(f'PRD-{i}') for i in range(3)]
+        self.prices = [Price.objects.create(product=product, vendor=self.vendor, price=10 + i) for i, product in enumerate(self.products)]
+
+        self.purchase_requisition = self.create_purchase_requisition('Chairs', lines=[(product, self.vendor, 2) for product in self.products])
+
+    def test_lines_without_price_annotations_share_one_matrix(self):
+        purchase_requisition = PurchaseRequisition.objects.select_related('project', 'requester').prefetch_related(
+            'product_purchase_requisitions__product', 'product_purchase_requisitions__vendor'
+        ).get(pk=self.purchase_requisition.pk)
+
+        # One Price query for every line and the total, whatever the number of lines
+        with CaptureQueriesContext(connection) as queries:
+            data = PurchaseRequisitionSerializer(purchase_requisition).data
+
+        self.assertEqual(len([query for query in queries if 'api_price' in query['sql']]), 1)
+        self.assertEqual([line['price'] for line in data['products']], [10, 11, 12])
+        self.assertEqual(data['totalPrice'], 66)
+
+        with CaptureQueriesContext(connection) as queries:
+            PurchaseRequisitionSerializer(purchase_requisition).data
+
+        self.assertFalse([query for query in queries if 'api_price' in query['sql']])
+
+    def test_price_changes_invalidate_the_matrix(self):
+        self.assertEqual(get_price_matrix(self.legal_entity.pk).get(self.products[0].pk, self.vendor.pk), 10)
+
+        self.client.patch('/api/product/update-price', {'id': str(self.prices[0].id), 'price': 20}, content_type='application/json')
+        self.assertEqual(get_price_matrix(self.legal_entity.pk).get(self.products[0].pk, self.vendor.pk), 20)
+
+        self.client.delete(f'/api/product/delete-price/{self.prices[1].id}')
+        self.assertNotIn((self.products[1].pk, self.vendor.pk), get_price_matrix(self.legal_entity.pk))
+
+        self.client.post('/api/product/add-price', {'productId': str(self.products[1].pk), 'vendorCode': 'VND', 'price': 7}, content_type='application/json')
+        self.assertEqual(get_price_matrix(self.legal_entity.pk).total(self.purchase_requisition.product_purchase_requisitions.all()), 78)
+
+        self.assertEqual(self.client.get('/api/metrics/cache').json()['price-matrix']['misses'], 4)
+
+    def test_lines_are_validated_against_the_database(self):
+        get_price_matrix(self.legal_entity.pk)
+
+        # A change the cached matrix never heard of, as when another worker made it
+        Price.objects.filter(pk=self.prices[0].pk).update(vendor=self.create_vendor('OTHER'))
+
+        response = self.client.post('/api/purchase-requisition', {
+            'purchaseName': 'Requisition',
+            'priority': 'LOW',
+            'projectCode': 'PRJ',
+            'targetDate': '01-10-2023',
+            'dueDate': '31-10-2023',
+            'products': [{'code': 'PRD-0', 'vendorCode': 'VND', 'quantity': 1}],
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), [{'vendorCode': ['Vendor does not supply this product']}])
+
+    def test_matrix_is_skipped_without_a_shared_cache_or_over_the_size_bound(self):
+        with override_settings(TENANT_CACHE_ALLOW_LOCAL=False):
+            self.assertIsNone(get_price_matrix(self.legal_entity.pk))
+
+        with mock.patch('api.pricing.PRICE_MATRIX_MAX_SIZE', 2):
+            self.assertIsNone(get_price_matrix(self.legal_entity.pk))
+            # The size check is cached with the matrix
+            self.assertIsNone(get_price_matrix(self.legal_entity.pk))
+
+        self.assertEqual(self.client.get('/api/metrics/cache').json()['price-matrix'], {'hits': 1, 'misses': 1, 'hitRate': 0.5})
+
+        # Rendering falls back to the prices of the lines shown
+        purchase_requisition = PurchaseRequisition.objects.get(pk=self.purchase_requisition.pk)
+        data = PurchaseRequisitionSerializer(purchase_requisition).data
+
+        self.assertEqual([line['price'] for line in data['products']], [10, 11, 12])
+        self.assertEqual(data['totalPrice'], 66)
+
+
+class IndexUsageTest(APITestCase):
+    # EXPLAIN the list, filter and ordering patterns of api.views and check
+    # each one is served by the index added for it. PostgreSQL is told to
+    # avoid sequential scans, which it would otherwise prefer on these tiny
+    # tables; SQLite picks its indexes without statistics and is checked as is.
+
+    def assertUsesIndex(self, queryset, index):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+        plan = queryset.explain()
+
+        self.assertIn(index, plan, f'{index} is not used by:\n{plan}')
+
+    def test_list_pages_use_legal_entity_indexes(self):
+        cursor = uuid.uuid4()
+
+        self.assertUsesIndex(self.legal_entity.products.order_by('id')[:20], 'product_entity_id')
+        self.assertUsesIndex(self.legal_entity.vendors.filter(id__gt=cursor).order_by('id')[:20], 'vendor_entity_id')
+        self.assertUsesIndex(self.legal_entity.projects.order_by('id')[:20], 'project_entity_id')
+        self.assertUsesIndex(self.legal_entity.purchase_requisitions.order_by('id')[:20], 'requisition_entity_id')
+        self.assertUsesIndex(self.legal_entity.users.order_by('id')[:20], 'user_entity_id')
+
+    def test_filters_use_their_indexes(self):
+        purchase_requisitions = self.legal_entity.purchase_requisitions
+
+        self.assertUsesIndex(self.legal_entity.projects.filter(is_default=True), 'project_entity_default')
+        self.assertUsesIndex(purchase_requisitions.filter(status__in=['COMPLETED', 'CANCELLED']), 'requisition_entity_status')
+        self.assertUsesIndex(purchase_requisitions.filter(target_date__gte=datetime.date(2023, 1, 1)).order_by('target_date', 'id'), 'requisition_entity_target')
+        self.assertUsesIndex(Comment.objects.filter(purchase_requisition=uuid.uuid4()).order_by('-created_at', 'pk')[:20], 'comment_requisition_created')
+
+    def test_searched_lists_use_name_indexes(self):
+        # The LIKE filter and name ordering api.search falls back to; on PostgreSQL name breaks rank ties
+        self.assertUsesIndex(self.legal_entity.products.filter(name__icontains='drill').order_by('name')[:20], 'product_entity_name')
+        self.assertUsesIndex(self.legal_entity.purchase_requisitions.filter(name__icontains='drill').order_by('name')[:20], 'requisition_entity_name')
+
+
+class SearchTest(APITestCase):
+    def search(self, path, query):
+        response = self.client.get(path, {'search': query})
+
+        self.assertEqual(response.status_code, 200)
+
+        return response.json()['data']
+
+    def test_product_search_by_vendor_code_returns_each_product_once(self):
+        product = self.create_product('PRD-1', name='Drill')
+        self.create_product('PRD-2', name='Hammer')
+
+        for code in ['ACME-1', 'ACME-2']:
+            Price.objects.create(product=product, vendor=self.create_vendor(code), price=1)
+
+        products = self.search('/api/product', 'acme')
+
+        self.assertEqual([item['code'] for item in products], ['PRD-1'])
+
+    def test_product_search_by_name_and_code(self):
+        self.create_product('PRD-1', name='Drill')
+        self.create_product('PRD-2', name='Hammer')
+
+        self.assertEqual([item['code'] for item in self.search('/api/product', 'hAMm')], ['PRD-2'])
+        self.assertEqual(len(self.search('/api/product', 'prd')), 2)
+
+    def test_vendor_search(self):
+        self.create_vendor('VND-1', name='Acme', business_num='123')
+        self.create_vendor('VND-2', name='Globex', business_num='456')
+
+        self.assertEqual([item['code'] for item in self.search('/api/vendor', 'glob')], ['VND-2'])
+        self.assertEqual([item['code'] for item in self.search('/api/vendor', '123')], ['VND-1'])
+
+    def test_project_search(self):
+        Project.objects.create(name='Office', code='OFF', label='Renovation', legal_entity=self.legal_entity)
+
+        self.assertEqual([item['code'] for item in self.search('/api/project', 'renov')], ['OFF'])
+
+    def test_purchase_requisition_search_by_name_and_project_code(self):
+        project = Project.objects.create(name='Office', code='OFF', label='Renovation', legal_entity=self.legal_entity)
+        self.create_purchase_requisition('Chairs', project=project)
+        self.create_purchase_requisition('Desks')
+
+        self.assertEqual([item['purchaseName'] for item in self.search('/api/purchase-requisition', 'off')], ['Chairs'])
+        self.assertEqual([item['purchaseName'] for item in self.search('/api/purchase-requisition', 'desk')], ['Desks'])
+
+
+class PurchaseRequisitionCreateTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.vendor = self.create_vendor('VND')
+        self.products = [self.create_product(f'PRD-{i}') for i in range(40)]
+
+        for product in self.products:
+            Price.objects.create(product=product, vendor=self.vendor, price=5)
+
+    def create(self, products):
+        return self.client.post('/api/purchase-requisition', {
+            'purchaseName': 'Requisition',
+            'priority': 'LOW',
+            'projectCode': 'PRJ',
+            'targetDate': '01-10-2023',
+            'dueDate': '31-10-2023',
+            'products': [{'code': product.code, 'vendorCode': 'VND', 'quantity': 2} for product in products],
+        }, content_type='application/json')
+
+    def count_queries(self, products):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.create(products)
+
+        self.assertEqual(response.status_code, 200)
+
+        return len(queries)
+
+    def test_query_count_is_constant_in_line_count(self):
+        # Warm the principal cache
+        self.client.get('/api/account')
+
+        self.assertEqual(self.count_queries(self.products[:2]), self.count_queries(self.products))
+        self.assertEqual(ProductPurchaseRequisition.objects.count(), 42)
+        self.assertEqual(sorted(PurchaseRequisition.objects.values_list('line_count', flat=True)), [2, 40])
+
+    def test_invalid_line_leaves_nothing_behind(self):
+        other = self.create_vendor('OTHER')
+
+        response = self.client.post('/api/purchase-requisition', {
+            'purchaseName': 'Requisition',
+            'priority': 'LOW',
+            'projectCode': 'PRJ',
+            'targetDate': '01-10-2023',
+            'dueDate': '31-10-2023',
+            'products': [
+                {'code': 'PRD-0', 'vendorCode': 'VND', 'quantity': 1},
+                {'code': 'PRD-1', 'vendorCode': 'OTHER', 'quantity': 1},
+                {'code': 'MISSING', 'vendorCode': 'VND', 'quantity': 1},
+            ],
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), [
+            {},
+            {'vendorCode': ['Vendor does not supply this product']},
+            {'code': ['Product not found']},
+        ])
+        self.assertFalse(PurchaseRequisition.objects.exists())
+        self.assertFalse(other.product_purchase_requisitions.exists())
+
+
+class BudgetTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.product = self.create_product('PRD')
+        self.vendor = self.create_vendor('VND')
+        Price.objects.create(product=self.product, vendor=self.vendor, price=100)
+
+        self.project.purchase_allowance = 250
+        self.project.save()
+
+    def complete(self, purchase_requisition):
+        return transition(PurchaseRequisition.objects.with_totals().get(pk=purchase_requisition.pk), 'COMPLETED')
+
+    def test_completion_charges_the_project_once(self):
+        purchase_requisition = self.create_purchase_requisition('Requisition', lines=[(self.product, self.vendor, 2)], is_approved=True, status='IN_PROGRESS')
+
+        self.complete(purchase_requisition)
+
+        with self.assertRaises(InvalidTransition):
+            self.complete(purchase_requisition)
+
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.current_purchase, self.project.purchase_count), (200, 1))
+
+    def test_completion_over_allowance_is_rolled_back(self):
+        purchase_requisition = self.create_purchase_requisition('Requisition', lines=[(self.product, self.vendor, 3)], is_approved=True, status='IN_PROGRESS')
+
+        with self.assertRaises(BudgetExceeded):
+            self.complete(purchase_requisition)
+
+        purchase_requisition.refresh_from_db()
+        self.project.refresh_from_db()
+        self.assertEqual(purchase_requisition.status, 'IN_PROGRESS')
+        self.assertEqual((self.project.current_purchase, self.project.purchase_count), (0, 0))
+
+    def test_completion_with_unpriced_lines_is_refused(self):
+        # The other vendor has no price for the product; counting it as 0 would under-charge the project
+        other = self.create_vendor('OTHER')
+        purchase_requisition = self.create_purchase_requisition('Requisition', lines=[(self.product, self.vendor, 1)], is_approved=True, status='IN_PROGRESS')
+        ProductPurchaseRequisition.objects.create(product=self.create_product('UNPRICED'), vendor=other, quantity=1, purchase_requisition=purchase_requisition)
+
+        response = self.client.post(f'/api/purchase-requisition/{purchase_requisition.pk}/set-status', {'status': 'COMPLETED'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'message': 'Purchase Requisition has products without a price from their vendor'})
+
+        purchase_requisition.refresh_from_db()
+        self.project.refresh_from_db()
+        self.assertEqual(purchase_requisition.status, 'IN_PROGRESS')
+        self.assertEqual((self.project.current_purchase, self.project.purchase_count), (0, 0))
+        self.assertFalse(PurchaseRequisitionTransition.objects.exists())
+
+        # Once priced it completes for the full amount
+        Price.objects.create(product=Product.objects.get(code='UNPRICED'), vendor=other, price=50)
+        self.complete(purchase_requisition)
+
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.current_purchase, self.project.purchase_count), (150, 1))
+
+    def test_deprecated_price_properties(self):
+        purchase_requisition = self.create_purchase_requisition('Requisition', lines=[(self.product, self.vendor, 2)])
+        line = purchase_requisition.product_purchase_requisitions.get()
+
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(purchase_requisition.total_price, 200)
+
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(line.price, 200)
+
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(purchase_requisition.total_comment, 0)
+
+        # The annotation is read without a query or a warning
+        annotated = PurchaseRequisition.objects.with_totals().get(pk=purchase_requisition.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(annotated.total_price, 200)
+
+
+@unittest.skipIf(
+    connection.vendor == 'sqlite' and connection.creation.is_in_memory_db(connection.settings_dict['TEST']['NAME'] or ':memory:'),
+    'needs a PostgreSQL or file-based SQLite test database'
+)
+class BudgetConcurrencyTest(FixturesMixin, TransactionTestCase):
+    def setUp(self):
+        self.create_fixtures()
+
+        product = self.create_product('PRD')
+        vendor = self.create_vendor('VND')
+        Price.objects.create(product=product, vendor=vendor, price=10)
+
+        # Room for 25 of the 40 requisitions of 10 each
+        self.project.purchase_allowance = 250
+        self.project.save()
+
+        self.purchase_requisitions = [
+            self.create_purchase_requisition(f'Requisition {i}', lines=[(product, vendor, 1)], is_approved=True, status='IN_PROGRESS')
+            for i in range(40)
+        ]
+
+    def test_concurrent_completions_keep_totals_exact(self):
+        results = []
+        start = threading.Barrier(8)
+
+        def worker(purchase_requisitions):
+            start.wait()
+
+            try:
+                for purchase_requisition in purchase_requisitions:
+                    try:
+                        transition(PurchaseRequisition.objects.with_totals().get(pk=purchase_requisition.pk), 'COMPLETED')
+                        results.append('completed')
+                    except (BudgetExceeded, InvalidTransition, TransitionConflict) as error:
+                        results.append(type(error).__name__)
+            finally:
+                connections.close_all()
+
+        # Every requisition is completed by two threads at once
+        threads = [
+            threading.Thread(target=worker, args=(self.purchase_requisitions[i % 4::4],))
+            for i in range(8)
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.project.refresh_from_db()
+        completed = PurchaseRequisition.objects.filter(status='COMPLETED').count()
+
+        self.assertEqual(results.count('completed'), 25)
+        self.assertEqual(completed, 25)
+        self.assertEqual(self.project.purchase_count, 25)
+        self.assertEqual(self.project.current_purchase, 250)
+
+
+class AsyncViewsTest(APITestCase):
+    # The async views must answer exactly like the sync views they replace
+
+    def setUp(self):
+        super().setUp()
+
+        vendor = self.create_vendor('VND')
+        Contact.objects.create(name='Contact', phone='0123', position='Sales', vendor=vendor)
+        products = [self.create_product(f'PRD-{i}') for i in range(3)]
+
+        for i, product in enumerate(products):
+            Price.objects.create(product=product, vendor=vendor, price=10 + i)
+
+        self.purchase_requisition = self.create_purchase_requisition('Requisition', lines=[(product, vendor, 2) for product in products])
+        Comment.objects.create(content='Comment', purchase_requisition=self.purchase_requisition, user=self.user)
+
+        self.factory = AsyncRequestFactory()
+
+    async def assertSameResponse(self, view, path, params=None, **kwargs):
+        expected = await sync_to_async(self.client.get)(path, params or {})
+        request = self.factory.get(path, params or {}, headers={'Authorization': self.client.defaults['HTTP_AUTHORIZATION']})
+        response = await view(request, **kwargs)
+
+        if hasattr(response, 'render'):
+            response = await sync_to_async(response.render)()
+
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(json.loads(response.content), expected.json())
+
+    async def test_async_views_match_sync_views(self):
+        await self.assertSameResponse(async_views.account, '/api/account')
+        await self.assertSameResponse(async_views.product, '/api/product')
+        await self.assertSameResponse(async_views.product, '/api/product', {'search': 'prd-1'})
+        await self.assertSameResponse(async_views.product, '/api/product', {'size': 2, 'page': 'last'})
+        await self.assertSameResponse(async_views.product, '/api/product', {'page': 5})
+        await self.assertSameResponse(async_views.product, '/api/product', {'size': 2, 'page': 2})
+        await self.assertSameResponse(async_views.product, '/api/product', {'page': 'first'})
+        await self.assertSameResponse(async_views.product, '/api/product', {'page': 0})
+        await self.assertSameResponse(async_views.vendor, '/api/vendor')
+        await self.assertSameResponse(async_views.purchase_requisition, '/api/purchase-requisition')
+
+        await self.assertSameResponse(
+            async_views.purchase_requisition_comment,
+            f'/api/purchase-requisition/{self.purchase_requisition.id}/comment',
+            purchase_requisition_id=str(self.purchase_requisition.id)
+        )
+
+    async def test_invalid_tokens_are_logged(self):
+        request = self.factory.get('/api/account', headers={'Authorization': 'Bearer invalid'})
+
+        with self.assertLogs('api.action', 'INFO') as logs:
+            response = await async_views.account(request)
+            expected = await sync_to_async(self.client.get)('/api/account', HTTP_AUTHORIZATION='Bearer invalid')
+
+        self.assertEqual((response.status_code, json.loads(response.content)), (401, expected.json()))
+        self.assertEqual(len(logs.records), 2)
+
+    async def test_cursor_mode_is_served_by_the_sync_view(self):
+        await self.assertSameResponse(async_views.product, '/api/product', {'cursor': '', 'size': 2})
+
+
+class ORJSONRendererTest(APITestCase):
+    def assertSameBytes(self, data):
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_list_payloads_are_byte_identical(self):
+        vendor = self.create_vendor('VND', name='Fournisseur \u00e9')
+        products = [self.create_product(f'PRD-{i}') for i in range(3)]
+
+        for i, product in enumerate(products):
+            Price.objects.create(product=product, vendor=vendor, price=10.5 + i)
+
+        purchase_requisition = self.create_purchase_requisition('Requisition', lines=[(product, vendor, 2) for product in products])
+        Comment.objects.create(content='Comment \u2028 line', purchase_requisition=purchase_requisition, user=self.user)
+
+        for path in ['/api/product', '/api/vendor', '/api/purchase-requisition', f'/api/purchase-requisition/{purchase_requisition.id}/comment']:
+            response = self.client.get(path)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_native_types_are_byte_identical(self):
+        self.assertSameBytes({
+            'id': uuid.uuid4(),
+            'price': decimal.Decimal('12.50'),
+            'at': datetime.datetime(2023, 10, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'day': datetime.date(2023, 10, 1),
+            'time': datetime.time(8, 15),
+            'float': 1234.5,
+            'text': 'caf\u00e9 \u2029',
+            1: None,
+        })
+
+        # Integers orjson cannot represent go through JSONRenderer
+        self.assertSameBytes({'big': 2 ** 70})
+
+    def test_floats_differ_only_in_notation(self):
+        data = {'large': 1e16, 'small': 1e-7, 'plain': 1234.5}
+
+        self.assertEqual(ORJSONRenderer().render(data), b'{"large":1e16,"small":1e-7,"plain":1234.5}')
+        self.assertEqual(JSONRenderer().render(data), b'{"large":1e+16,"small":1e-07,"plain":1234.5}')
+        self.assertEqual(json.loads(ORJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+    def test_non_finite_floats_render_as_null(self):
+        data = {'nan': float('nan'), 'inf': float('inf'), 'negative': float('-inf')}
+
+        self.assertEqual(ORJSONRenderer().render(data), b'{"nan":null,"inf":null,"negative":null}')
+
+        with self.assertRaises(ValueError):
+            JSONRenderer().render(data)
+
+    def test_parser_matches_json_parser(self):
+        body = json.dumps({'name': 'caf\u00e9', 'big': 2 ** 70, 'items': [1, 2.5, None]}).encode()
+
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(body)), json.loads(body))
+
+
+class ConditionalGetTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.vendor = self.create_vendor('VND')
+        self.product = self.create_product('PRD')
+        self.price = Price.objects.create(product=self.product, vendor=self.vendor, price=10)
+        self.purchase_requisition = self.create_purchase_requisition('Requisition', lines=[(self.product, self.vendor, 1)])
+
+    def assertRevalidates(self, path, change):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        change()
+
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified_skips_the_serializer(self):
+        path = f'/api/purchase-requisition/{self.purchase_requisition.id}'
+        etag = self.client.get(path)['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(len(queries), 1)
+
+    def test_product_follows_its_prices(self):
+        self.assertRevalidates('/api/product/PRD', lambda: Price.objects.filter(pk=self.price.pk).first().save())
+
+    def test_vendor_follows_its_contacts(self):
+        self.assertRevalidates('/api/vendor/VND', lambda: Contact.objects.create(name='Contact', phone='0123', position='Sales', vendor=self.vendor))
+
+    def test_purchase_requisition_follows_comments_and_prices(self):
+        path = f'/api/purchase-requisition/{self.purchase_requisition.id}'
+
+        self.assertRevalidates(path, lambda: Comment.objects.create(content='Comment', purchase_requisition=self.purchase_requisition, user=self.user))
+        self.assertRevalidates(path, lambda: self.client.patch('/api/product/update-price', {'id': str(self.price.id), 'price': 12}, content_type='application/json'))
+
+    def test_catalog_import_bumps_the_rows_rendering_its_vendors(self):
+        def rename_vendor():
+            CatalogImport(self.legal_entity).run([(1, {'type': 'vendor', 'code': 'VND', 'businessName': 'Renamed', 'businessNumber': '2'})])
+
+        self.assertRevalidates('/api/product/PRD', rename_vendor)
+        self.assertRevalidates(f'/api/purchase-requisition/{self.purchase_requisition.id}', rename_vendor)
+
+    def test_legal_entity_and_roles_follow_the_organisation(self):
+        role = self.legal_entity.roles.get(role='VIEWER')
+
+        self.assertRevalidates('/api/entity/info', lambda: self.client.post('/api/department', {'departmentCode': 'DEP', 'departmentName': 'Department'}, content_type='application/json'))
+        self.assertRevalidates('/api/role', lambda: self.client.patch('/api/role', {'id': str(role.id), 'approve': False}, content_type='application/json'))
+
+
+class TenantCacheTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+        self.department = Department.objects.create(code='DEP', name='Department', legal_entity=self.legal_entity)
+        Team.objects.create(code='TEAM', name='Team', department=self.department)
+
+    def test_org_tree_is_served_from_cache_until_it_changes(self):
+        first = self.client.get('/api/entity/info').json()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/entity/info').json(), first)
+
+        # Only the updated_at lookup of the conditional GET check
+        self.assertEqual(len(queries), 1)
+
+        response = self.client.post('/api/team', {'departmentId': str(self.department.id), 'teamCode': 'NEW', 'teamName': 'New team'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        teams = self.client.get('/api/entity/info').json()['departments'][0]['teams']
+        self.assertEqual(sorted(team['teamCode'] for team in teams), ['NEW', 'TEAM'])
+
+        response = self.client.delete(f'/api/department/delete/{self.department.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/entity/info').json()['departments'], [])
+
+        self.assertEqual(self.client.get('/api/metrics/cache').json()['org-tree'], {'hits': 1, 'misses': 3, 'hitRate': 0.25})
+
+    @override_settings(TENANT_CACHE_ALLOW_LOCAL=False)
+    def test_process_local_backend_is_bypassed(self):
+        self.client.get('/api/entity/info')
+        Team.objects.filter(code='TEAM').update(name='Renamed')
+
+        # Built from the database every time; no worker can serve a stale copy
+        teams = self.client.get('/api/entity/info').json()['departments'][0]['teams']
+        self.assertEqual(teams[0]['teamName'], 'Renamed')
+        self.assertEqual(self.client.get('/api/metrics/cache').json()['org-tree'], {'hits': 0, 'misses': 0, 'hitRate': None})
+
+    def test_role_table_follows_role_updates(self):
+        role = self.legal_entity.roles.get(role='VIEWER')
+
+        self.client.get('/api/role')
+        self.client.patch('/api/role', {'id': str(role.id), 'approve': False}, content_type='application/json')
+
+        roles = {item['role']: item for item in self.client.get('/api/role').json()}
+        self.assertFalse(roles['VIEWER']['approve'])
+
+
+class PurchaseRequisitionExportTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        vendor = self.create_vendor('VND', name='Vendor')
+        products = [self.create_product(f'PRD-{i}') for i in range(2)]
+
+        for i, product in enumerate(products):
+            Price.objects.create(product=product, vendor=vendor, price=10 + i)
+
+        self.create_purchase_requisition('Chairs', lines=[(product, vendor, 3) for product in products])
+        self.create_purchase_requisition('Empty', status='COMPLETED', target_date=datetime.date(2023, 12, 1))
+
+    def export(self, **params):
+        response = self.client.get('/api/purchase-requisition/export', params)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_has_one_row_per_line(self):
+        rows = list(csv.DictReader(io.StringIO(self.export())))
+
+        self.assertEqual([(row['purchaseName'], row['productCode'], row['unitPrice'], row['linePrice']) for row in rows], [
+            ('Chairs', 'PRD-0', '10.0', '30.0'),
+            ('Chairs', 'PRD-1', '11.0', '33.0'),
+            ('Empty', '', '', ''),
+        ])
+        self.assertEqual(rows[0]['projectCode'], 'PRJ')
+        self.assertEqual(rows[0]['requester'], 'manager')
+        self.assertEqual((rows[0]['targetDate'], rows[0]['dueDate']), ('01-10-2023', '31-10-2023'))
+
+    def test_ndjson_export_with_filters(self):
+        lines = [json.loads(line) for line in self.export(output='ndjson', status='COMPLETED,DRAFT', projectCode='PRJ', **{'from': '01-11-2023'}).splitlines()]
+
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['purchaseName'], 'Empty')
+        self.assertIsNone(lines[0]['productCode'])
+
+        self.assertEqual(self.export(output='ndjson', to='01-11-2023').count('\n'), 2)
+
+        # Exported dates are accepted back by the filters
+        self.assertEqual(lines[0]['targetDate'], '01-12-2023')
+        self.assertEqual(self.export(output='ndjson', **{'from': lines[0]['targetDate']}).count('\n'), 1)
+
+    def test_asgi_export_is_streamed_asynchronously(self):
+        expected = {output: self.export(output=output) for output in ('csv', 'ndjson')}
+
+        async def read(response):
+            return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        # Django would collect a sync iterator in memory before sending it over ASGI
+        with override_settings(SERVER_MODE='asgi'):
+            for output, body in expected.items():
+                response = self.client.get('/api/purchase-requisition/export', {'output': output})
+
+                self.assertTrue(response.is_async)
+                self.assertEqual(async_to_sync(read)(response), body)
+
+    def test_invalid_filters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/purchase-requisition/export', {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/purchase-requisition/export', {'status': 'UNKNOWN'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/purchase-requisition/export', {'from': '2023-01-01'}).status_code, 400)
+
+
+def image_file(width, height, image_format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, image_format)
+
+    return buffer.getvalue()
+
+
+def use_temporary_media(test):
+    # Uploaded files and thumbnails go to a directory removed after the test
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root)
+
+    settings_override = override_settings(MEDIA_ROOT=media_root)
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+
+
+@override_settings(THUMBNAIL_BACKGROUND=False, THUMBNAIL_FORMAT='WEBP')
+class ThumbnailTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        use_temporary_media(self)
+
+        self.product = self.create_product('PRD')
+
+    def upload(self, content, name='image.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/product/PRD/image', {'image': SimpleUploadedFile(name, content)})
+
+        self.assertEqual(response.status_code, 200)
+        self.product.refresh_from_db()
+
+        return self.product.thumbnails
+
+    def widths(self, thumbnails):
+        sizes = {}
+
+        for width, name in thumbnails.items():
+            with default_storage.open(name) as file:
+                sizes[width] = Image.open(file).size
+
+        return sizes
+
+    def test_thumbnails_are_rendered_without_upscaling(self):
+        self.product.image.save('PRD.png', ContentFile(image_file(400, 200)))
+
+        self.assertEqual(self.widths(generate_thumbnails(self.product)), {'160': (160, 80), '320': (320, 160)})
+        self.assertEqual(Product.objects.get(pk=self.product.pk).thumbnails, self.product.thumbnails)
+
+        # A smaller original gets a single derivative at its own width
+        self.product.image.save('PRD.png', ContentFile(image_file(100, 50)))
+        self.assertEqual(self.widths(generate_thumbnails(self.product)), {'160': (100, 50)})
+
+    def test_thumbnails_of_a_replaced_image_are_not_saved(self):
+        self.product.image.save('PRD.png', ContentFile(image_file(400, 200)))
+        stale = Product.objects.get(pk=self.product.pk)
+        self.product.image.save('PRD-new.png', ContentFile(image_file(400, 200)))
+
+        generate_thumbnails(stale)
+
+        self.assertEqual(Product.objects.get(pk=self.product.pk).thumbnails, {})
+
+    def test_reupload_deletes_the_previous_thumbnails(self):
+        previous = self.upload(image_file(800, 400))
+        self.assertEqual(set(previous), {'160', '320', '640'})
+
+        current = self.upload(image_file(200, 100, 'JPEG'), name='image.jpg')
+
+        self.assertEqual(self.widths(current), {'160': (160, 80)})
+        self.assertEqual([name for name in previous.values() if default_storage.exists(name)], list(current.values()))
+
+    @override_settings(THUMBNAIL_BACKGROUND=True)
+    def test_background_job(self):
+        self.product.image.save('PRD.png', ContentFile(image_file(400, 200)))
+
+        with mock.patch('api.thumbnails._executor') as executor, self.captureOnCommitCallbacks(execute=True):
+            schedule_thumbnails(self.product)
+
+        executor.submit.assert_called_once_with(thumbnails._run, Product, self.product.pk)
+
+        # The job closes its thread's connection, which here is the test's
+        with mock.patch('api.thumbnails.connection') as job_connection:
+            thumbnails._run(Product, self.product.pk)
+
+            with mock.patch('api.thumbnails.generate_thumbnails', side_effect=OSError('Broken image')), self.assertLogs('api.thumbnails', 'ERROR'):
+                thumbnails._run(Product, self.product.pk)
+
+        self.assertEqual(job_connection.close.call_count, 2)
+        self.assertEqual(set(Product.objects.get(pk=self.product.pk).thumbnails), {'160', '320'})
+
+
+@override_settings(THUMBNAIL_BACKGROUND=False, IMAGE_UPLOAD_MAX_SIZE=4096)
+class ImageUploadTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        use_temporary_media(self)
+
+        self.product = self.create_product('PRD')
+
+    def upload(self, content, name='image.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/product/PRD/image', {'image': SimpleUploadedFile(name, content)})
+
+        self.product.refresh_from_db()
+
+        return response
+
+    def test_image_is_saved_under_its_sniffed_type(self):
+        # The client's file name and content type are not trusted
+        response = self.upload(image_file(10, 10, 'JPEG'), name='image.png')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.product.image.name, 'images/products/PRD.jpeg')
+
+    def test_unknown_magic_number_is_rejected(self):
+        response = self.upload(b'<svg xmlns="http://www.w3.org/2000/svg"/>', name='image.png')
+
+        self.assertEqual((response.status_code, response.json()), (400, {'message': 'Unsupported image format'}))
+        self.assertFalse(self.product.image)
+
+    def test_size_limit(self):
+        # Within the multipart allowance of Content-Length, so the handler stops it while streaming
+        response = self.upload(image_file(10, 10) + b'\0' * 4096)
+        self.assertEqual((response.status_code, response.json()), (400, {'message': 'Image exceeds the maximum size of 4096 bytes'}))
+
+        # Far beyond it, so the body is never read
+        with mock.patch.object(ImageUploadHandler, 'receive_data_chunk') as receive_data_chunk:
+            response = self.upload(image_file(10, 10) + b'\0' * 128 * 1024)
+
+        self.assertEqual(response.status_code, 400)
+        receive_data_chunk.assert_not_called()
+        self.assertFalse(self.product.image)
+
+    def test_skipped_file_leaves_the_next_one_unaffected(self):
+        handler = ImageUploadHandler(max_size=10)
+
+        handler.new_file('image', 'image.gif', 'image/gif', None)
+        handler.receive_data_chunk(b'GIF89a', 0)
+
+        with self.assertRaises(SkipFile):
+            handler.receive_data_chunk(b'\0' * 5, 6)
+
+        # A later file starts from scratch, but the error stays for receive_image to report
+        handler.new_file('image', 'image.png', 'image/png', None)
+        handler.receive_data_chunk(b'\x89PNG\r\n\x1a\n', 0)
+
+        self.assertEqual((handler.image_type, handler.received), ('png', 8))
+        self.assertEqual(handler.error, 'Image exceeds the maximum size of 10 bytes')
+
+
+class CatalogImportTest(APITestCase):
+    def upload(self, name, content):
+        return self.client.post('/api/catalog/import', {'file': SimpleUploadedFile(name, content.encode())})
+
+    def test_csv_import_upserts_products_vendors_and_prices(self):
+        product = self.create_product('PRD-1', name='Old name')
+        self.create_vendor('VND-1')
+
+        header = 'type,code,name,description,SKU,brand,category,weight,width,height,length,color,material,businessName,businessNumber,productCode,vendorCode,price\n'
+        rows = [
+            'product,PRD-1,Chair,,CH-1,Brand,Furniture,5,50,90,50,Black,Wood,,,,,',
+            'product,PRD-2,Desk,A desk,DS-1,Brand,Furniture,20,120,75,60,White,Steel,,,,,',
+            'vendor,VND-2,,,,,,,,,,,,Acme,123,,,',
+            'price,,,,,,,,,,,,,,,PRD-1,VND-1,12.5',
+            'price,,,,,,,,,,,,,,,PRD-2,VND-2,99',
+            'product,PRD-3,,,,,,,,,,,,,,,,',
+            'price,,,,,,,,,,,,,,,PRD-9,VND-2,abc',
+        ]
+
+        response = self.upload('catalog.csv', header + '\n'.join(rows) + '\n')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['rows'], 7)
+        self.assertEqual(response.data['imported'], {'products': 2, 'vendors': 1, 'prices': 2})
+        self.assertEqual([error['row'] for error in response.data['errors']], [6, 7])
+        self.assertIn('name', response.data['errors'][0]['errors'])
+        self.assertIn('price', response.data['errors'][1]['errors'])
+
+        product.refresh_from_db()
+        self.assertEqual((product.pk, product.name, product.material), (Product.objects.get(code='PRD-1').pk, 'Chair', 'Wood'))
+        self.assertEqual(Price.objects.get(product__code='PRD-2', vendor__code='VND-2').price, 99)
+        self.assertEqual(Vendor.objects.get(code='VND-2').legal_entity, self.legal_entity)
+
+    def test_ndjson_prices_across_chunks_and_errors(self):
+        lines = [
+            {'type': 'vendor', 'code': 'VND-1', 'businessName': 'Acme', 'businessNumber': '1'},
+            {'type': 'product', 'code': 'PRD-1', 'name': 'Chair', 'SKU': 'CH', 'brand': 'B', 'category': 'C', 'weight': '1', 'width': '1', 'height': '1', 'length': '1', 'color': 'Red', 'material': 'Wood'},
+            {'type': 'price', 'productCode': 'PRD-1', 'vendorCode': 'VND-1', 'price': 3},
+            {'type': 'price', 'productCode': 'PRD-1', 'vendorCode': 'VND-1', 'price': 4},
+            {'type': 'price', 'productCode': 'PRD-1', 'vendorCode': 'VND-1', 'price': 5},
+            {'type': 'unknown'},
+        ]
+        content = '\n'.join(json.dumps(line) for line in lines) + '\n[1, 2]\n'
+
+        report = CatalogImport(self.legal_entity, chunk_size=3).run(
+            (number, json.loads(line) if line.startswith('{') else None) for number, line in enumerate(content.splitlines(), start=1)
+        )
+
+        # Row 4 updates the price set by the first chunk; row 5 repeats it within the same chunk
+        self.assertEqual(report['imported'], {'products': 1, 'vendors': 1, 'prices': 2})
+        self.assertEqual([(error['row'], list(error['errors'])) for error in report['errors']], [(5, ['productCode']), (6, ['type']), (7, ['row'])])
+        self.assertEqual(Price.objects.get().price, 4)
+
+        # In a single chunk, rows 4 and 5 both repeat row 3
+        response = self.upload('catalog.ndjson', content)
+        self.assertEqual(response.data['errorCount'], 4)
+
+    def test_codes_of_other_legal_entities_are_not_taken_over(self):
+        other = LegalEntity.objects.create(legal_entity_code='SOL', business_num='Sol Inc.')
+        Vendor.objects.create(name='Foreign', code='VND-X', business_num='1', legal_entity=other)
+
+        response = self.upload('catalog.ndjson', json.dumps({'type': 'vendor', 'code': 'VND-X', 'businessName': 'Mine', 'businessNumber': '2'}) + '\n')
+
+        self.assertEqual(response.data['imported']['vendors'], 0)
+        self.assertEqual(response.data['errors'][0]['errors'], {'code': ['Code is already used by another legal entity.']})
+        self.assertEqual(Vendor.objects.get(code='VND-X').name, 'Foreign')
+
+    def test_code_taken_by_another_legal_entity_after_the_check_is_not_overwritten(self):
+        other = LegalEntity.objects.create(legal_entity_code='SOL', business_num='Sol Inc.')
+        Vendor.objects.create(name='Foreign', code='VND-X', business_num='1', legal_entity=other)
+
+        # As if the foreign vendor was created between the lookup and the insert
+        with mock.patch.object(CatalogImport, 'lock_codes', return_value={}):
+            report = CatalogImport(self.legal_entity).run([(1, {'type': 'vendor', 'code': 'VND-X', 'businessName': 'Mine', 'businessNumber': '2'})])
+
+        self.assertEqual(report['imported']['vendors'], 0)
+        self.assertEqual(report['errors'][0]['errors'], {'code': ['Code is already used by another legal entity.']})
+        self.assertEqual(Vendor.objects.get(code='VND-X').name, 'Foreign')
+
+    def test_non_finite_prices_are_rejected(self):
+        self.create_product('PRD-1')
+        self.create_vendor('VND-1')
+
+        lines = [{'type': 'price', 'productCode': 'PRD-1', 'vendorCode': 'VND-1', 'price': price} for price in ('nan', 'inf', '-Infinity')]
+        report = CatalogImport(self.legal_entity).run(enumerate(lines, start=1))
+
+        self.assertEqual([list(error['errors']) for error in report['errors']], [['price']] * 3)
+        self.assertFalse(Price.objects.exists())
+
+    def test_unsupported_file_is_rejected(self):
+        self.assertEqual(self.upload('catalog.xlsx', 'x').status_code, 400)
+        self.assertEqual(self.client.post('/api/catalog/import').status_code, 400)
+
+
+class SpendAnalyticsTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.vendors = [self.create_vendor(f'VND-{i}') for i in range(2)]
+        products = [self.create_product(f'PRD-{i}') for i in range(2)]
+
+        for i, product in enumerate(products):
+            for vendor in self.vendors:
+                Price.objects.create(product=product, vendor=vendor, price=10 * (i + 1))
+
+        lines = [(products[0], self.vendors[0], 1), (products[1], self.vendors[1], 2)]
+
+        self.october = self.create_purchase_requisition('October', lines=lines, is_approved=True)
+        self.november = self.create_purchase_requisition('November', lines=lines[:1], is_approved=True, target_date=datetime.date(2023, 11, 5))
+        self.rejected = self.create_purchase_requisition('Rejected', lines=lines[1:], status='WAITING_TO_APPROVAL')
+        self.create_purchase_requisition('Open', lines=lines)
+
+    def close_requisitions(self):
+        for purchase_requisition in (self.october, self.november):
+            response = self.client.post(f'/api/purchase-requisition/{purchase_requisition.pk}/set-status', {'status': 'COMPLETED'}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(f'/api/purchase-requisition/{self.rejected.pk}/reject', {'comment': 'Too expensive'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def spend(self, **params):
+        response = self.client.get('/api/analytics/spend', params)
+
+        self.assertEqual(response.status_code, 200)
+
+        return response.json()['data']
+
+    def test_closed_requisitions_are_rolled_up(self):
+        self.close_requisitions()
+
+        self.assertEqual(self.spend(groupBy='month,status'), [
+            {'month': '10-2023', 'status': 'CANCELLED', 'totalSpend': 40.0, 'lineCount': 1, 'requisitionCount': 1},
+            {'month': '10-2023', 'status': 'COMPLETED', 'totalSpend': 50.0, 'lineCount': 2, 'requisitionCount': 1},
+            {'month': '11-2023', 'status': 'COMPLETED', 'totalSpend': 10.0, 'lineCount': 1, 'requisitionCount': 1},
+        ])
+
+        self.assertEqual(self.spend(groupBy='vendor', status='COMPLETED', **{'from': '01-11-2023'}), [
+            {'vendor': 'VND-0', 'totalSpend': 10.0, 'lineCount': 1, 'requisitionCount': 1},
+        ])
+
+        self.assertEqual(self.client.get('/api/analytics/spend', {'groupBy': 'requester'}).status_code, 400)
+
+        # The rejected requisition was claimed once; rejecting it again changes nothing
+        response = self.client.post(f'/api/purchase-requisition/{self.rejected.pk}/reject', {'comment': 'Again'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_requisitions_are_counted_once_across_vendors(self):
+        self.close_requisitions()
+
+        # October orders from both vendors
+        self.assertEqual(self.spend(groupBy='project', status='COMPLETED')[0]['requisitionCount'], 2)
+        self.assertEqual([row['requisitionCount'] for row in self.spend(groupBy='vendor', status='COMPLETED')], [2, 1])
+        self.assertEqual(self.spend(groupBy='month', status='COMPLETED', vendorCode='VND-1')[0]['requisitionCount'], 1)
+
+    def test_deleted_requisitions_leave_their_rollups(self):
+        self.close_requisitions()
+
+        response = self.client.delete(f'/api/purchase-requisition/{self.october.pk}')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.spend(groupBy='month,status'), [
+            {'month': '10-2023', 'status': 'CANCELLED', 'totalSpend': 40.0, 'lineCount': 1, 'requisitionCount': 1},
+            {'month': '11-2023', 'status': 'COMPLETED', 'totalSpend': 10.0, 'lineCount': 1, 'requisitionCount': 1},
+        ])
+        self.assertEqual(SpendRollup.objects.count(), 2)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.close_requisitions()
+        incremental = self.spend(groupBy='project,vendor,month,status')
+
+        SpendRollup.objects.update(total_spend=0)
+
+        out = io.StringIO()
+        call_command('rebuild_spend_rollups', legal_entity='LUNA', stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Wrote 4 spend rollups')
+        self.assertEqual(self.spend(groupBy='project,vendor,month,status'), incremental)
+
+    def test_price_changes_after_closing_leave_the_rollups_alone(self):
+        # Shares October's (VND-0, 10-2023, COMPLETED) bucket
+        shared = self.create_purchase_requisition('Shared', lines=[(Product.objects.get(code='PRD-0'), self.vendors[0], 1)], is_approved=True)
+        self.close_requisitions()
+
+        response = self.client.post(f'/api/purchase-requisition/{shared.pk}/set-status', {'status': 'COMPLETED'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        closed = [
+            {'vendor': 'VND-0', 'month': '10-2023', 'totalSpend': 10.0, 'lineCount': 1, 'requisitionCount': 1},
+            {'vendor': 'VND-0', 'month': '11-2023', 'totalSpend': 10.0, 'lineCount': 1, 'requisitionCount': 1},
+            {'vendor': 'VND-1', 'month': '10-2023', 'totalSpend': 40.0, 'lineCount': 1, 'requisitionCount': 1},
+        ]
+        self.assertEqual(self.spend(groupBy='vendor,month', status='COMPLETED')[0]['totalSpend'], 20.0)
+
+        Price.objects.update(price=100)
+
+        response = self.client.delete(f'/api/purchase-requisition/{shared.pk}')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.spend(groupBy='vendor,month', status='COMPLETED'), closed)
+
+        call_command('rebuild_spend_rollups', legal_entity='LUNA', stdout=io.StringIO())
+
+        self.assertEqual(self.spend(groupBy='vendor,month', status='COMPLETED'), closed)
+
+    def test_tiles_are_answered_in_one_query(self):
+        self.close_requisitions()
+        self.client.get('/api/account')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.spend(groupBy='project,month', projectCode='PRJ')
+
+        self.assertEqual(len(queries), 1)
+
+
+class PurchaseRequisitionBatchTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.product = self.create_product('PRD')
+        self.vendor = self.create_vendor('VND')
+        Price.objects.create(product=self.product, vendor=self.vendor, price=100)
+
+        self.project.purchase_allowance = 250
+        self.project.save()
+
+    def batch(self, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/purchase-requisition/batch', {'items': items}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+
+        return response.json()
+
+    def test_valid_items_apply_and_the_rest_are_reported(self):
+        waiting = self.create_purchase_requisition('Waiting', status='WAITING_TO_APPROVAL')
+        draft = self.create_purchase_requisition('Draft')
+        unapproved = self.create_purchase_requisition('Unapproved')
+        rejected = self.create_purchase_requisition('Rejected', lines=[(self.product, self.vendor, 1)], status='WAITING_TO_APPROVAL')
+        with mock.patch.object(hub, 'publish') as publish:
+            body = self.batch([
+                {'id': str(waiting.pk), 'action': 'approve'},
+                {'id': str(draft.pk), 'action': 'approve'},
+                {'id': str(unapproved.pk), 'action': 'set-status', 'status': 'TO_DO'},
+                {'id': str(rejected.pk), 'action': 'reject', 'comment': 'Too expensive'},
+                {'id': str(waiting.pk), 'action': 'reject', 'comment': 'Twice'},
+                {'id': str(uuid.uuid4()), 'action': 'approve'},
+                {'id': str(draft.pk), 'action': 'archive'},
+            ])
+
+        self.assertEqual((body['succeeded'], body['failed']), (2, 5))
+        self.assertEqual([result['message'] for result in body['results']], [
+            'Successfully approved purchase requisition',
+            'Purchase Requisition is not waiting to approval',
+            'Purchase Requisition is not approved yet',
+            'Successfully rejected purchase requisition',
+            'Purchase Requisition is listed more than once',
+            'Purchase Requisition not found',
+            'Action must be one of approve, reject, set-status',
+        ])
+
+        waiting.refresh_from_db()
+        rejected.refresh_from_db()
+        self.assertEqual((waiting.status, waiting.is_approved), ('IN_PROGRESS', True))
+        self.assertEqual((rejected.status, rejected.is_rejected, rejected.rejected_comment), ('CANCELLED', True, 'Too expensive'))
+        self.assertEqual(SpendRollup.objects.get().total_spend, 100)
+
+        # One status event per applied item, published once the batch committed
+        self.assertEqual([call.args[2]['status'] for call in publish.call_args_list], ['IN_PROGRESS', 'CANCELLED'])
+
+    def test_completions_are_charged_per_project(self):
+        purchase_requisitions = [
+            self.create_purchase_requisition(f'Requisition {i}', lines=[(self.product, self.vendor, 1)], is_approved=True, status='IN_PROGRESS')
+            for i in range(3)
+        ]
+
+        body = self.batch([{'id': str(purchase_requisition.pk), 'action': 'set-status', 'status': 'COMPLETED'} for purchase_requisition in purchase_requisitions])
+
+        # 300 does not fit the allowance of 250 together; the first two still do
+        self.assertEqual([result['success'] for result in body['results']], [True, True, False])
+        self.assertEqual(body['results'][2]['message'], "Purchase Requisition exceeds project's purchase allowance")
+
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.current_purchase, self.project.purchase_count), (200, 2))
+        self.assertEqual(list(PurchaseRequisition.objects.order_by('name').values_list('status', flat=True)), ['COMPLETED', 'COMPLETED', 'IN_PROGRESS'])
+        self.assertEqual(SpendRollup.objects.get().requisition_count, 2)
+
+    def test_completions_with_unpriced_lines_are_reported(self):
+        unpriced = self.create_purchase_requisition('Unpriced', lines=[(self.product, self.create_vendor('OTHER'), 1)], is_approved=True, status='IN_PROGRESS')
+        priced = self.create_purchase_requisition('Priced', lines=[(self.product, self.vendor, 1)], is_approved=True, status='IN_PROGRESS')
+
+        body = self.batch([{'id': str(purchase_requisition.pk), 'action': 'set-status', 'status': 'COMPLETED'} for purchase_requisition in (unpriced, priced)])
+
+        self.assertEqual([(result['success'], result['message']) for result in body['results']], [
+            (False, 'Purchase Requisition has products without a price from their vendor'),
+            (True, 'Successfully updated purchase requisition status'),
+        ])
+
+        unpriced.refresh_from_db()
+        self.project.refresh_from_db()
+        self.assertEqual(unpriced.status, 'IN_PROGRESS')
+        self.assertEqual((self.project.current_purchase, self.project.purchase_count), (100, 1))
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def approve(count):
+            items = [
+                {'id': str(self.create_purchase_requisition(f'Requisition {i}', status='WAITING_TO_APPROVAL').pk), 'action': 'approve'}
+                for i in range(count)
+            ]
+
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.batch(items)['succeeded'], count)
+
+            return len(queries)
+
+        # The first request also loads the principal
+        approve(1)
+        self.assertEqual(approve(2), approve(20))
+
+    def test_invalid_payloads_are_rejected(self):
+        response = self.client.post('/api/purchase-requisition/batch', {'items': []}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/purchase-requisition/batch', {'items': [{}] * 501}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class WorkflowTest(APITestCase):
+    def test_table_covers_every_state_and_action(self):
+        self.assertEqual(len(TRANSITIONS), 8 * 2 * 10)
+
+        approve = TRANSITIONS[('WAITING_TO_APPROVAL', False, 'approve')]
+        self.assertEqual((approve.target, approve.values), ('IN_PROGRESS', {'is_approved': True, 'status': 'IN_PROGRESS'}))
+        self.assertTrue(TRANSITIONS[('IN_PROGRESS', True, 'COMPLETED')].charges_budget)
+        self.assertEqual(TRANSITIONS[('DRAFT', False, 'TO_DO')], 'Purchase Requisition is not approved yet')
+        self.assertEqual(TRANSITIONS[('COMPLETED', True, 'reject')], 'Purchase Requisition is already completed or cancelled')
+
+        with self.assertRaisesMessage(InvalidTransition, '"ARCHIVED" is not a valid choice.'):
+            check(PurchaseRequisition(status='DRAFT'), 'ARCHIVED')
+
+    def test_transitions_are_audited(self):
+        purchase_requisition = self.create_purchase_requisition('Chairs', status='WAITING_TO_APPROVAL')
+
+        response = self.client.post(f'/api/purchase-requisition/{purchase_requisition.pk}/approve')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(f'/api/purchase-requisition/{purchase_requisition.pk}/reject', {'comment': 'Too expensive'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(list(purchase_requisition.transitions.order_by('created_at').values_list('user', 'action', 'from_status', 'to_status', 'comment')), [
+            (self.user.pk, 'approve', 'WAITING_TO_APPROVAL', 'IN_PROGRESS', None),
+            (self.user.pk, 'reject', 'IN_PROGRESS', 'CANCELLED', 'Too expensive'),
+        ])
+
+    def test_stale_transitions_are_not_applied(self):
+        purchase_requisition = self.create_purchase_requisition('Chairs', status='WAITING_TO_APPROVAL')
+        stale = PurchaseRequisition.objects.get(pk=purchase_requisition.pk)
+
+        transition(purchase_requisition, 'reject', comment='Too expensive')
+
+        # Checked against the state it was loaded in, applied after another request moved it
+        with self.assertRaises(TransitionConflict):
+            apply_transitions([Change(stale, check(stale, 'approve'))])
+
+        purchase_requisition.refresh_from_db()
+        self.assertEqual((purchase_requisition.status, purchase_requisition.is_approved), ('CANCELLED', False))
+        self.assertEqual(purchase_requisition.transitions.count(), 1)
+
+
+class EventStreamTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.purchase_requisition = self.create_purchase_requisition('Chairs', status='WAITING_TO_APPROVAL')
+        self.factory = AsyncRequestFactory()
+
+    async def test_hub_delivers_across_threads_and_drops_slow_subscribers(self):
+        events = EventHub(queue_size=2)
+        subscription = events.subscribe(['a', 'b'])
+
+        await sync_to_async(events.publish, thread_sensitive=False)(['b'], 'ping', {'n': 1})
+        self.assertEqual(await asyncio.wait_for(subscription.get(), 1), {'type': 'ping', 'channels': ['b'], 'data': {'n': 1}})
+
+        for n in range(3):
+            events.publish(['a'], 'ping', {'n': n})
+
+        await asyncio.sleep(0)
+
+        # The third event overflows the queue: the oldest is dropped and the stream told to end
+        self.assertEqual((await subscription.get())['data'], {'n': 1})
+        self.assertIsNone(await subscription.get())
+        self.assertEqual(dict(events.subscribers), {})
+
+    async def test_comments_and_approvals_are_published_on_commit(self):
+        subscription = hub.subscribe([requisition_channel(self.purchase_requisition.pk)])
+        path = f'/api/purchase-requisition/{self.purchase_requisition.pk}'
+
+        def change():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'{path}/comment', {'content': 'Hello'}, content_type='application/json')
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'{path}/approve')
+
+        try:
+            await sync_to_async(change)()
+
+            comment = await asyncio.wait_for(subscription.get(), 1)
+            approval = await asyncio.wait_for(subscription.get(), 1)
+        finally:
+            subscription.close()
+
+        self.assertEqual((comment['type'], comment['data']['content'], comment['data']['username']), ('comment.created', 'Hello', 'manager'))
+        self.assertEqual(approval['type'], 'requisition.status')
+        self.assertEqual((approval['data']['status'], approval['data']['isApproved']), ('IN_PROGRESS', True))
+
+    @override_settings(EVENTS_STREAM_TIMEOUT=1)
+    async def test_requisition_stream(self):
+        headers = {'Authorization': self.client.defaults['HTTP_AUTHORIZATION']}
+
+        response = await async_views.purchase_requisition_events(self.factory.get('/', headers=headers), purchase_requisition_id=str(uuid.uuid4()))
+        self.assertEqual(response.status_code, 404)
+
+        response = await async_views.purchase_requisition_events(self.factory.get('/', headers=headers), purchase_requisition_id=str(self.purchase_requisition.pk))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        chunks = []
+
+        async for chunk in response.streaming_content:
+            if not chunks:
+                hub.publish([requisition_channel(self.purchase_requisition.pk)], 'comment.deleted', {'id': '1'})
+
+            chunks.append(chunk)
+
+        # The stream ends on its timeout and releases its subscription
+        self.assertEqual(chunks, [b'retry: 3000\n\n', b'event: comment.deleted\ndata: {"id":"1"}\n\n'])
+        self.assertEqual(dict(hub.subscribers), {})
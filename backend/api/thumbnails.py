@@ -0,0 +1,137 @@
+import io
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+# Widths, in pixels, of the derivatives generated for every product and vendor image
+THUMBNAIL_WIDTHS = (160, 320, 640)
+
+# Images are generated off the request thread; the pool is created on first use
+_executor = None
+
+
+def thumbnail_format():
+    # Prefer WebP and fall back to JPEG when Pillow was built without libwebp
+    if settings.THUMBNAIL_FORMAT == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+
+    return settings.THUMBNAIL_FORMAT
+
+
+def generate_thumbnails(instance):
+    """Render every thumbnail width of a Product or Vendor image into storage.
+
+    Returns the ``{width: storage name}`` map, which is also saved on the row
+    unless the image was replaced while the thumbnails were being rendered.
+    """
+    if not instance.image:
+        return {}
+
+    image_name = instance.image.name
+    image_format = thumbnail_format()
+    extension = 'webp' if image_format == 'WEBP' else 'jpg'
+
+    directory, filename = os.path.split(image_name)
+    stem = os.path.splitext(filename)[0]
+
+    with default_storage.open(image_name, 'rb') as file:
+        original = Image.open(file)
+        original.load()
+
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'A' in original.getbands() else 'RGB')
+
+    if image_format == 'JPEG' and original.mode == 'RGBA':
+        original = original.convert('RGB')
+
+    thumbnails = {}
+
+    for width in THUMBNAIL_WIDTHS:
+        # Never upscale: small originals get a single derivative at their own width
+        if width > original.width and thumbnails:
+            break
+
+        target = min(width, original.width)
+        derivative = original.resize((target, max(1, round(original.height * target / original.width))), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        derivative.save(buffer, image_format, quality=settings.THUMBNAIL_QUALITY)
+
+        name = f'{directory}/thumbnails/{stem}-{width}.{extension}'
+
+        if default_storage.exists(name):
+            default_storage.delete(name)
+
+        thumbnails[str(width)] = default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    type(instance).objects.filter(pk=instance.pk, image=image_name).update(thumbnails=thumbnails, updated_at=timezone.now())
+    instance.thumbnails = thumbnails
+
+    return thumbnails
+
+
+def delete_thumbnails(instance, thumbnails=None):
+    """Delete the thumbnail files of a Product or Vendor, or the given ``{width: storage name}`` map."""
+    for name in (instance.thumbnails if thumbnails is None else thumbnails or {}).values():
+        try:
+            default_storage.delete(name)
+        except:
+            pass
+
+
+def thumbnail_urls(instance):
+    # Absolute URLs of the generated derivatives, keyed by width
+    return {width: 'http://localhost:8080' + default_storage.url(name) for width, name in (instance.thumbnails or {}).items()}
+
+
+def _run(model, pk):
+    try:
+        instance = model.objects.filter(pk=pk).first()
+
+        if instance is not None:
+            generate_thumbnails(instance)
+    except Exception:
+        logger.exception('Failed to generate thumbnails for %s %s', model.__name__, pk)
+    finally:
+        # Worker threads own their connection; do not leave it open between jobs
+        connection.close()
+
+
+def schedule_thumbnails(instance):
+    """Generate thumbnails for a freshly saved image once the transaction commits.
+
+    The previous image's thumbnails are dropped from the row right away and
+    their files deleted on commit: a new image with another name or fewer
+    widths would otherwise leave some of them behind.
+    """
+    global _executor
+
+    if not instance.image:
+        return
+
+    model, pk = type(instance), instance.pk
+    previous = instance.thumbnails
+
+    if previous:
+        model.objects.filter(pk=pk).update(thumbnails={}, updated_at=timezone.now())
+        instance.thumbnails = {}
+        # Before the new ones are rendered, which may reuse their names
+        transaction.on_commit(lambda: delete_thumbnails(instance, previous))
+
+    if not settings.THUMBNAIL_BACKGROUND:
+        transaction.on_commit(lambda: generate_thumbnails(model.objects.get(pk=pk)))
+        return
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix='thumbnails')
+
+    transaction.on_commit(lambda: _executor.submit(_run, model, pk))
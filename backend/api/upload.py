@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler, SkipFile
+
+
+# Magic numbers of the image formats accepted for product and vendor images
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+
+def sniff_image_type(header):
+    """Return the image extension matching the leading bytes of a file, or None."""
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+
+    return None
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    # Streams an uploaded image chunk by chunk into a temporary file, whatever its
+    # size, so memory per upload stays flat. The content type is sniffed from the
+    # first chunk instead of trusting the client, and the upload is skipped as
+    # soon as it grows past max_size. The reason is left on `error`.
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size or settings.IMAGE_UPLOAD_MAX_SIZE
+        self.error = None
+        self.image_type = None
+        self.received = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.image_type = None
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0:
+            self.image_type = sniff_image_type(raw_data)
+
+            if self.image_type is None:
+                self.error = 'Unsupported image format'
+                raise SkipFile()
+
+        self.received += len(raw_data)
+
+        if self.received > self.max_size:
+            self.error = f'Image exceeds the maximum size of {self.max_size} bytes'
+            raise SkipFile()
+
+        return super().receive_data_chunk(raw_data, start)
+
+
+def receive_image(request, field_name='image'):
+    """Read a multipart image upload from a DRF request whose body has not been read yet.
+
+    Returns an ``(uploaded_file, extension, error)`` tuple; ``error`` is None on success.
+    """
+    max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+
+    # Reject oversized bodies before reading them; the multipart overhead is small
+    if int(request.META.get('CONTENT_LENGTH') or 0) > max_size + 64 * 1024:
+        return None, None, f'Image exceeds the maximum size of {max_size} bytes'
+
+    # Replace the default handlers (which keep small uploads in memory) before the body is
+    # parsed; REST framework's MultiPartParser reads them from this request, not Django's
+    handler = ImageUploadHandler(request, max_size=max_size)
+    request.upload_handlers = [handler]
+
+    uploaded_file = request.FILES.get(field_name)
+
+    if handler.error:
+        return None, None, handler.error
+
+    if uploaded_file is None:
+        return None, None, 'Image file is required'
+
+    return uploaded_file, handler.image_type, None
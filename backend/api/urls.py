@@ -1,6 +1,11 @@
+from django.conf import settings
 from django.urls import path
+
+from . import async_views
 from .views import (
     get_user, 
+    get_database_metrics,
+    get_cache_metrics,
     set_role,
     create_legal_entity, 
     join_legal_entity, 
@@ -15,27 +20,35 @@ from .views import (
     list_or_update_role,
     create_and_list_product,
     delete_and_get_product,
+    upload_product_image,
     assign_price_to_product,
     update_price,
     delete_and_update_price,
+    import_catalog,
     create_and_list_vendor,
     delete_and_get_vendor,
+    upload_vendor_image,
     create_contact_in_vendor,
     delete_contact,
     create_and_list_project,
     delete_and_update_project,
     mark_default_project,
     create_and_list_purchase_requisition,
+    export_purchase_requisitions,
+    get_spend_analytics,
     get_and_delete_purchase_requisition,
     set_purchase_requisition_status,
     approve_purchase_requisition,
     reject_purchase_requisition,
+    batch_purchase_requisition,
     post_and_list_comment_purchase_requisition,
     delete_and_update_comment_purchase_requisition
 )
 
 urlpatterns = [
     path('account', get_user),
+    path('metrics/db', get_database_metrics),
+    path('metrics/cache', get_cache_metrics),
     path('account/set-role', set_role),
     path('entity/create-entity', create_legal_entity),
     path('entity/join-entity', join_legal_entity),
@@ -53,18 +66,37 @@ urlpatterns = [
     path('product/update-price', update_price),
     path('product/delete-price/<str:price_id>', delete_and_update_price),
     path('product/<str:product_code>', delete_and_get_product),
+    path('product/<str:product_code>/image', upload_product_image),
+    path('catalog/import', import_catalog),
     path('vendor', create_and_list_vendor),
     path('vendor/contact', create_contact_in_vendor),
     path('vendor/<str:vendor_code>', delete_and_get_vendor),
+    path('vendor/<str:vendor_code>/image', upload_vendor_image),
     path('vendor/contact/<str:contact_id>', delete_contact),
     path('project', create_and_list_project),
     path('project/<str:project_id>', delete_and_update_project),
     path('project/<str:project_id>/mark-default', mark_default_project),
+    path('analytics/spend', get_spend_analytics),
     path('purchase-requisition', create_and_list_purchase_requisition),
+    path('purchase-requisition/export', export_purchase_requisitions),
+    path('purchase-requisition/batch', batch_purchase_requisition),
     path('purchase-requisition/<str:purchase_requisition_id>', get_and_delete_purchase_requisition),
     path('purchase-requisition/<str:purchase_requisition_id>/set-status', set_purchase_requisition_status),
     path('purchase-requisition/<str:purchase_requisition_id>/approve', approve_purchase_requisition),
     path('purchase-requisition/<str:purchase_requisition_id>/reject', reject_purchase_requisition),
     path('purchase-requisition/<str:purchase_requisition_id>/comment', post_and_list_comment_purchase_requisition),
     path('purchase-requisition/<str:purchase_requisition_id>/comment/<str:comment_id>', delete_and_update_comment_purchase_requisition)
-]
\ No newline at end of file
+]
+
+if settings.ASYNC_VIEWS:
+    # Serve the high-traffic GET endpoints from api.async_views; listed first, they shadow the sync views
+    urlpatterns = [
+        path('account', async_views.account),
+        path('product', async_views.product),
+        path('vendor', async_views.vendor),
+        path('purchase-requisition', async_views.purchase_requisition),
+        path('purchase-requisition/<str:purchase_requisition_id>/comment', async_views.purchase_requisition_comment),
+        # Server-Sent Events streams; they hold a connection open, so only served under ASGI
+        path('events', async_views.entity_events),
+        path('purchase-requisition/<str:purchase_requisition_id>/events', async_views.purchase_requisition_events),
+    ] + urlpatterns
@@ -1,10 +1,25 @@
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from django.db.models import Q
 from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from datetime import datetime
 
-from .action import auth_handler, Pagination
+from .action import auth_handler, conditional_response, Pagination
+from .search import search
+from .export import export_lines, FORMATS as EXPORT_FORMATS
+from .catalog_import import CatalogImport, read_rows, FORMATS as IMPORT_FORMATS
+from .budget import BudgetExceeded
+from .workflow import transition, InvalidTransition, TransitionConflict, REJECT, APPROVE
+from .batch import RequisitionBatch, MAX_BATCH_SIZE
+from .analytics import spend_summary, DIMENSIONS as SPEND_DIMENSIONS
+from .upload import receive_image
+from .thumbnails import schedule_thumbnails, delete_thumbnails
+from .dbmetrics import metrics as connection_metrics
+from .tenant_cache import tenant_cache, ORG_TREE, ROLES
+from .pricing import price_cache, PRICE_MATRIX
 from .models import User, LegalEntity, Role, Department, Team, Product, Vendor, Price, Contact, Project, PurchaseRequisition, Comment
 from .serializers import (
     UserInfoSerializer, 
@@ -38,6 +53,24 @@ def get_user(request, user: User):
     except:
         return Response({"message": "An error has occured while retrieving user info"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+@auth_handler
+def get_database_metrics(request, user: User):
+    if not user.role or user.role.role != 'MANAGER':
+        return Response({"message": "Only manager can perform this action"}, status=status.HTTP_403_FORBIDDEN)
+    
+    # Connection reuse counters of the worker process that served this request
+    return Response(connection_metrics.snapshot())
+
+@api_view(['GET'])
+@auth_handler
+def get_cache_metrics(request, user: User):
+    if not user.role or user.role.role != 'MANAGER':
+        return Response({"message": "Only manager can perform this action"}, status=status.HTTP_403_FORBIDDEN)
+    
+    # Hit and miss counters of the tenant caches, across every process sharing their backend
+    return Response({**tenant_cache.stats([ORG_TREE, ROLES]), **price_cache.stats([PRICE_MATRIX])})
+
 @api_view(['POST'])
 @auth_handler
 def create_legal_entity(request, user: User):
@@ -175,9 +208,17 @@ def get_legal_entity(request, user: User):
         
         legal_entity = user.legal_entity
         
-        serializer = LegalEntitySerializer(legal_entity)
+        not_modified, headers = conditional_response(request, LegalEntity.objects.values_list('updated_at', flat=True).get(pk=legal_entity.pk), legal_entity.pk)
         
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        if not_modified:
+            return not_modified
+        
+        # Rendered once per change of the org tree, shared by every member of the entity
+        data = tenant_cache.get_or_set(legal_entity.pk, ORG_TREE, lambda: LegalEntitySerializer(
+            LegalEntity.objects.prefetch_related('departments__teams').get(pk=legal_entity.pk)
+        ).data)
+        
+        return Response(data, status=status.HTTP_200_OK, headers=headers)
     except:
         return Response({"message": "An error has occured while retrieving Legal Entity info"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -320,10 +361,17 @@ def list_or_update_role(request, user: User):
     legal_entity = user.legal_entity
     
     if request.method == 'GET':
-        roles = legal_entity.roles.all().order_by('role')
-        serializer = RoleSerializer(roles, many=True)
+        # Role changes bump the legal entity's updated_at
+        not_modified, headers = conditional_response(request, LegalEntity.objects.values_list('updated_at', flat=True).get(pk=legal_entity.pk), legal_entity.pk, 'roles')
+        
+        if not_modified:
+            return not_modified
         
-        return Response(serializer.data)
+        data = tenant_cache.get_or_set(legal_entity.pk, ROLES, lambda: RoleSerializer(
+            legal_entity.roles.all().order_by('role'), many=True
+        ).data)
+        
+        return Response(data, headers=headers)
     
     elif request.method == 'PATCH':
         role = Role.objects.get(id=data["id"])
@@ -349,11 +397,7 @@ def create_and_list_product(request, user: User):
         
         try:
             if search_query:
-                products = legal_entity.products.filter(
-                    Q(name__icontains=search_query) |
-                    Q(code__icontains=search_query) |
-                    Q(prices__vendor__code__icontains=search_query)
-                ).order_by('name')
+                products = search(legal_entity.products.all(), search_query, ordering=('name',))
             else:
                 products = legal_entity.products.all().order_by('id')
         except Product.DoesNotExist:
@@ -361,6 +405,8 @@ def create_and_list_product(request, user: User):
         except:
             return Response({"message": "An error has occured while retrieving products"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        products = products.prefetch_related(Prefetch('prices', queryset=Price.objects.select_related('vendor')))
+        
         products = paginator.paginate_queryset(products, request)
         
         serializer = ProductSerializer(products, many=True)
@@ -392,6 +438,8 @@ def delete_and_get_product(request, user: User, product_code):
         image_file = product.image
         
         product.delete()
+        
+        delete_thumbnails(product)
 
         if image_file:
             try:
@@ -402,8 +450,43 @@ def delete_and_get_product(request, user: User, product_code):
         return Response({"message": "Successfully deleted product"})
     
     elif request.method == 'GET':
+        not_modified, headers = conditional_response(request, product.updated_at, product.pk)
+        
+        if not_modified:
+            return not_modified
+        
         serializer = ProductSerializer(product)
-        return Response(serializer.data)    
+        return Response(serializer.data, headers=headers)    
+    
+@api_view(['POST'])
+@auth_handler
+def upload_product_image(request, user: User, product_code):
+    legal_entity = user.legal_entity
+    
+    try:
+        product = legal_entity.products.get(code=product_code)
+    except Product.DoesNotExist:
+        return Response({"message": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
+    
+    # The multipart body is streamed to a temporary file and moved into storage, never held in memory
+    image, extension, error = receive_image(request)
+    
+    if error:
+        return Response({"message": error}, status=status.HTTP_400_BAD_REQUEST)
+    
+    previous_image = product.image.name if product.image else None
+    
+    product.image.save(f'{product.code}.{extension}', image)
+    
+    if previous_image and previous_image != product.image.name:
+        try:
+            default_storage.delete(previous_image)
+        except:
+            pass
+    
+    schedule_thumbnails(product)
+    
+    return Response({"message": "Successfully uploaded product image"})
     
 @api_view(['POST'])
 @auth_handler
@@ -469,6 +552,27 @@ def delete_and_update_price(request, user: User, price_id):
     
     return Response({"message": "Successfully deleted price"})
     
+@api_view(['POST'])
+@auth_handler
+def import_catalog(request, user: User):
+    if not user.role or user.role.role != 'MANAGER':
+        return Response({"message": "Only manager can perform this action"}, status=status.HTTP_403_FORBIDDEN)
+    
+    file = request.FILES.get('file')
+    
+    if file is None:
+        return Response({"message": "A CSV or NDJSON file is required"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    file_format = IMPORT_FORMATS.get(file.name.rsplit('.', 1)[-1].lower()) or IMPORT_FORMATS.get(file.content_type)
+    
+    if file_format is None:
+        return Response({"message": "File must be a .csv or .ndjson file"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Rows are read line by line and written in chunks, so the file is never loaded whole
+    report = CatalogImport(user.legal_entity).run(read_rows(file.file, file_format))
+    
+    return Response(report)
+    
 @api_view(['POST', 'GET'])
 @auth_handler
 def create_and_list_vendor(request, user: User):
@@ -491,15 +595,11 @@ def create_and_list_vendor(request, user: User):
         paginator = Pagination()
         
         if search_query:
-            vendors = legal_entity.vendors.filter(
-                Q(name__icontains=search_query) |
-                Q(code__icontains=search_query) |
-                Q(business_num__icontains=search_query)
-            ).order_by('id')
+            vendors = search(legal_entity.vendors.all(), search_query, ordering=('id',))
         else:
             vendors = legal_entity.vendors.all().order_by('id')
 
-        vendors = paginator.paginate_queryset(vendors, request)
+        vendors = paginator.paginate_queryset(vendors.prefetch_related('contacts'), request)
         
         serializer = VendorSerializer(vendors, many=True)
         
@@ -516,6 +616,8 @@ def delete_and_get_vendor(request, user: User, vendor_code):
         
         vendor.delete()
         
+        delete_thumbnails(vendor)
+        
         if image_file:
             try:
                 default_storage.delete(image_file.name)
@@ -525,8 +627,43 @@ def delete_and_get_vendor(request, user: User, vendor_code):
         return Response({"message": "Successfully deleted vendor"})
     
     elif request.method == 'GET':
+        not_modified, headers = conditional_response(request, vendor.updated_at, vendor.pk)
+        
+        if not_modified:
+            return not_modified
+        
         serializer = VendorSerializer(vendor)
-        return Response(serializer.data)
+        return Response(serializer.data, headers=headers)
+
+@api_view(['POST'])
+@auth_handler
+def upload_vendor_image(request, user: User, vendor_code):
+    legal_entity = user.legal_entity
+    
+    try:
+        vendor = legal_entity.vendors.get(code=vendor_code)
+    except Vendor.DoesNotExist:
+        return Response({"message": "Vendor not found"}, status=status.HTTP_404_NOT_FOUND)
+    
+    # The multipart body is streamed to a temporary file and moved into storage, never held in memory
+    image, extension, error = receive_image(request)
+    
+    if error:
+        return Response({"message": error}, status=status.HTTP_400_BAD_REQUEST)
+    
+    previous_image = vendor.image.name if vendor.image else None
+    
+    vendor.image.save(f'{vendor.code}.{extension}', image)
+    
+    if previous_image and previous_image != vendor.image.name:
+        try:
+            default_storage.delete(previous_image)
+        except:
+            pass
+    
+    schedule_thumbnails(vendor)
+    
+    return Response({"message": "Successfully uploaded vendor image"})
 
 @api_view(['POST'])
 @auth_handler
@@ -577,11 +714,7 @@ def create_and_list_project(request, user: User):
         paginator = Pagination()
         
         if search_query:
-            projects = legal_entity.projects.filter(
-                Q(name__icontains=search_query) |
-                Q(code__icontains=search_query) |
-                Q(label__icontains=search_query)
-            ).order_by('id')
+            projects = search(legal_entity.projects.all(), search_query, ordering=('id',))
         else:
             projects = legal_entity.projects.all().order_by('id')
         
@@ -653,15 +786,15 @@ def create_and_list_purchase_requisition(request, user: User):
             if not serializer.is_valid():
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
             
-            purchase_requisition = serializer.save()
-                
-            if len(data["products"]) > 0:
-                serializer = ProductPurchaseRequisitionSerializer(data=data["products"], many=True, purchase_requisition=purchase_requisition)
-                
-                if not serializer.is_valid():
-                    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-                serializer.save()
+            # Validate every line before anything is written so a bad line never leaves a header behind
+            products_serializer = ProductPurchaseRequisitionSerializer(data=data.get("products") or [], many=True, legal_entity=legal_entity)
+            
+            if not products_serializer.is_valid():
+                return Response(products_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            
+            with transaction.atomic():
+                purchase_requisition = serializer.save()
+                products_serializer.save(purchase_requisition=purchase_requisition)
 
             return Response({"message": "Successfully created purchase requisition"})
         
@@ -671,34 +804,118 @@ def create_and_list_purchase_requisition(request, user: User):
         search_query = request.query_params.get('search')
         
         if search_query:
-            purchase_requisitions = legal_entity.purchase_requisitions.filter(
-                Q(project__code__icontains=search_query) |
-                Q(name__icontains=search_query)
-            ).order_by('name')
+            purchase_requisitions = search(legal_entity.purchase_requisitions.all(), search_query, ordering=('name',))
         else:
             purchase_requisitions = legal_entity.purchase_requisitions.all().order_by('id')
         
-        purchase_requisitions = paginator.paginate_queryset(purchase_requisitions, request)
+        purchase_requisitions = paginator.paginate_queryset(purchase_requisitions.with_details(), request)
         
         serializer = PurchaseRequisitionSerializer(purchase_requisitions, many=True)
         
         return paginator.get_paginated_response(serializer.data)
     
+@api_view(['GET'])
+@auth_handler
+def export_purchase_requisitions(request, user: User):
+    legal_entity = user.legal_entity
+    params = request.query_params
+    
+    # `format` is taken by REST framework's content negotiation
+    output = params.get('output', 'csv')
+    
+    if output not in EXPORT_FORMATS:
+        return Response({"message": "Output must be one of " + ", ".join(EXPORT_FORMATS)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    purchase_requisitions = legal_entity.purchase_requisitions.all()
+    
+    if params.get('status'):
+        statuses = params['status'].split(',')
+        
+        if not set(statuses) <= {choice for choice, _ in PurchaseRequisition.status_choices}:
+            return Response({"message": "Invalid status"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        purchase_requisitions = purchase_requisitions.filter(status__in=statuses)
+    
+    if params.get('projectCode'):
+        purchase_requisitions = purchase_requisitions.filter(project__code=params['projectCode'])
+    
+    # Target date range, inclusive, in the dd-mm-YYYY format used by the rest of the API and by the exported dates
+    try:
+        if params.get('from'):
+            purchase_requisitions = purchase_requisitions.filter(target_date__gte=datetime.strptime(params['from'], '%d-%m-%Y').date())
+        
+        if params.get('to'):
+            purchase_requisitions = purchase_requisitions.filter(target_date__lte=datetime.strptime(params['to'], '%d-%m-%Y').date())
+    except ValueError:
+        return Response({"message": "Dates must be formatted as dd-mm-YYYY"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    content_type, _, _ = EXPORT_FORMATS[output]
+    
+    # Rows are read from a server-side cursor while the body is sent
+    response = StreamingHttpResponse(export_lines(output, purchase_requisitions), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="purchase-requisitions.{output}"'
+    
+    return response
+    
+@api_view(['GET'])
+@auth_handler
+def get_spend_analytics(request, user: User):
+    legal_entity = user.legal_entity
+    params = request.query_params
+    
+    group_by = params.get('groupBy', 'month').split(',')
+    
+    if not set(group_by) <= set(SPEND_DIMENSIONS):
+        return Response({"message": "groupBy must be a list of " + ", ".join(SPEND_DIMENSIONS)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    filters = {}
+    
+    if params.get('status'):
+        filters['status__in'] = params['status'].split(',')
+    
+    if params.get('projectCode'):
+        filters['project__code'] = params['projectCode']
+    
+    if params.get('vendorCode'):
+        filters['vendor__code'] = params['vendorCode']
+    
+    # Months of target dates, inclusive, in the dd-mm-YYYY format used by the rest of the API
+    try:
+        if params.get('from'):
+            filters['month__gte'] = datetime.strptime(params['from'], '%d-%m-%Y').date().replace(day=1)
+        
+        if params.get('to'):
+            filters['month__lte'] = datetime.strptime(params['to'], '%d-%m-%Y').date().replace(day=1)
+    except ValueError:
+        return Response({"message": "Dates must be formatted as dd-mm-YYYY"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Completed and cancelled requisitions only, read from the precomputed rollups
+    return Response({"data": spend_summary(legal_entity, group_by, filters)})
+    
 @api_view(['GET', 'DELETE'])
 @auth_handler
 def get_and_delete_purchase_requisition(request, user: User, purchase_requisition_id):
     legal_entity = user.legal_entity
     
     try:
-        purchase_requisition = legal_entity.purchase_requisitions.get(id=purchase_requisition_id)
+        purchase_requisitions = legal_entity.purchase_requisitions
+        purchase_requisition = purchase_requisitions.get(id=purchase_requisition_id)
     except PurchaseRequisition.DoesNotExist:
         return Response({"message": "Purchase Requisition not found"}, status=status.HTTP_404_NOT_FOUND)
     except:
         return Response({"message": "An error has occured while retrieving Purchase Requisition info"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     if request.method == 'GET':
+        not_modified, headers = conditional_response(request, purchase_requisition.updated_at, purchase_requisition.pk)
+        
+        if not_modified:
+            return not_modified
+        
+        # Only load the lines, prices and totals when the body has to be built
+        purchase_requisition = purchase_requisitions.with_details().get(id=purchase_requisition.pk)
+        
         serializer = PurchaseRequisitionSerializer(purchase_requisition)
-        return Response(serializer.data)
+        return Response(serializer.data, headers=headers)
         
     elif request.method == 'DELETE':
         purchase_requisition.delete()
@@ -711,41 +928,51 @@ def set_purchase_requisition_status(request, user: User, purchase_requisition_id
     legal_entity = user.legal_entity
     
     try:
-        purchase_requisition: PurchaseRequisition = legal_entity.purchase_requisitions.get(id=purchase_requisition_id)
+        purchase_requisition: PurchaseRequisition = legal_entity.purchase_requisitions.select_related('project').get(id=purchase_requisition_id)
         project = purchase_requisition.project
     except PurchaseRequisition.DoesNotExist:
         return Response({"message": "Purchase Requisition not found"}, status=status.HTTP_404_NOT_FOUND)
     except Project.DoesNotExist:
         return Response({"message": "Project not found"}, status=status.HTTP_404_NOT_FOUND)
     
-    if purchase_requisition.status == 'COMPLETED' or purchase_requisition.status == 'CANCELLED':
-        return Response({"message": "Purchase Requisition is already completed or cancelled"}, status=status.HTTP_400_BAD_REQUEST)
-    if purchase_requisition.is_approved == False:
-        if data["status"] == 'COMPLETED' or data["status"] == 'TO_DO' or data["status"] == 'IN_PROGRESS':
-            return Response({"message": "Purchase Requisition is not approved yet"}, status=status.HTTP_400_BAD_REQUEST)
-    else:
-        if data["status"] == 'WAITING_TO_APPROVAL':
-            return Response({"message": "Purchase Requisition is already approved"}, status=status.HTTP_400_BAD_REQUEST)
-        
-    if data["status"] == "COMPLETED":
-        total_price = purchase_requisition.total_price
-        
-        if project.purchase_allowance < project.current_purchase + total_price:
-            return Response({"message": "Purchase Requisition exceeds project's purchase allowance"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        project.current_purchase += total_price
-        project.purchase_count += 1
-    
     serializer = SetStatusPurchaseRequisitionSerializer(purchase_requisition, data=data, partial=True)
     
-    if serializer.is_valid():
-        purchase_requisition = serializer.save()
-        project.save()
-                
-        return Response({"message": "Successfully updated purchase requisition status"})
-    else:
+    if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    # The approval and closed-status rules live in api.workflow's transition table
+    try:
+        transition(purchase_requisition, data.get("status"), user)
+    except InvalidTransition as error:
+        return Response({"message": error.message}, status=status.HTTP_400_BAD_REQUEST)
+    except BudgetExceeded:
+        return Response({"message": "Purchase Requisition exceeds project's purchase allowance"}, status=status.HTTP_400_BAD_REQUEST)
+    except TransitionConflict:
+        return Response({"message": "Purchase Requisition was changed by another request, please retry"}, status=status.HTTP_409_CONFLICT)
+    
+    return Response({"message": "Successfully updated purchase requisition status"})
+    
+@api_view(['POST'])
+@auth_handler
+def batch_purchase_requisition(request, user: User):
+    items = request.data.get('items') if isinstance(request.data, dict) else None
+    
+    if not isinstance(items, list) or not items:
+        return Response({"message": "items must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if len(items) > MAX_BATCH_SIZE:
+        return Response({"message": f"A batch can hold at most {MAX_BATCH_SIZE} items"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Items are checked one by one, then applied together; failed items are reported and skipped
+    try:
+        results = RequisitionBatch(user.legal_entity, user).run(items)
+    except TransitionConflict:
+        return Response({"message": "Purchase Requisitions changed while the batch was applied, please retry"}, status=status.HTTP_409_CONFLICT)
+    
+    succeeded = sum(result['success'] for result in results)
+    
+    return Response({"succeeded": succeeded, "failed": len(results) - succeeded, "results": results})
+    
 @api_view(['POST'])
 @auth_handler
 def approve_purchase_requisition(request, user: User, purchase_requisition_id):
@@ -756,12 +983,12 @@ def approve_purchase_requisition(request, user: User, purchase_requisition_id):
     except PurchaseRequisition.DoesNotExist:
         return Response({"message": "Purchase Requisition not found"}, status=status.HTTP_404_NOT_FOUND)
     
-    if purchase_requisition.status != 'WAITING_TO_APPROVAL':
-        return Response({"message": "Purchase Requisition is not waiting to approval"}, status=status.HTTP_400_BAD_REQUEST)
-    
-    purchase_requisition.is_approved = True
-    purchase_requisition.status = 'IN_PROGRESS'
-    purchase_requisition.save()
+    try:
+        transition(purchase_requisition, APPROVE, user)
+    except InvalidTransition as error:
+        return Response({"message": error.message}, status=status.HTTP_400_BAD_REQUEST)
+    except TransitionConflict:
+        return Response({"message": "Purchase Requisition was changed by another request, please retry"}, status=status.HTTP_409_CONFLICT)
     
     return Response({"message": "Successfully approved purchase requisition"})
 
@@ -779,11 +1006,12 @@ def reject_purchase_requisition(request, user: User, purchase_requisition_id):
     except PurchaseRequisition.DoesNotExist:
         return Response({"message": "Purchase Requisition not found"}, status=status.HTTP_404_NOT_FOUND)
     
-    purchase_requisition.is_rejected = True
-    purchase_requisition.is_approved = False
-    purchase_requisition.status = 'CANCELLED'
-    purchase_requisition.rejected_comment = data["comment"]
-    purchase_requisition.save()
+    try:
+        transition(purchase_requisition, REJECT, user, comment=data["comment"])
+    except InvalidTransition as error:
+        return Response({"message": error.message}, status=status.HTTP_400_BAD_REQUEST)
+    except TransitionConflict:
+        return Response({"message": "Purchase Requisition was changed by another request, please retry"}, status=status.HTTP_409_CONFLICT)
     
     return Response({"message": "Successfully rejected purchase requisition"})
     
@@ -0,0 +1,272 @@
+from collections import defaultdict
+from itertools import product
+
+from django.db import transaction
+from django.db.models import Case, TextField, Value, When
+from django.utils import timezone
+
+from .models import PurchaseRequisition, PurchaseRequisitionTransition
+from .budget import charge, BudgetExceeded
+from .analytics import record_spend
+from .events import publish_status
+
+
+STATUSES = [value for value, _ in PurchaseRequisition.status_choices]
+
+# Statuses a requisition can no longer leave
+CLOSED_STATUSES = ('COMPLETED', 'CANCELLED')
+
+# Statuses a requisition must be approved to reach
+APPROVED_STATUSES = ('TO_DO', 'IN_PROGRESS', 'COMPLETED')
+
+# Actions besides set-status; a set-status action is named by the status it sets
+APPROVE = 'approve'
+REJECT = 'reject'
+
+ACTIONS = [APPROVE, REJECT] + STATUSES
+
+# Completions are refused while a line cannot be priced, which would under-charge the budget
+UNPRICED_MESSAGE = 'Purchase Requisition has products without a price from their vendor'
+
+
+class InvalidTransition(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class TransitionConflict(Exception):
+    pass
+
+
+class Transition:
+    # One entry of the transition table: where `action` takes a requisition
+    # in `source` status and approval state, and the fields it writes
+
+    def __init__(self, action, source, is_approved, target, values=None):
+        self.action = action
+        self.source = source
+        self.is_approved = is_approved
+        self.target = target
+        self.values = dict(values or {}, status=target)
+        # Completions are charged to the project when applied, the one guard that needs the database
+        self.charges_budget = target == 'COMPLETED'
+
+    def __repr__(self):
+        return f'<Transition {self.action}: {self.source} -> {self.target}>'
+
+
+def rule(status, is_approved, action):
+    """Return the Transition ``action`` makes from a state, or the message it is refused with."""
+    if action == APPROVE:
+        if status != 'WAITING_TO_APPROVAL':
+            return 'Purchase Requisition is not waiting to approval'
+
+        return Transition(action, status, is_approved, 'IN_PROGRESS', {'is_approved': True})
+
+    if status in CLOSED_STATUSES:
+        return 'Purchase Requisition is already completed or cancelled'
+
+    if action == REJECT:
+        return Transition(action, status, is_approved, 'CANCELLED', {'is_rejected': True, 'is_approved': False})
+
+    if not is_approved and action in APPROVED_STATUSES:
+        return 'Purchase Requisition is not approved yet'
+
+    if is_approved and action == 'WAITING_TO_APPROVAL':
+        return 'Purchase Requisition is already approved'
+
+    return Transition(action, status, is_approved, action)
+
+
+# Every (status, is_approved, action), compiled once: a Transition or the refusal message
+TRANSITIONS = {
+    (status, is_approved, action): rule(status, is_approved, action)
+    for status, is_approved, action in product(STATUSES, (False, True), ACTIONS)
+}
+
+
+class Change:
+    # A checked transition of one requisition, waiting to be applied
+
+    def __init__(self, purchase_requisition, transition, comment=None):
+        self.purchase_requisition = purchase_requisition
+        self.transition = transition
+        self.comment = comment
+        # Set by apply_transitions: the total a completion is charged, and the error a refused change failed with
+        self.total = None
+        self.refusal = None
+
+
+def check(purchase_requisition, action):
+    """Look up the Transition ``action`` makes from the requisition's current state; raises InvalidTransition."""
+    entry = TRANSITIONS.get((purchase_requisition.status, purchase_requisition.is_approved, action))
+
+    if entry is None:
+        raise InvalidTransition(f'"{action}" is not a valid choice.')
+
+    if isinstance(entry, str):
+        raise InvalidTransition(entry)
+
+    return entry
+
+
+def transition(purchase_requisition, action, user=None, comment=None):
+    """Check and apply one transition; raises InvalidTransition, BudgetExceeded or TransitionConflict.
+
+    A completion of a requisition with unpriced lines raises InvalidTransition.
+    """
+    change = Change(purchase_requisition, check(purchase_requisition, action), comment)
+
+    with transaction.atomic():
+        if apply_transitions([change], user):
+            # Roll the claim back along with everything else
+            raise change.refusal
+
+    return purchase_requisition
+
+
+def apply_transitions(changes, user=None):
+    """Apply checked changes in one transaction; returns the changes left out.
+
+    Each group making the same transition is claimed with one UPDATE ...
+    WHERE status = <source>, so a requisition another request moved since it
+    was checked is never overwritten: the whole call is rolled back with
+    TransitionConflict instead. Requisitions are claimed before any project
+    is charged, the order every transition locks rows in. Completions are
+    then priced in one query and charged to each project in one conditional
+    UPDATE; when a project cannot cover them together they are charged one
+    by one, in order. A completion with unpriced lines or one that does not
+    fit goes back to its source status and is returned with its ``refusal``
+    set, InvalidTransition or BudgetExceeded. The changes are written to the
+    audit table in one INSERT, closed requisitions added to the spend rollups
+    and status events published once the transaction commits.
+    """
+    with transaction.atomic():
+        update(changes)
+
+        completions = [change for change in changes if change.transition.charges_budget]
+        refused = price_completions(completions)
+        refused += charge_completions([change for change in completions if change not in refused])
+
+        if refused:
+            revert(refused)
+            changes = [change for change in changes if change not in refused]
+
+        PurchaseRequisitionTransition.objects.bulk_create([
+            PurchaseRequisitionTransition(
+                purchase_requisition_id=change.purchase_requisition.pk,
+                user=user,
+                action=change.transition.action,
+                from_status=change.transition.source,
+                to_status=change.transition.target,
+                comment=change.comment,
+            )
+            for change in changes
+        ])
+
+        closed = [change.purchase_requisition.pk for change in changes if change.transition.target in CLOSED_STATUSES]
+
+        if closed:
+            record_spend(*closed)
+
+        for change in changes:
+            publish_status(change.purchase_requisition)
+
+    return refused
+
+
+def price_completions(completions):
+    # Load the totals of the completions in one query; returns, refused, the ones with unpriced lines
+    if not completions:
+        return []
+
+    rows = PurchaseRequisition.objects.with_totals().with_unpriced_lines().filter(
+        pk__in=[change.purchase_requisition.pk for change in completions]
+    ).values_list('pk', 'total_price', 'unpriced_lines')
+    prices = {pk: (total, unpriced_lines) for pk, total, unpriced_lines in rows}
+    unpriced = []
+
+    for change in completions:
+        change.total, unpriced_lines = prices.get(change.purchase_requisition.pk, (0.0, 0))
+
+        if unpriced_lines:
+            change.refusal = InvalidTransition(UNPRICED_MESSAGE)
+            unpriced.append(change)
+
+    return unpriced
+
+
+def charge_completions(completions):
+    # Returns the completions their project could not cover
+    if not completions:
+        return []
+
+    projects = defaultdict(list)
+    over_budget = []
+
+    for change in completions:
+        projects[change.purchase_requisition.project_id].append(change)
+
+    for project_id in sorted(projects, key=str):
+        project_completions = projects[project_id]
+
+        if charge(project_id, sum(change.total for change in project_completions), len(project_completions)):
+            continue
+
+        for change in project_completions:
+            if not charge(project_id, change.total):
+                change.refusal = BudgetExceeded()
+                over_budget.append(change)
+
+    return over_budget
+
+
+def update(changes):
+    # One conditional UPDATE per transition; every row must still be in the state it was checked in
+    now = timezone.now()
+    groups = defaultdict(list)
+
+    for change in changes:
+        groups[change.transition].append(change)
+
+    for transition, group in groups.items():
+        values = dict(transition.values)
+
+        if transition.action == REJECT:
+            values['rejected_comment'] = Case(
+                *[When(pk=change.purchase_requisition.pk, then=Value(change.comment)) for change in group],
+                output_field=TextField()
+            )
+
+        updated = PurchaseRequisition.objects.filter(
+            pk__in=[change.purchase_requisition.pk for change in group],
+            status=transition.source,
+            is_approved=transition.is_approved,
+        ).update(updated_at=now, **values)
+
+        if updated != len(group):
+            raise TransitionConflict()
+
+        for change in group:
+            for name, value in transition.values.items():
+                setattr(change.purchase_requisition, name, value)
+
+            if transition.action == REJECT:
+                change.purchase_requisition.rejected_comment = change.comment
+
+            change.purchase_requisition.updated_at = now
+
+
+def revert(changes):
+    # Unclaim completions their project could not cover; they were claimed in this transaction, so nobody else saw them
+    sources = defaultdict(list)
+
+    for change in changes:
+        sources[change.transition.source].append(change.purchase_requisition)
+
+    for source, purchase_requisitions in sources.items():
+        PurchaseRequisition.objects.filter(pk__in=[purchase_requisition.pk for purchase_requisition in purchase_requisitions]).update(status=source)
+
+        for purchase_requisition in purchase_requisitions:
+            purchase_requisition.status = source
@@ -0,0 +1,66 @@
+"""
+Compare the sync and async views of the hot GET endpoints at high concurrency.
+
+Runs `python -m core.server` with a single worker process in three setups and
+drives each one with the same load:
+
+    wsgi-sync   gthread worker, sync views (WEB_THREADS threads)
+    asgi-sync   uvicorn worker, sync views (run one at a time on Django's sync thread)
+    asgi-async  uvicorn worker, async views (ASYNC_VIEWS=1)
+
+    python benchmarks/async_views.py --requests 2000 --concurrency 128
+
+The async views only pay off when requests spend their time waiting, so run
+it with --postgres against a database on another host to see the difference.
+"""
+
+import argparse
+import subprocess
+import sys
+
+from common import BACKEND_DIR, add_database_arguments, configure_environment, seed, free_port, wait_for_port, run_load, print_table
+
+MODES = {
+    'wsgi-sync': {'SERVER_MODE': 'wsgi', 'ASYNC_VIEWS': 'false'},
+    'asgi-sync': {'SERVER_MODE': 'asgi', 'ASYNC_VIEWS': 'false'},
+    'asgi-async': {'SERVER_MODE': 'asgi', 'ASYNC_VIEWS': 'true'},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=128)
+    parser.add_argument('--path', default='/api/product?size=20', help='Endpoint to load')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    environment = configure_environment(args)
+    token = seed(args.products)
+
+    rows = []
+
+    for mode in args.modes:
+        port = free_port()
+        env = dict(environment, PORT=str(port), WEB_CONCURRENCY='1', WEB_THREADS='8', **MODES[mode])
+
+        process = subprocess.Popen([sys.executable, '-m', 'core.server'], cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        try:
+            wait_for_port(port)
+            url = f'http://localhost:{port}{args.path}'
+
+            # Warm up the principal cache and lazily imported modules
+            run_load(url, token, requests=args.concurrency, concurrency=args.concurrency)
+
+            rows.append((mode, run_load(url, token, args.requests, args.concurrency)))
+        finally:
+            process.terminate()
+            process.wait()
+
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Shared helpers for the backend benchmarks.
+
+The benchmarks run against a throwaway SQLite database by default, seeded with
+one legal entity and a catalog. Pass --postgres to use the database configured
+in the environment (DB_NAME, DB_USER, ...) instead; it is seeded the same way.
+"""
+
+import datetime
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_database_arguments(parser):
+    parser.add_argument('--postgres', action='store_true', help='Use the PostgreSQL database from the environment')
+    parser.add_argument('--products', type=int, default=150, help='Number of products to seed')
+
+
+def configure_environment(args):
+    """Point Django at the benchmark database; returns the environment for child processes."""
+    sys.path.insert(0, BACKEND_DIR)
+
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('ALGORITHM', 'HS256')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+    if not args.postgres:
+        os.environ['DB_ENGINE'] = 'django.db.backends.sqlite3'
+        os.environ['DB_NAME'] = os.path.join(tempfile.mkdtemp(prefix='luna-bench-'), 'db.sqlite3')
+
+    return dict(os.environ)
+
+
+def seed(products=150):
+    """Migrate and seed the benchmark database; returns a bearer token for the seeded manager."""
+    import django
+    django.setup()
+
+    import jwt
+    from django.core.management import call_command
+    from core.settings import SECRET_KEY, ALGORITHM
+    from api.models import User, LegalEntity, Role, Product, Vendor, Price
+
+    call_command('migrate', verbosity=0)
+
+    legal_entity, _ = LegalEntity.objects.get_or_create(legal_entity_code='BENCH', defaults={'business_num': 'Benchmark'})
+
+    for role in ['ADMINISTRATOR', 'MANAGER', 'MEMBER', 'VIEWER', 'SUPERVISOR']:
+        Role.objects.get_or_create(role=role, legal_entity=legal_entity)
+
+    user, _ = User.objects.get_or_create(
+        email='bench@luna.com',
+        defaults={
+            'username': 'bench',
+            'password': 'bench',
+            'legal_entity': legal_entity,
+            'role': legal_entity.roles.get(role='MANAGER')
+        }
+    )
+
+    vendors = [
+        Vendor.objects.get_or_create(code=f'BENCH-VND-{i}', defaults={'name': f'Vendor {i}', 'business_num': str(i), 'legal_entity': legal_entity})[0]
+        for i in range(5)
+    ]
+
+    for i in range(products):
+        product, created = Product.objects.get_or_create(
+            code=f'BENCH-PRD-{i}',
+            defaults={
+                'name': f'Product {i}', 'description': 'Benchmark product', 'SKU': str(i), 'brand': 'Brand',
+                'category': 'Category', 'weight': '1', 'width': '1', 'height': '1', 'length': '1',
+                'color': 'Black', 'material': 'Steel', 'legal_entity': legal_entity
+            }
+        )
+
+        if created:
+            Price.objects.bulk_create([Price(product=product, vendor=vendor, price=i + 1) for vendor in vendors])
+
+    payload = {
+        'email': user.email,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=2),
+        'iat': datetime.datetime.utcnow()
+    }
+
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('localhost', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+
+    raise RuntimeError(f'Server on port {port} did not start within {timeout}s')
+
+
+def run_load(url, token, requests=500, concurrency=16):
+    """Fire `requests` GETs at `url` from `concurrency` threads; returns a stats dict."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def fetch(_):
+        nonlocal errors
+        request = urllib.request.Request(url, headers={'Authorization': f'Bearer {token}'})
+        started = time.perf_counter()
+
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+        except Exception:
+            with lock:
+                errors += 1
+            return
+
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(fetch, range(requests)))
+
+    elapsed = time.perf_counter() - started
+
+    return summarize(latencies, elapsed, errors)
+
+
+def summarize(latencies, elapsed, errors=0):
+    latencies = sorted(latencies) or [0.0]
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': statistics.median(latencies) * 1000,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000 if len(latencies) > 1 else latencies[0] * 1000,
+    }
+
+
+def print_table(rows):
+    print(f"{'mode':<24}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+
+    for name, stats in rows:
+        print(f"{name:<24}{stats['throughput']:>10.1f}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['errors']:>8}")
@@ -0,0 +1,64 @@
+"""
+Measure per-request latency with and without persistent database connections.
+
+Runs the WSGI server twice, with DB_CONN_MAX_AGE=0 (a new connection per
+request) and with DB_CONN_MAX_AGE=60 (one connection per worker thread), and
+prints latency plus the connection counters from /api/metrics/db. The
+difference only shows against a real server, so use --postgres:
+
+    DB_NAME=... DB_USER=... DB_PASSWORD=... DB_HOST=... python benchmarks/db_connections.py --postgres
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import urllib.request
+
+from common import BACKEND_DIR, add_database_arguments, configure_environment, seed, free_port, wait_for_port, run_load, print_table
+
+
+def fetch_metrics(port, token):
+    request = urllib.request.Request(f'http://localhost:{port}/api/metrics/db', headers={'Authorization': f'Bearer {token}'})
+
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--path', default='/api/project', help='Endpoint to load')
+    args = parser.parse_args()
+
+    environment = configure_environment(args)
+    token = seed(args.products)
+
+    rows = []
+
+    for max_age in ('0', '60'):
+        port = free_port()
+        # A single worker process, so the metrics endpoint sees every request
+        env = dict(environment, PORT=str(port), SERVER_MODE='wsgi', WEB_CONCURRENCY='1', WEB_THREADS=str(args.concurrency), DB_CONN_MAX_AGE=max_age)
+
+        process = subprocess.Popen([sys.executable, '-m', 'core.server'], cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        try:
+            wait_for_port(port)
+            url = f'http://localhost:{port}{args.path}'
+
+            run_load(url, token, requests=args.concurrency, concurrency=args.concurrency)
+            rows.append((f'CONN_MAX_AGE={max_age}', run_load(url, token, args.requests, args.concurrency)))
+
+            print(f'CONN_MAX_AGE={max_age}: {fetch_metrics(port, token)}')
+        finally:
+            process.terminate()
+            process.wait()
+
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare REST framework's JSONRenderer with the orjson-backed ORJSONRenderer.
+
+Serializes a page of 150 products (with providedVendorInfo) and a page of
+150 requisitions (with their products) once, then times rendering each
+payload with both renderers:
+
+    python benchmarks/renderers.py --repeat 200
+"""
+
+import argparse
+import datetime
+import json
+import time
+
+from common import add_database_arguments, configure_environment, seed
+
+
+def seed_purchase_requisitions(count):
+    from api.models import LegalEntity, Price, Project, PurchaseRequisition, ProductPurchaseRequisition
+
+    legal_entity = LegalEntity.objects.get(legal_entity_code='BENCH')
+    project, _ = Project.objects.get_or_create(code='BENCH-PRJ', defaults={'name': 'Benchmark', 'label': 'Benchmark', 'purchase_allowance': 10 ** 9, 'legal_entity': legal_entity})
+    prices = list(Price.objects.filter(product__legal_entity=legal_entity).order_by('product__code', 'vendor__code')[:20])
+
+    for i in range(legal_entity.purchase_requisitions.count(), count):
+        purchase_requisition = PurchaseRequisition.objects.create(
+            name=f'Requisition {i}', priority='LOW', project=project, requester=legal_entity.users.first(),
+            legal_entity=legal_entity, target_date=datetime.date(2023, 10, 1), due_date=datetime.date(2023, 10, 31)
+        )
+
+        lines = {price.product_id: price for price in prices[i % 10:i % 10 + 10]}
+
+        ProductPurchaseRequisition.objects.bulk_create([
+            ProductPurchaseRequisition(product_id=price.product_id, vendor_id=price.vendor_id, quantity=i + 1, purchase_requisition=purchase_requisition)
+            for price in lines.values()
+        ])
+
+
+def payloads():
+    from django.db.models import Prefetch
+    from api.models import LegalEntity, Price
+    from api.serializers import ProductSerializer, PurchaseRequisitionSerializer
+
+    legal_entity = LegalEntity.objects.get(legal_entity_code='BENCH')
+    products = legal_entity.products.order_by('id').prefetch_related(Prefetch('prices', queryset=Price.objects.select_related('vendor')))[:150]
+    purchase_requisitions = legal_entity.purchase_requisitions.order_by('id').with_details()[:150]
+
+    return {
+        'products': {'data': ProductSerializer(products, many=True).data},
+        'purchase requisitions': {'data': PurchaseRequisitionSerializer(purchase_requisitions, many=True).data},
+    }
+
+
+def timed(render, data, repeat):
+    started = time.perf_counter()
+
+    for _ in range(repeat):
+        render(data)
+
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    configure_environment(args)
+    seed(args.products)
+    seed_purchase_requisitions(150)
+
+    from rest_framework.renderers import JSONRenderer
+    from api.renderers import ORJSONRenderer
+
+    print(f"{'payload':<24}{'bytes':>10}{'json ms':>10}{'orjson ms':>11}{'speedup':>9}")
+
+    for name, data in payloads().items():
+        expected = JSONRenderer().render(data)
+        # Floats may differ in exponent notation, not in value
+        assert json.loads(ORJSONRenderer().render(data)) == json.loads(expected), f'{name}: renderers disagree'
+
+        baseline = timed(JSONRenderer().render, data, args.repeat)
+        fast = timed(ORJSONRenderer().render, data, args.repeat)
+
+        print(f'{name:<24}{len(expected):>10}{baseline:>10.2f}{fast:>11.2f}{baseline / fast:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare the development server with the production server modes.
+
+Starts `manage.py runserver`, then `python -m core.server` in WSGI and ASGI
+mode, and drives each one with the same concurrent load:
+
+    python benchmarks/serve.py --requests 1000 --concurrency 32
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+from common import BACKEND_DIR, add_database_arguments, configure_environment, seed, free_port, wait_for_port, run_load, print_table
+
+MODES = {
+    'runserver': lambda port: [sys.executable, 'manage.py', 'runserver', '--noreload', f'localhost:{port}'],
+    'gunicorn-wsgi': lambda port: [sys.executable, '-m', 'core.server'],
+    'gunicorn-asgi': lambda port: [sys.executable, '-m', 'core.server'],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--path', default='/api/product?size=50', help='Endpoint to load')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    environment = configure_environment(args)
+    token = seed(args.products)
+
+    rows = []
+
+    for mode in args.modes:
+        port = free_port()
+        env = dict(environment, PORT=str(port), SERVER_MODE='asgi' if mode.endswith('asgi') else 'wsgi')
+        env.setdefault('WEB_CONCURRENCY', str(os.cpu_count() * 2 + 1))
+
+        process = subprocess.Popen(MODES[mode](port), cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        try:
+            wait_for_port(port)
+            url = f'http://localhost:{port}{args.path}'
+
+            # Warm up connections, caches and lazily imported modules
+            run_load(url, token, requests=args.concurrency, concurrency=args.concurrency)
+
+            rows.append((mode, run_load(url, token, args.requests, args.concurrency)))
+        finally:
+            process.terminate()
+            process.wait()
+
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Production server entry point for the core project.
+
+Runs the project under gunicorn, either as a WSGI app (``core.wsgi``, sync
+threaded workers) or as an ASGI app (``core.asgi``, uvicorn workers):
+
+    python -m core.server            # SERVER_MODE=wsgi by default
+    SERVER_MODE=asgi python -m core.server
+
+The application is preloaded in the master process before forking, so
+workers start instantly and share its memory. Send SIGHUP to the master for
+a graceful reload: new workers are started with the new code and old ones
+finish their in-flight requests first. Migrations are not run here; apply
+them once per deploy with ``python manage.py migrate``.
+
+Every setting is read from the environment:
+
+    SERVER_MODE        wsgi or asgi (default wsgi)
+    PORT               port to bind on 0.0.0.0 (default 8080)
+    WEB_CONCURRENCY    worker processes (default 2 * CPUs + 1)
+    WEB_THREADS        threads per sync worker (default 4, wsgi only)
+    WEB_TIMEOUT        seconds before a silent worker is restarted (default 30)
+    WEB_GRACEFUL_TIMEOUT  seconds workers get to finish on reload/stop (default 30)
+    WEB_MAX_REQUESTS   recycle a worker after this many requests, 0 disables (default 1000)
+    WEB_RELOAD         restart workers on code changes, for development (default false)
+"""
+
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+def get_options():
+    mode = os.environ.get('SERVER_MODE', 'wsgi').lower()
+
+    if mode not in ('wsgi', 'asgi'):
+        raise ValueError(f'Unknown SERVER_MODE {mode!r}, expected wsgi or asgi')
+
+    options = {
+        'bind': f"0.0.0.0:{os.environ.get('PORT', '8080')}",
+        'workers': int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)),
+        'timeout': int(os.environ.get('WEB_TIMEOUT', 30)),
+        'graceful_timeout': int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30)),
+        'max_requests': int(os.environ.get('WEB_MAX_REQUESTS', 1000)),
+        'max_requests_jitter': int(os.environ.get('WEB_MAX_REQUESTS', 1000)) // 10,
+        'reload': os.environ.get('WEB_RELOAD', 'false').lower() in ('1', 'true', 'yes'),
+        'accesslog': '-',
+        'errorlog': '-',
+    }
+
+    # Preloading and code reloading are mutually exclusive
+    options['preload_app'] = not options['reload']
+
+    if mode == 'asgi':
+        options['worker_class'] = 'uvicorn.workers.UvicornWorker'
+    else:
+        options['worker_class'] = 'gthread'
+        options['threads'] = int(os.environ.get('WEB_THREADS', 4))
+
+    return mode, options
+
+
+class Server(BaseApplication):
+    def __init__(self, mode, options):
+        self.mode = mode
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+        if self.mode == 'asgi':
+            from core.asgi import application
+        else:
+            from core.wsgi import application
+
+        return application
+
+
+def main():
+    mode, options = get_options()
+    Server(mode, options).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,9 @@ import environ
 env = environ.Env()
 environ.Env().read_env()
 
+# How core.server serves the project, wsgi or asgi
+SERVER_MODE = env("SERVER_MODE", default="wsgi").lower()
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -29,6 +32,13 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = env("SECRET_KEY")
 ALGORITHM = env("ALGORITHM")
 
+# Per-process cache of authenticated principals used by api.action.auth_handler. Signals
+# invalidate it only in the process that made the change: other workers can keep
+# authorizing a changed or removed member for up to AUTH_PRINCIPAL_CACHE_TTL seconds
+# (a TTL or size of 0 disables the cache)
+AUTH_PRINCIPAL_CACHE_SIZE = env.int("AUTH_PRINCIPAL_CACHE_SIZE", default=1024)
+AUTH_PRINCIPAL_CACHE_TTL = env.int("AUTH_PRINCIPAL_CACHE_TTL", default=60)
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
@@ -52,6 +62,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +72,55 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+REST_FRAMEWORK = {
+    # orjson-backed drop-ins for the default JSON renderer and parser
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Cache backend shared by the pagination totals and the tenant cache; local memory by
+# default, any django-environ cache URL otherwise (e.g. redis://redis:6379/0)
+CACHES = {
+    'default': env.cache("CACHE_URL", default="locmemcache://"),
+}
+
+# Rendered org tree and role table of each legal entity (api.tenant_cache). The cache needs
+# a backend every worker shares; on a local memory backend it is bypassed, as workers would
+# miss each other's invalidations, unless TENANT_CACHE_ALLOW_LOCAL is set for a single process
+TENANT_CACHE_ALIAS = env("TENANT_CACHE_ALIAS", default="default")
+TENANT_CACHE_TIMEOUT = env.int("TENANT_CACHE_TIMEOUT", default=300)
+TENANT_CACHE_ALLOW_LOCAL = env.bool("TENANT_CACHE_ALLOW_LOCAL", default=False)
+
+# Price matrices (api.pricing) are cached through the same backend, for legal entities with
+# at most this many prices; larger ones are priced per render, one query for the lines shown
+PRICE_MATRIX_MAX_SIZE = env.int("PRICE_MATRIX_MAX_SIZE", default=20000)
+
+# Route the hot GET endpoints to the async views in api.async_views. On by default when
+# serving ASGI (core.server with SERVER_MODE=asgi); under WSGI every async view would
+# need its own event loop per request
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=SERVER_MODE == "asgi")
+
+# Server-Sent Events streams of requisition changes (api.events, served by the async views).
+# "local" delivers within one worker process; "postgres" fans out to every worker through
+# LISTEN/NOTIFY. Streams end after EVENTS_STREAM_TIMEOUT seconds and the browser reconnects
+EVENTS_BACKEND = env("EVENTS_BACKEND", default="local")
+EVENTS_QUEUE_SIZE = env.int("EVENTS_QUEUE_SIZE", default=100)
+EVENTS_KEEPALIVE = env.int("EVENTS_KEEPALIVE", default=15)
+EVENTS_STREAM_TIMEOUT = env.int("EVENTS_STREAM_TIMEOUT", default=300)
+
+# Per-request query instrumentation (api.middleware.QueryInstrumentationMiddleware).
+# Aggregates are written to the database every QUERY_STATS_FLUSH_INTERVAL seconds by a
+# background thread of each worker process; 0 keeps them in memory only
+QUERY_INSTRUMENTATION = env.bool("QUERY_INSTRUMENTATION", default=True)
+QUERY_STATS_FLUSH_INTERVAL = env.int("QUERY_STATS_FLUSH_INTERVAL", default=30)
+
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
@@ -92,14 +152,28 @@ CSRF_TRUSTED_ORIGINS = [
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# DB_ENGINE can be set to django.db.backends.sqlite3 (with DB_NAME as the file path)
+# to run the test suite locally without PostgreSQL
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': env("DB_ENGINE", default='django.db.backends.postgresql_psycopg2'),
         'NAME': env("DB_NAME"),
-        'USER': env("DB_USER"),
-        'PASSWORD': env("DB_PASSWORD"),
-        'HOST': env("DB_HOST"),
-        'PORT': env("DB_PORT")
+        'USER': env("DB_USER", default=''),
+        'PASSWORD': env("DB_PASSWORD", default=''),
+        'HOST': env("DB_HOST", default=''),
+        'PORT': env("DB_PORT", default=''),
+        # Keep each worker thread's connection open for this many seconds instead of
+        # reconnecting on every request (0 closes it after every request). Always 0 under
+        # ASGI: Django runs each request's database work on a thread of its own there, so
+        # a kept connection is never reused and only stays open; reuse connections through
+        # a pooler such as pgbouncer instead
+        'CONN_MAX_AGE': 0 if SERVER_MODE == "asgi" else env.int("DB_CONN_MAX_AGE", default=60),
+        # Ping reused connections before a request so a dropped one is replaced, not failed
+        'CONN_HEALTH_CHECKS': env.bool("DB_CONN_HEALTH_CHECKS", default=True),
+        # SQLite test databases live in memory unless named; the concurrency tests need a file
+        'TEST': {
+            'NAME': env("DB_TEST_NAME", default=None),
+        },
     }
 }
 
@@ -147,6 +221,15 @@ STATIC_FILES_DIRS = (
     os.path.join(BASE_DIR, 'static'),
 )
 
+# Largest product or vendor image accepted by the multipart upload endpoints, in bytes
+IMAGE_UPLOAD_MAX_SIZE = env.int("IMAGE_UPLOAD_MAX_SIZE", default=5 * 1024 * 1024)
+
+# Product and vendor thumbnails (see api.thumbnails), rendered by a background thread pool
+THUMBNAIL_FORMAT = env("THUMBNAIL_FORMAT", default='WEBP')
+THUMBNAIL_QUALITY = env.int("THUMBNAIL_QUALITY", default=80)
+THUMBNAIL_BACKGROUND = env.bool("THUMBNAIL_BACKGROUND", default=True)
+THUMBNAIL_WORKERS = env.int("THUMBNAIL_WORKERS", default=2)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 